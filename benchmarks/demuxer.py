@@ -0,0 +1,129 @@
+# -*- coding: UTF-8 -*-
+"""Measures how fast a Demuxer reads the output of a session without a TTY.
+
+Without a TTY (i.e. ``ssh host 'make'``, or scp) Docker wraps every write the
+command makes in an 8-byte header. This benchmark sends a stream of frames, of
+a fixed payload size, over a socketpair and times demuxing all of it.
+
+For comparison, the same stream is demuxed with the previous Demuxer, which
+read the header and payload with separate reads, and returned one frame per
+call.
+
+Usage:
+
+    python benchmarks/demuxer.py [--frames 16,256,4096] [--total 32] [--read-size 4096] [--no-legacy]
+"""
+import os
+import sys
+import time
+import struct
+import socket
+import argparse
+import threading
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from container_shell.lib.dockerpty import io #pylint: disable=C0413
+
+MIB = 1024 * 1024
+
+
+class LegacyDemuxer(io.Demuxer):
+    """The previous demuxing; a read for the header, a read for the payload, one frame per call"""
+    def read(self, n=4096):
+        size = self._next_packet_size(n)
+        if size <= 0:
+            return None
+        data = b''
+        while len(data) < size:
+            nxt = self.stream.read(size - len(data))
+            if not nxt:
+                return data
+            data = data + nxt
+        return data
+
+    def _next_packet_size(self, n=0):
+        if self.remain > 0:
+            size = min(n, self.remain)
+            self.remain -= size
+            return size
+        data = b''
+        while len(data) < 8:
+            nxt = self.stream.read(8 - len(data))
+            if not nxt:
+                return 0
+            data = data + nxt
+        __, actual = struct.unpack('>BxxxL', data)
+        size = min(n, actual)
+        self.remain = actual - size
+        return size
+
+
+def demux(demuxer_cls, frame_size, total, read_size):
+    """Time demuxing ``total`` bytes of payload, sent as frames of ``frame_size``.
+
+    :Returns: Tuple (MiB of payload per second, read calls per MiB)
+
+    :param demuxer_cls: The kind of Demuxer to measure.
+    :type demuxer_cls: Class
+
+    :param frame_size: The size of each frame's payload.
+    :type frame_size: Integer
+
+    :param total: How many bytes of payload to send.
+    :type total: Integer
+
+    :param read_size: How many bytes to ask for with each read.
+    :type read_size: Integer
+    """
+    frame = struct.pack('>BxxxL', 1, frame_size) + os.urandom(frame_size)
+    count = total // frame_size
+    blob = frame * count
+    writer, reader = socket.socketpair()
+    sender = threading.Thread(target=writer.sendall, args=(blob,), daemon=True)
+    demuxer = demuxer_cls(io.Stream(reader))
+    received = 0
+    reads = 0
+    try:
+        start = time.perf_counter()
+        sender.start()
+        while received < count * frame_size:
+            received += len(demuxer.read(read_size))
+            reads += 1
+        elapsed = time.perf_counter() - start
+        sender.join()
+    finally:
+        writer.close()
+        reader.close()
+    mib = received / MIB
+    return mib / elapsed, reads / mib
+
+
+def main(cli_args=sys.argv[1:]): #pylint: disable=W0102
+    """Entry point logic"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--frames', default='16,256,4096',
+                        help='Comma-separated frame payload sizes, in bytes')
+    parser.add_argument('--total', type=int, default=32,
+                        help='MiB of payload to send for each frame size')
+    parser.add_argument('--read-size', type=int, default=4096,
+                        help='Bytes asked for with each read, like a Pump')
+    parser.add_argument('--no-legacy', action='store_true',
+                        help="Don't measure the previous Demuxer")
+    args = parser.parse_args(cli_args)
+
+    print('{:>8} {:>15} {:>13} {:>15} {:>13}'.format('frame B', 'Demuxer MiB/s', 'calls/MiB',
+                                                     'legacy MiB/s', 'calls/MiB'))
+    for size in [int(x) for x in args.frames.split(',')]:
+        rate, reads = demux(io.Demuxer, size, args.total * MIB, args.read_size)
+        if args.no_legacy:
+            legacy = ('-', '-')
+        else:
+            legacy = ['{:.0f}'.format(x) for x in demux(LegacyDemuxer, size, args.total * MIB, args.read_size)]
+        print('{:>8} {:>15.1f} {:>13.0f} {:>15} {:>13}'.format(size, rate, reads, *legacy))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
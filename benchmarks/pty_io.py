@@ -0,0 +1,393 @@
+# -*- coding: UTF-8 -*-
+"""Measures the throughput and latency of dockerpty.io, and compares it against a baseline.
+
+The real Stream, Demuxer and Pump classes move data over socketpairs and pipes
+that stand in for the Docker socket, and the SSH session. They're driven by an
+``io.Selector`` loop that updates interest the same way the PTY loop does.
+
+Scenarios:
+
+  tty          A TTY session streaming output (i.e. ``cat`` of a large file).
+  tty-splice   The same, with a SplicePump; only if os.splice is available.
+  demux-N      A session without a TTY; the output is in frames of N bytes.
+  backlog      A TTY session whose reader is slow, and takes 4 KiB at a time.
+  echo         Single keystrokes, echoed back by the container.
+
+For each scenario, the report has:
+
+  MiB/s        Throughput.
+  calls/MiB    System calls made by dockerpty.io per MiB moved; reads, writes,
+               splices and selects. For ``echo``, per keystroke instead.
+  peak KiB     The most memory allocated at once while moving the data,
+               measured in a second, shorter run with tracemalloc.
+  p50/p99 us   Keystroke round trip latency, for ``echo``.
+
+Results are compared against ``pty_io_baseline.json``; a metric that's worse
+by more than the tolerance fails the benchmark. Run with ``--update`` to
+store a new baseline. For comparisons against the implementations they
+replaced, see ``stream_backlog.py`` and ``demuxer.py``.
+
+Usage:
+
+    python benchmarks/pty_io.py [--scenarios tty,echo] [--scale 1.0] [--runs N] [--update] [--baseline FILE]
+"""
+import os
+import sys
+import json
+import time
+import socket
+import struct
+import argparse
+import threading
+import statistics
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from container_shell.lib.dockerpty import io, pty #pylint: disable=C0413
+
+MIB = 1024 * 1024
+BASELINE_LOCATION = os.path.join(HERE, 'pty_io_baseline.json')
+# How much worse than the baseline a metric can get before the benchmark fails.
+TOLERANCE = 0.3
+# Metrics where a bigger number is better; for the rest, smaller is better.
+HIGHER_IS_BETTER = ('mib_s',)
+# The tracemalloc run moves this fraction of the data, since tracing is slow.
+TRACED_FRACTION = 8
+
+
+class Syscalls:
+    """Counts the system calls dockerpty.io makes.
+
+    Sockets are wrapped with ``socket``, and while installed, the ``os``
+    functions dockerpty.io calls are counted too.
+    """
+    OS_CALLS = ('read', 'readv', 'write', 'writev', 'splice')
+    SOCKET_CALLS = ('recv', 'recv_into', 'send', 'sendmsg')
+
+    def __init__(self):
+        self.count = 0
+        self._os = None
+
+    def socket(self, sock):
+        """Wrap ``sock``, so the calls dockerpty.io makes on it are counted"""
+        return _CountingProxy(sock, self, Syscalls.SOCKET_CALLS)
+
+    def __enter__(self):
+        self._os = io.os
+        io.os = _CountingProxy(self._os, self, Syscalls.OS_CALLS)
+        return self
+
+    def __exit__(self, *args):
+        io.os = self._os
+
+
+class _CountingProxy:
+    """Passes everything through to ``target``, counting calls to ``names``"""
+    def __init__(self, target, counter, names):
+        self._target = target
+        self._counter = counter
+        self._names = names
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if name not in self._names:
+            return attr
+        counter = self._counter
+        def counted(*args, **kwargs):
+            counter.count += 1
+            return attr(*args, **kwargs)
+        return counted
+
+
+class CountingSelector(io.Selector):
+    """An io.Selector that counts calls to ``select``"""
+    def __init__(self, counter):
+        super().__init__()
+        self.counter = counter
+
+    def select(self, timeout=None):
+        self.counter.count += 1
+        return super().select(timeout)
+
+
+def drive(pumps, counter, done):
+    """Run the pumps until ``done`` returns True, like the PTY loop does.
+
+    :Returns: None
+
+    :param pumps: The pumps to run.
+    :type pumps: List
+
+    :param counter: Counts the calls to select.
+    :type counter: Syscalls
+
+    :param done: Says when to stop.
+    :type done: Callable
+    """
+    with CountingSelector(counter) as selector:
+        for pump in pumps:
+            selector.set_reading(pump)
+        while not done():
+            read_ready, write_ready = selector.select()
+            for stream in write_ready:
+                stream.do_write()
+                pty.PseudoTerminal._update_interest(selector, pumps, stream) #pylint: disable=W0212
+            for pump in read_ready:
+                pump.flush()
+                pty.PseudoTerminal._update_interest(selector, pumps, pump.to_stream) #pylint: disable=W0212
+
+
+def sink(fd, total, chunk=MIB):
+    """Read and discard ``total`` bytes from a file descriptor, ``chunk`` bytes at a time, without allocating"""
+    buf = bytearray(chunk)
+    received = 0
+    while received < total:
+        got = os.readv(fd, [buf])
+        if not got:
+            break
+        received += got
+
+
+def stream(total, pump_cls=io.Pump, frame=None, chunk=MIB):
+    """Move ``total`` bytes from a container socket to the SSH session, which is a pipe.
+
+    :Returns: Dictionary
+
+    :param total: How many bytes of output to move.
+    :type total: Integer
+
+    :param pump_cls: The kind of Pump to use.
+    :type pump_cls: Class
+
+    :param frame: The payload size of each frame, or None for a TTY session.
+    :type frame: Integer
+
+    :param chunk: How many bytes the SSH client reads at a time.
+    :type chunk: Integer
+    """
+    counter = Syscalls()
+    container, container_peer = socket.socketpair()
+    container.setblocking(False)
+    session_peer, session_fd = os.pipe()
+    os.set_blocking(session_fd, False)
+    session = open(session_fd, 'wb', buffering=0)
+    if frame:
+        blob = (struct.pack('>BxxxL', 1, frame) + os.urandom(frame)) * (total // frame)
+        total = total // frame * frame
+        from_stream = io.Demuxer(io.Stream(counter.socket(container)))
+    else:
+        blob = os.urandom(total)
+        from_stream = io.Stream(counter.socket(container))
+    pump = pump_cls(from_stream, io.Stream(session))
+    sender = threading.Thread(target=_send_and_close, args=(container_peer, blob), daemon=True)
+    receiver = threading.Thread(target=sink, args=(session_peer, total, chunk), daemon=True)
+    try:
+        with counter:
+            tracemalloc.reset_peak()
+            allocated = tracemalloc.get_traced_memory()[0]
+            start = time.perf_counter()
+            receiver.start()
+            sender.start()
+            drive([pump], counter, pump.is_done)
+            receiver.join()
+            elapsed = time.perf_counter() - start
+        sender.join()
+    finally:
+        for sock in (container, container_peer):
+            sock.close()
+        if not session.closed:
+            session.close()
+        os.close(session_peer)
+    mib = total / MIB
+    return {'mib_s' : round(mib / elapsed, 1),
+            'calls_mib' : round(counter.count / mib, 1),
+            'peak_kib' : round((tracemalloc.get_traced_memory()[1] - allocated) / 1024)}
+
+
+def _send_and_close(sock, blob):
+    sock.sendall(blob)
+    sock.shutdown(socket.SHUT_WR)
+
+
+def echo(keystrokes):
+    """Time single keystrokes, from the SSH client, through the container, and back.
+
+    :Returns: Dictionary
+
+    :param keystrokes: How many keystrokes to send.
+    :type keystrokes: Integer
+    """
+    counter = Syscalls()
+    stdin, client_in = socket.socketpair()
+    stdout, client_out = socket.socketpair()
+    container, container_peer = socket.socketpair()
+    for sock in (stdin, stdout, container):
+        sock.setblocking(False)
+    stdin_pump = io.Pump(io.Stream(counter.socket(stdin)), io.Stream(counter.socket(container)),
+                         propagate_close=False)
+    stdout_pump = io.Pump(io.Stream(counter.socket(container)), io.Stream(counter.socket(stdout)),
+                          propagate_close=False)
+    latencies = []
+
+    def type_keys():
+        for _ in range(keystrokes):
+            start = time.perf_counter_ns()
+            client_in.sendall(b'x')
+            client_out.recv(1)
+            latencies.append((time.perf_counter_ns() - start) / 1000)
+        client_in.shutdown(socket.SHUT_WR)
+
+    def echo_keys():
+        key = container_peer.recv(1)
+        while key:
+            container_peer.sendall(key)
+            key = container_peer.recv(1)
+
+    typist = threading.Thread(target=type_keys, daemon=True)
+    shell = threading.Thread(target=echo_keys, daemon=True)
+    try:
+        with counter:
+            tracemalloc.reset_peak()
+            allocated = tracemalloc.get_traced_memory()[0]
+            shell.start()
+            typist.start()
+            drive([stdin_pump, stdout_pump], counter, lambda: stdin_pump.eof)
+        typist.join()
+    finally:
+        for sock in (stdin, client_in, stdout, client_out, container, container_peer):
+            sock.close()
+        shell.join()
+    latencies.sort()
+    return {'calls_op' : round(counter.count / keystrokes, 1),
+            'peak_kib' : round((tracemalloc.get_traced_memory()[1] - allocated) / 1024),
+            'p50_us' : round(latencies[len(latencies) // 2], 1),
+            'p99_us' : round(latencies[int(len(latencies) * 0.99)], 1)}
+
+
+def scenarios(scale):
+    """The scenarios to measure, and how to run each one at a fraction of its full size.
+
+    :Returns: Dictionary
+
+    :param scale: Multiplies how much data each scenario moves.
+    :type scale: Float
+    """
+    runs = {
+        'tty' : lambda div: stream(int(256 * MIB * scale) // div),
+        'demux-16' : lambda div: stream(int(8 * MIB * scale) // div, frame=16),
+        'demux-256' : lambda div: stream(int(32 * MIB * scale) // div, frame=256),
+        'demux-4096' : lambda div: stream(int(64 * MIB * scale) // div, frame=4096),
+        'backlog' : lambda div: stream(int(64 * MIB * scale) // div, chunk=4096),
+        'echo' : lambda div: echo(max(int(2000 * scale) // div, 100)),
+    }
+    if hasattr(os, 'splice'):
+        runs['tty-splice'] = lambda div: stream(int(256 * MIB * scale) // div, io.SplicePump)
+    return runs
+
+
+def run(names, scale, runs):
+    """Measure the named scenarios.
+
+    :Returns: Dictionary
+
+    :param names: Which scenarios to measure.
+    :type names: List
+
+    :param scale: Multiplies how much data each scenario moves.
+    :type scale: Float
+
+    :param runs: How many times to measure each scenario; the median is used.
+    :type runs: Integer
+    """
+    measures = scenarios(scale)
+    results = {}
+    for name in names:
+        samples = [measures[name](1) for _ in range(runs)]
+        results[name] = {metric : statistics.median(sample[metric] for sample in samples)
+                         for metric in samples[0]}
+        tracemalloc.start()
+        try:
+            results[name]['peak_kib'] = measures[name](TRACED_FRACTION)['peak_kib']
+        finally:
+            tracemalloc.stop()
+    return results
+
+
+def regressions(results, baseline):
+    """Compare the results against the baseline.
+
+    :Returns: List
+
+    :param results: The measured metrics, by scenario.
+    :type results: Dictionary
+
+    :param baseline: The stored metrics, by scenario.
+    :type baseline: Dictionary
+    """
+    failures = []
+    for name, metrics in results.items():
+        for metric, value in metrics.items():
+            before = baseline.get(name, {}).get(metric)
+            if not before:
+                continue
+            if metric in HIGHER_IS_BETTER:
+                worse = value < before * (1 - TOLERANCE)
+            else:
+                worse = value > before * (1 + TOLERANCE)
+            if worse:
+                failures.append('{} {}: {} vs baseline of {}'.format(name, metric, value, before))
+    return failures
+
+
+def _column(metrics, baseline, metric):
+    """Format a metric, and how it changed from the baseline"""
+    value = metrics.get(metric)
+    if value is None:
+        return '-'
+    before = baseline.get(metric)
+    if not before:
+        return '{:g}'.format(value)
+    return '{:g} ({:+.0%})'.format(value, (value - before) / before)
+
+
+def main(cli_args=sys.argv[1:]): #pylint: disable=W0102
+    """Entry point logic"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenarios', default=','.join(sorted(scenarios(1))),
+                        help='Comma-separated scenarios to measure')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='Multiplies how much data each scenario moves')
+    parser.add_argument('--runs', type=int, default=3,
+                        help='Runs per scenario; the median is used')
+    parser.add_argument('--baseline', default=BASELINE_LOCATION, help='The stored baseline file')
+    parser.add_argument('--update', action='store_true', help='Store the results as the new baseline')
+    args = parser.parse_args(cli_args)
+
+    baseline = {}
+    if not args.update and os.path.exists(args.baseline):
+        with open(args.baseline) as the_file:
+            baseline = json.load(the_file)
+    results = run(args.scenarios.split(','), args.scale, args.runs)
+
+    columns = (('mib_s', 'MiB/s'), ('calls_mib', 'calls/MiB'), ('calls_op', 'calls/key'),
+               ('peak_kib', 'peak KiB'), ('p50_us', 'p50 us'), ('p99_us', 'p99 us'))
+    print('{:<12}'.format('') + ''.join('{:>18}'.format(title) for _, title in columns))
+    for name, metrics in results.items():
+        print('{:<12}'.format(name) + ''.join('{:>18}'.format(_column(metrics, baseline.get(name, {}), metric))
+                                             for metric, _ in columns))
+    if args.update:
+        with open(args.baseline, 'w') as the_file:
+            json.dump(results, the_file, indent=2, sort_keys=True)
+            the_file.write('\n')
+        print('Stored new baseline in {}'.format(args.baseline))
+        return 0
+    failures = regressions(results, baseline)
+    for failure in failures:
+        print('REGRESSION: {}'.format(failure))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,129 @@
+# -*- coding: UTF-8 -*-
+"""Measures the CPU a Pump spends forwarding a TTY session, with and without splice.
+
+In a TTY session the data isn't transformed, so a SplicePump can move it
+between file descriptors inside the kernel with ``os.splice``, instead of
+copying every byte into Python and back out. This benchmark pumps a stream of
+data from one socketpair to another, and reports the CPU time the pumping
+thread used per GiB, along with the throughput. The receiving end discards
+the data with ``os.splice`` too, so it keeps up with either kind of Pump.
+
+Usage:
+
+    python benchmarks/splice.py [--total 1024] [--block 65536]
+"""
+import os
+import sys
+import time
+import socket
+import argparse
+import resource
+import threading
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from container_shell.lib.dockerpty import io #pylint: disable=C0413
+
+MIB = 1024 * 1024
+GIB = 1024 * MIB
+
+
+def _cpu():
+    """The CPU seconds, user and system, used by the calling thread"""
+    usage = resource.getrusage(resource.RUSAGE_THREAD)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _sink(sock, total):
+    """Read and discard ``total`` bytes from ``sock``, without copying them into Python"""
+    read_fd, write_fd = os.pipe()
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    received = 0
+    try:
+        while received < total:
+            moved = os.splice(sock.fileno(), write_fd, MIB)
+            if not moved:
+                break
+            received += moved
+            while moved:
+                moved -= os.splice(read_fd, devnull, moved)
+    finally:
+        for fd in (read_fd, write_fd, devnull):
+            os.close(fd)
+
+
+def forward(pump_cls, total, block):
+    """Time pumping ``total`` bytes between two socketpairs.
+
+    :Returns: Tuple (MiB per second, CPU seconds per GiB)
+
+    :param pump_cls: The kind of Pump to measure.
+    :type pump_cls: Class
+
+    :param total: How many bytes to send.
+    :type total: Integer
+
+    :param block: How many bytes the sender writes at a time.
+    :type block: Integer
+    """
+    source, source_peer = socket.socketpair()
+    dest, dest_peer = socket.socketpair()
+    payload = os.urandom(block)
+
+    def send():
+        for _ in range(total // block):
+            source_peer.sendall(payload)
+        source_peer.shutdown(socket.SHUT_WR)
+
+    sender = threading.Thread(target=send, daemon=True)
+    sink = threading.Thread(target=_sink, args=(dest_peer, total // block * block), daemon=True)
+    pump = pump_cls(io.Stream(source), io.Stream(dest))
+    try:
+        with io.Selector() as selector:
+            source.setblocking(False)
+            dest.setblocking(False)
+            selector.set_reading(pump)
+            sink.start()
+            sender.start()
+            start = time.perf_counter()
+            cpu = _cpu()
+            while not pump.is_done():
+                readable, writable = selector.select()
+                for stream in writable:
+                    stream.do_write()
+                for ready in readable:
+                    ready.flush()
+                selector.set_reading(pump, pump.wants_read())
+                selector.set_writing(pump.to_stream, pump.to_stream.needs_write())
+            cpu = _cpu() - cpu
+            sink.join()
+            elapsed = time.perf_counter() - start
+        sender.join()
+    finally:
+        for sock in (source, source_peer, dest, dest_peer):
+            sock.close()
+    return (total / MIB) / elapsed, cpu / (total / GIB)
+
+
+def main(cli_args=sys.argv[1:]): #pylint: disable=W0102
+    """Entry point logic"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--total', type=int, default=1024,
+                        help='MiB to send through each kind of Pump')
+    parser.add_argument('--block', type=int, default=64 * 1024,
+                        help='Bytes the sender writes at a time')
+    args = parser.parse_args(cli_args)
+    if not hasattr(os, 'splice'):
+        print('os.splice is not available; it needs Linux and Python 3.10+')
+        return 1
+
+    print('{:>12} {:>10} {:>12}'.format('', 'MiB/s', 'CPU s/GiB'))
+    for pump_cls in (io.Pump, io.SplicePump):
+        rate, cpu = forward(pump_cls, args.total * MIB, args.block)
+        print('{:>12} {:>10.1f} {:>12.3f}'.format(pump_cls.__name__, rate, cpu))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
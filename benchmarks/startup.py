@@ -0,0 +1,174 @@
+# -*- coding: UTF-8 -*-
+"""Measures how long Container Shell takes to start, and fails if it's over budget.
+
+Two paths are measured, each in a fresh interpreter:
+
+  host       A ``skip_users`` login, from interpreter start until the host
+             command (``true``) has ran and Container Shell exits.
+  container  Interpreter start until every module the container path needs is
+             imported and the Docker client is constructed. Daemon round trips
+             aren't included; those show up in the per-login log record.
+
+For each path the wall clock time, and the ``-X importtime`` total, are compared
+against ``startup_budget.json``. Both are measured relative to a bare interpreter
+(``python -c pass``), so the budget tracks Container Shell's own cost instead of
+how fast the machine is, or what ``site`` happens to import. Run with
+``--update`` to store new budgets.
+
+Usage:
+
+    python benchmarks/startup.py [--runs N] [--update] [--budget FILE]
+"""
+import os
+import sys
+import json
+import time
+import getpass
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(HERE)
+BUDGET_LOCATION = os.path.join(HERE, 'startup_budget.json')
+# Stored budgets get some headroom, so noisy machines don't fail the benchmark.
+HEADROOM = 1.5
+
+HOST_PATH = '''
+import functools
+from container_shell import container_shell
+from container_shell.lib.config import get_config
+container_shell.get_config = functools.partial(get_config, location={location!r})
+container_shell.main(['-c', 'true'])
+'''
+
+CONTAINER_PATH = '''
+from container_shell import container_shell
+container_shell.dockage.build_args
+container_shell.dockerpty.start
+container_shell.pool.claim
+container_shell.refresh.update_image
+container_shell.docker.DockerClient(base_url='unix:///var/run/docker.sock', version='1.41')
+'''
+
+CONFIG = '''
+[config]
+skip_users={user}
+[logging]
+location={log}
+'''
+
+
+def measure(code, runs):
+    """Run some code in a fresh interpreter several times.
+
+    :Returns: Dictionary
+
+    :param code: The Python source to run.
+    :type code: String
+
+    :param runs: How many times to run the code.
+    :type runs: Integer
+    """
+    walls = []
+    imports = []
+    env = dict(os.environ, PYTHONPATH=REPO)
+    env.pop('SSH_ORIGINAL_COMMAND', None)
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], env=env, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        walls.append((time.perf_counter() - start) * 1000)
+        proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], env=env,
+                              check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        imports.append(_import_total(proc.stderr.decode()))
+    return {'wall_ms' : round(statistics.median(walls), 2),
+            'import_us' : int(statistics.median(imports))}
+
+
+def _import_total(importtime_output):
+    """Sum the 'self' time of every import in the output of ``-X importtime``"""
+    total = 0
+    for line in importtime_output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        self_us = line.split(':', 1)[1].split('|')[0].strip()
+        if self_us.isdigit():
+            total += int(self_us)
+    return total
+
+
+def run(runs):
+    """Measure both the host and container paths.
+
+    :Returns: Dictionary
+
+    :param runs: How many times to measure each path.
+    :type runs: Integer
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        location = os.path.join(tmp_dir, 'config.ini')
+        with open(location, 'w') as the_file:
+            the_file.write(CONFIG.format(user=getpass.getuser(),
+                                         log=os.path.join(tmp_dir, 'messages.log')))
+        baseline = measure('pass', runs)
+        results = {'host' : measure(HOST_PATH.format(location=location), runs),
+                   'container' : measure(CONTAINER_PATH, runs)}
+    for metrics in results.values():
+        for metric, value in metrics.items():
+            metrics[metric] = type(value)(max(value - baseline[metric], 0))
+    return results
+
+
+def over_budget(results, budget):
+    """Compare the results against the budget.
+
+    :Returns: List
+
+    :param results: The measured startup times.
+    :type results: Dictionary
+
+    :param budget: The maximum allowed startup times.
+    :type budget: Dictionary
+    """
+    failures = []
+    for path, metrics in results.items():
+        for metric, value in metrics.items():
+            limit = budget.get(path, {}).get(metric)
+            if limit is not None and value > limit:
+                failures.append('{} {}: {} exceeds budget of {}'.format(path, metric, value, limit))
+    return failures
+
+
+def main(cli_args=sys.argv[1:]): #pylint: disable=W0102
+    """Entry point logic"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='Runs per path; the median is used')
+    parser.add_argument('--budget', default=BUDGET_LOCATION, help='The stored budget file')
+    parser.add_argument('--update', action='store_true', help='Store the results as the new budget')
+    args = parser.parse_args(cli_args)
+
+    results = run(args.runs)
+    for path, metrics in sorted(results.items()):
+        print('{:<10} wall {:>8.2f} ms   imports {:>8} us'.format(path,
+                                                                 metrics['wall_ms'],
+                                                                 metrics['import_us']))
+    if args.update:
+        budget = {path : {metric : type(value)(round(value * HEADROOM, 2)) for metric, value in metrics.items()} #pylint: disable=C0301
+                  for path, metrics in results.items()}
+        with open(args.budget, 'w') as the_file:
+            json.dump(budget, the_file, indent=2, sort_keys=True)
+            the_file.write('\n')
+        print('Stored new budget in {}'.format(args.budget))
+        return 0
+    with open(args.budget) as the_file:
+        budget = json.load(the_file)
+    failures = over_budget(results, budget)
+    for failure in failures:
+        print('OVER BUDGET: {}'.format(failure))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
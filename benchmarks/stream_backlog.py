@@ -0,0 +1,108 @@
+# -*- coding: UTF-8 -*-
+"""Measures how fast a Stream drains a write backlog to a slow reader.
+
+A fast producer (i.e. ``cat`` of a large log) fills a Stream's write buffer
+while the SSH client falls behind. This benchmark builds backlogs of growing
+size over a socketpair, then drains them one reader-sized chunk at a time, the
+way the PTY loop does when the socket becomes writable.
+
+The buffering in ``dockerpty.io.Stream`` should drain at the same rate no
+matter how large the backlog is. For comparison, the same drain is measured
+with the previous ``bytes`` buffer, which copies the whole remaining backlog
+on every partial write.
+
+Usage:
+
+    python benchmarks/stream_backlog.py [--sizes 1,4,16] [--chunk 4096] [--no-legacy]
+"""
+import os
+import sys
+import time
+import socket
+import argparse
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from container_shell.lib.dockerpty import io #pylint: disable=C0413
+
+MIB = 1024 * 1024
+
+
+class LegacyStream(io.Stream):
+    """The previous write buffering; a single bytes object that's sliced on every write"""
+    def __init__(self, fd):
+        super().__init__(fd)
+        self.legacy_buffer = b''
+
+    def write(self, data):
+        self.legacy_buffer += data
+        self.do_write()
+        return len(data)
+
+    def do_write(self):
+        try:
+            written = self.fd.send(self.legacy_buffer)
+        except BlockingIOError:
+            return 0
+        self.legacy_buffer = self.legacy_buffer[written:]
+        return written
+
+    def needs_write(self):
+        return len(self.legacy_buffer) > 0
+
+
+def drain(stream_cls, backlog, chunk):
+    """Fill a backlog, then time draining it to a reader that takes ``chunk`` bytes at a time.
+
+    :Returns: Float (MiB per second)
+
+    :param stream_cls: The kind of Stream to measure.
+    :type stream_cls: Class
+
+    :param backlog: How many bytes to buffer before the reader starts.
+    :type backlog: Integer
+
+    :param chunk: How many bytes the reader takes per read.
+    :type chunk: Integer
+    """
+    writer, reader = socket.socketpair()
+    try:
+        writer.setblocking(False)
+        stream = stream_cls(writer)
+        block = os.urandom(64 * 1024)
+        for _ in range(backlog // len(block)):
+            stream.write(block)
+        received = 0
+        start = time.perf_counter()
+        while stream.needs_write():
+            received += len(reader.recv(chunk))
+            stream.do_write()
+        elapsed = time.perf_counter() - start
+    finally:
+        writer.close()
+        reader.close()
+    return (backlog / MIB) / elapsed
+
+
+def main(cli_args=sys.argv[1:]): #pylint: disable=W0102
+    """Entry point logic"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1,4,16',
+                        help='Comma-separated backlog sizes, in MiB')
+    parser.add_argument('--chunk', type=int, default=4096,
+                        help='Bytes the slow reader takes per read')
+    parser.add_argument('--no-legacy', action='store_true',
+                        help="Don't measure the previous bytes buffer")
+    args = parser.parse_args(cli_args)
+
+    print('{:>12} {:>14} {:>14}'.format('backlog MiB', 'Stream MiB/s', 'legacy MiB/s'))
+    for size in [int(x) for x in args.sizes.split(',')]:
+        current = drain(io.Stream, size * MIB, args.chunk)
+        legacy = '-' if args.no_legacy else '{:.1f}'.format(drain(LegacyStream, size * MIB, args.chunk))
+        print('{:>12} {:>14.1f} {:>14}'.format(size, current, legacy))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,27 +7,48 @@ import time
 import atexit
 import signal
 import argparse
+import threading
 import functools
+import contextlib
 import subprocess
 from pwd import getpwnam
 from getpass import getuser
 
-import docker
-
-from container_shell.lib.config import get_config
-from container_shell.lib import utils, dockage, dockerpty
-
-#pylint: disable=R0914,R0915,W0102
+from container_shell.lib.config import get_config, compile_config, COMPILED_LOCATION
+from container_shell.lib import utils
+
+# Only the container path needs these, so host users don't pay to import them.
+docker = utils.LazyImport('docker')
+dockage = utils.LazyImport('container_shell.lib.dockage')
+dockerpty = utils.LazyImport('container_shell.lib.dockerpty')
+pool = utils.LazyImport('container_shell.lib.pool')
+refresh = utils.LazyImport('container_shell.lib.refresh')
+broker = utils.LazyImport('container_shell.lib.broker')
+sweep = utils.LazyImport('container_shell.lib.sweep')
+process = utils.LazyImport('container_shell.lib.process')
+futures = utils.LazyImport('concurrent.futures')
+
+#pylint: disable=R0912,R0914,R0915,W0102
 def main(cli_args=sys.argv[1:]):
     """Entry point logic"""
+    timer = utils.PhaseTimer()
     user_info = getpwnam(getuser())
     username = user_info.pw_name
     user_uid = user_info.pw_uid
     user_gid = user_info.pw_gid
     args = parse_cli(cli_args)
 
-    config, using_defaults, location = get_config(shell_command=args.command)
-    docker_client = docker.from_env(timeout=config['config'].getint('docker_timeout'))
+    with timer.phase('config'):
+        config, using_defaults, location = get_config(shell_command=args.command)
+    if args.compile_config:
+        # Before making the logger; an invalid [logging] section would break it.
+        errors = compile_config(location)
+        for error in errors:
+            utils.printerr(error)
+        if errors:
+            sys.exit(1)
+        print('Compiled {} to {}'.format(location, COMPILED_LOCATION))
+        return
     logger = utils.get_logger(name=__name__,
                               location=config['logging'].get('location'),
                               max_size=config['logging'].getint('max_size'),
@@ -39,8 +60,34 @@ def main(cli_args=sys.argv[1:]):
     else:
         logger.debug('Custom config:\n%s', config)
 
+    if args.broker:
+        try:
+            broker.serve(config, logger)
+        except broker.BrokerError as doh:
+            utils.printerr(str(doh))
+            sys.exit(1)
+        return
+    if args.refresh_image:
+        refresh.refresh_out_of_band(config, logger)
+        return
+    if args.sweep:
+        if os.getuid() != 0:
+            # The binary is setuid root; only the real root user may remove containers.
+            utils.printerr('Only root may sweep containers')
+            sys.exit(1)
+        docker_client = dockage.local_client(config)
+        min_age = sweep.MIN_AGE if args.min_age is None else args.min_age
+        stats = sweep.sweep(docker_client, config, logger, dry_run=args.dry_run, min_age=min_age)
+        if stats['errors']:
+            sys.exit(1)
+        return
+    # Logs whatever was timed, even if the login fails.
+    atexit.register(timer.log, logger)
+
     if utils.skip_container(username, config['config']['skip_users']):
         logger.info('User %s accessing host environment', username)
+        timer.path = 'skip'
+        timer.log(logger)
         original_cmd = os.getenv('SSH_ORIGINAL_COMMAND', args.command)
         if not original_cmd:
             original_cmd = os.getenv('SHELL')
@@ -48,32 +95,56 @@ def main(cli_args=sys.argv[1:]):
         proc.communicate()
         sys.exit(proc.returncode)
 
-    image = config['config'].get('image')
+    if config['broker'].get('socket') and _brokered_login(username, user_uid, user_gid,
+                                                           config, logger, timer=timer):
+        return
+
+    if not (using_defaults or config.compiled):
+        _compile_in_passing(location, logger)
+    with timer.phase('client'):
+        docker_client = docker.from_env(timeout=config['config'].getint('docker_timeout'))
+    # The login is a small graph of Docker round trips. The image refresh runs
+    # alongside looking up the user's container; only creating a new container
+    # has to wait on it. The image config the exec needs is then fetched while
+    # the refresh finishes. So an existing user waits on the slowest round trip,
+    # not all of them back to back.
+    executor = futures.ThreadPoolExecutor(max_workers=2)
+    refreshing = None
     if not config['config'].get('auto_refresh').lower() == 'false':
-        try:
-            docker_client.images.pull(image)
-        except docker.errors.DockerException as doh:
-            logger.exception(doh)
-            utils.printerr('Unable to update login environment')
-            sys.exit(1)
+        refreshing = executor.submit(timer.timed('refresh', refresh.update_image),
+                                     docker_client, config, logger)
+    refreshed = functools.partial(_wait_for_refresh, refreshing, logger)
+    image = None # only a shared container needs the image config
 
     try:
         create_kwargs = dockage.build_args(config, username, user_uid, user_gid, logger)
         logger.debug('Create kwargs:\n%s', create_kwargs)
-        container, standalone = _get_container(docker_client, username, config, **create_kwargs)
+        pooled = functools.partial(pool.claim, docker_client, config, username,
+                                   user_uid, user_gid, logger)
+        container, standalone = _get_container(docker_client, username, config, logger,
+                                               pooled=pooled, refreshed=refreshed,
+                                               timer=timer, **create_kwargs)
+        timer.path = 'standalone' if standalone else 'shared'
+        if not standalone:
+            image = executor.submit(_image_config, container, config)
+            refreshed()
+            pool.refill_in_background(docker_client, config, logger)
     except docker.errors.DockerException as doh:
         logger.exception(doh)
         utils.printerr("Failed to create login environment")
         sys.exit(1)
     else:
-        cleanup = functools.partial(kill_container,
-                                    container,
-                                    config['config']['term_signal'],
-                                    config['config']['persist'],
-                                    config['config']['persist_egrep'],
-                                    config['binaries']['ps'],
-                                    logger)
-        atexit.register(cleanup)
+        teardown = Teardown(logger)
+        teardown.add(functools.partial(reap_container,
+                                       container,
+                                       config['config']['term_signal'],
+                                       config,
+                                       logger))
+        atexit.register(teardown.run)
+        sweep.hold_session(config, container.id, logger)
+    finally:
+        executor.shutdown(wait=False)
+    splice = config['config'].getboolean('splice')
     try:
         if standalone:
             logger.debug("Connecting to standalone container")
@@ -83,21 +154,241 @@ def main(cli_args=sys.argv[1:]):
             # on their SSH application (instead of pressing "CTL D" or typing "exit")
             # will cause ContainerShell to leak containers. In other words, the
             # SSH session will be gone, but the container will remain.
-            set_container_signal_handlers(container, config, logger)
-            dockerpty.start(docker_client.api, container.id)
+            set_signal_handlers(teardown)
+            run_op = dockerpty.pty.RunOperation(docker_client.api, container.id, splice=splice,
+                                                logger=logger)
+            with timer.phase('attach'):
+                pty_stdin, pty_stdout, pty_stderr = run_op.sockets()
+            if pty_stdout:
+                pty_stdout = _first_output(pty_stdout, splice, timer, logger)
+            _pseudo_terminal(docker_client.api, run_op, config, hangup=teardown.hangup).start(
+                sockets=(pty_stdin, pty_stdout, pty_stderr))
         else:
             logger.debug("Connecting to shared container")
-            exec_id = dockage.create_exec(docker_client, container, config, username, logger)
-            set_exec_signal_handlers(docker_client, exec_id, logger)
-            exec_op = dockerpty.pty.ExecOperation(docker_client.api, exec_id, logger)
-            dockerpty.pty.PseudoTerminal(docker_client.api, exec_op).start()
+            with timer.phase('exec_create'):
+                exec_id = dockage.create_exec(docker_client, container, config, username,
+                                              logger, image=image.result())
+            grace = config['config'].getfloat('exec_grace')
+            teardown.add(functools.partial(process.kill_exec, docker_client, exec_id, logger,
+                                           grace=grace),
+                         signalled_only=True)
+            set_signal_handlers(teardown)
+            exec_op = dockerpty.pty.ExecOperation(docker_client.api, exec_id, logger, splice=splice)
+            with timer.phase('attach'):
+                stream = exec_op.sockets()
+            _pseudo_terminal(docker_client.api, exec_op, config, hangup=teardown.hangup).start(
+                sockets=_first_output(stream, splice, timer, logger))
     except Exception as doh: #pylint: disable=W0703
         logger.exception(doh)
         utils.printerr("Failed to connect to PTY")
         sys.exit(1)
 
 
-def _get_container(docker_client, username, config, **create_kwargs):
+def _brokered_login(username, user_uid, user_gid, config, logger, timer=None): #pylint: disable=R0913
+    """Have the broker do the Docker work, and connect to the exec it hands back.
+
+    Returns False if the broker is unavailable, so the caller should do the
+    work directly.
+
+    :Returns: Boolean
+
+    :param username: The name of the user running Container Shell.
+    :type username: String
+
+    :param user_uid: The user-id (UID) of the user running Container Shell.
+    :type user_uid: Integer
+
+    :param user_gid: The group-id (GID) of the user running Container Shell.
+    :type user_gid: Integer
+
+    :param config: The defined settings (or defaults) that define the behavior of Container Shell.
+    :type config: configparser.ConfigParser
+
+    :param logger: An object for writing errors/messages for debugging problems
+    :type logger: logging.Logger
+
+    :param timer: Optionally, records how long each phase of the login takes.
+    :type timer: container_shell.lib.utils.PhaseTimer
+    """
+    timer = timer or utils.PhaseTimer()
+    client = broker.BrokerClient(config['broker'].get('socket'),
+                                 timeout=config['config'].getint('docker_timeout'))
+    try:
+        with timer.phase('broker'):
+            container_id, exec_id, exec_socket = client.login(username, user_uid, user_gid,
+                                                              sys.stdin.isatty(), config)
+    except broker.BrokerUnavailable as doh:
+        logger.info('Not using broker: %s', doh)
+        return False
+    except broker.BrokerError as doh:
+        logger.exception(doh)
+        utils.printerr("Failed to create login environment")
+        sys.exit(1)
+    logger.debug("Connecting to shared container via broker")
+    sweep.hold_session(config, container_id, logger)
+    timer.path = 'broker'
+    splice = config['config'].getboolean('splice')
+    teardown = Teardown(logger)
+    teardown.add(functools.partial(client.teardown,
+                                   container_id,
+                                   config['config']['term_signal'],
+                                   config))
+    grace = config['config'].getfloat('exec_grace')
+    teardown.add(functools.partial(process.kill_exec, client, exec_id, logger, grace=grace),
+                 signalled_only=True)
+    atexit.register(teardown.run)
+    try:
+        set_signal_handlers(teardown)
+        exec_op = dockerpty.pty.ExecOperation(client, exec_id, logger, splice=splice)
+        stream = dockerpty.io.Stream(exec_socket)
+        if not exec_op.is_process_tty():
+            stream = dockerpty.io.Demuxer(stream)
+        _pseudo_terminal(client, exec_op, config, hangup=teardown.hangup).start(
+            sockets=_first_output(stream, splice, timer, logger))
+    except Exception as doh: #pylint: disable=W0703
+        logger.exception(doh)
+        utils.printerr("Failed to connect to PTY")
+        sys.exit(1)
+    return True
+
+
+def _pseudo_terminal(client, operation, config, hangup=None):
+    """Make the PseudoTerminal that runs the session, using the configured engine.
+
+    :Returns: container_shell.lib.dockerpty.pty.PseudoTerminal
+
+    :param client: For making calls to the Docker API.
+    :type client: docker.APIClient
+
+    :param operation: The exec, or container, to connect to.
+    :type operation: container_shell.lib.dockerpty.pty.Operation
+
+    :param config: The defined settings (or defaults) that define the behavior of Container Shell.
+    :type config: configparser.ConfigParser
+
+    :param hangup: Ends the session once it's notified.
+    :type hangup: container_shell.lib.dockerpty.io.Notifier
+    """
+    state_ttl = config['config'].getint('state_ttl')
+    record_latency = config['config'].getboolean('log_latency')
+    if config['config'].get('pty_engine').lower() == 'asyncio':
+        return dockerpty.pty.AsyncPseudoTerminal(client, operation, state_ttl, record_latency,
+                                                 hangup)
+    return dockerpty.pty.PseudoTerminal(client, operation, state_ttl, record_latency, hangup)
+
+
+def _first_output(stream, splice, timer, logger):
+    """Time the first byte of the container's output, unless it's going to be spliced.
+
+    Spliced data never passes through ``read``, and the wrapper would stop the
+    stream from being spliced anyway.
+
+    :Returns: Object
+
+    :param stream: The container's output.
+    :type stream: container_shell.lib.dockerpty.io.Stream
+
+    :param splice: If the session moves data with os.splice() when it can.
+    :type splice: Boolean
+
+    :param timer: Records how long each phase of the login takes.
+    :type timer: container_shell.lib.utils.PhaseTimer
+
+    :param logger: An object for writing errors/messages for debugging problems
+    :type logger: logging.Logger
+    """
+    if splice and dockerpty.io.can_splice(stream):
+        return stream
+    return _FirstOutput(stream, timer, logger)
+
+
+class _FirstOutput:
+    """Wraps the stream of the container's output, to time the first byte the user sees.
+
+    Everything besides ``read`` is passed through to the wrapped stream.
+    """
+    def __init__(self, stream, timer, logger):
+        self._stream = stream
+        self._timer = timer
+        self._logger = logger
+        self._waiting = True
+
+    def read(self, n=4096, **kwargs):
+        """Read from the wrapped stream, and log the timings once output arrives"""
+        data = self._stream.read(n, **kwargs)
+        if data and self._waiting:
+            self._waiting = False
+            self._timer.mark('first_byte')
+            self._timer.log(self._logger)
+        return data
+
+    def __getattr__(self, attr):
+        return getattr(self._stream, attr)
+
+
+def _compile_in_passing(location, logger):
+    """Compile the config so later logins don't have to parse it.
+
+    :Returns: None
+
+    :param location: The location of the config.ini file
+    :type location: String
+
+    :param logger: An object for writing errors/messages for debugging problems
+    :type logger: logging.Logger
+    """
+    try:
+        errors = compile_config(location)
+    except OSError as doh:
+        logger.debug('Unable to compile config %s: %s', location, doh)
+        return
+    if errors:
+        logger.warning('Not compiling invalid config %s: %s', location, '; '.join(errors))
+
+
+def _wait_for_refresh(refreshing, logger):
+    """Block until the image refresh finishes; exit if it failed.
+
+    Safe to call more than once.
+
+    :Returns: None
+
+    :param refreshing: The image refresh running on another thread, or None if disabled.
+    :type refreshing: concurrent.futures.Future
+
+    :param logger: An object for writing errors/messages for debugging problems
+    :type logger: logging.Logger
+    """
+    if refreshing is None:
+        return
+    try:
+        refreshing.result()
+    except (docker.errors.DockerException, OSError) as doh:
+        logger.exception(doh)
+        utils.printerr('Unable to update login environment')
+        sys.exit(1)
+
+
+def _image_config(container, config):
+    """Fetch the image the exec needs to pick a user, if it needs one.
+
+    :Returns: docker.models.images.Image or None
+
+    :param container: The user's container.
+    :type container: docker.models.containers.Container
+
+    :param config: The defined settings (or defaults) that define the behavior of Container Shell.
+    :type config: configparser.ConfigParser
+    """
+    if not dockage.provision_mode(config):
+        # Without recreating the user, the exec runs as the image's default user.
+        return container.image
+    return None
+
+
+#pylint: disable=R0913
+def _get_container(docker_client, username, config, logger, pooled=None, refreshed=None,
+                   timer=None, **create_kwargs):
     """Find or create the Linux container to operate against.
 
     :Returns: Tuple
@@ -110,20 +401,43 @@ def _get_container(docker_client, username, config, **create_kwargs):
 
     :param config: The defined settings (or defaults) that define the behavior of Container Shell.
     :type config: configparser.ConfigParser
+
+    :param logger: An object for writing errors/messages for debugging problems
+    :type logger: logging.Logger
+
+    :param pooled: Optionally claim an already running container from the warm pool.
+                   Returns None when no idle container is available.
+    :type pooled: Callable
+
+    :param refreshed: Optionally blocks until the image is up to date. Called
+                      before claiming or creating a container.
+    :type refreshed: Callable
+
+    :param timer: Optionally, records how long each phase of the login takes.
+    :type timer: container_shell.lib.utils.PhaseTimer
     """
+    refreshed = refreshed or (lambda: None)
+    timer = timer or utils.PhaseTimer()
     standalone = False
     command = config['config']['command']
     if command.startswith('scp') or command.endswith('sftp-server'):
         # Not sure why, but I can only get `scp` to work via it's own container.
         # Hacky, but if you can fix please let me know!
-        container = docker_client.containers.create(**create_kwargs)
+        refreshed()
+        with timer.phase('create'):
+            container = docker_client.containers.create(**create_kwargs)
         standalone = True
     else:
-        for container in docker_client.containers.list(all=True):
-            if container.name == username:
-                break
-        else:
-            container = docker_client.containers.create(**create_kwargs)
+        with timer.phase('lookup'):
+            container = _find_container(docker_client, username)
+        if container is None:
+            refreshed()
+        if container is None and pooled:
+            with timer.phase('claim'):
+                container = pooled()
+        if container is None:
+            with timer.phase('create'):
+                container = docker_client.containers.create(**create_kwargs)
 
     if container.status == 'created' and not standalone:
         # Correctly handles two different situations:
@@ -132,17 +446,53 @@ def _get_container(docker_client, username, config, **create_kwargs):
         # Two containers with the same name cannot exist. If the server was
         # suddenly rebooted, users might be unable to connect because their
         # old session exists, it's just not running.
-        container.start()
-        _block_on_init(container, username, config['binaries']['id'])
+        with timer.phase('start'):
+            container.start()
+        if dockage.provision_mode(config) == 'mount':
+            # The container runs as the user from the start; there's nothing to wait on.
+            logger.debug('Container %s started as %s', container.name, username)
+        else:
+            with timer.phase('init'):
+                waited = _block_on_init(container, username, config['binaries']['id'])
+            logger.info('Waited %.3f seconds for container %s to initialize',
+                        waited, container.name)
     return container, standalone
 
 
+def _find_container(docker_client, username):
+    """Lookup the user's container by name.
+
+    Unlike listing every container, the cost of this lookup doesn't grow with
+    the number of containers on the host.
+
+    :Returns: docker.models.containers.Container or None
+
+    :param docker_client: For communicating with the Docker daemon.
+    :type docker_client: docker.client.DockerClient
+
+    :param username: The name of the user running Container Shell.
+    :type username: String
+    """
+    try:
+        container = docker_client.containers.get(username)
+    except docker.errors.NotFound:
+        return None
+    # The daemon also resolves container ID prefixes, so make sure we got the
+    # container with that exact name.
+    if container.name != username:
+        return None
+    return container
+
+
 def _block_on_init(container, username, id_path, timeout=60):
     """There's a race between starting the container and creating the user inside
     it, and running the ``exec`` against the container to connect the user to it.
 
+    Containers that announce when the user exists are waited on by following
+    their output. Otherwise, this falls back to polling for the user with an
+    exponential backoff. Returns the number of seconds spent waiting.
 
-    :Returns: None
+    :Returns: Float
 
     :param container: The container created by ContainerShell
     :type container: docker.models.containers.Container
@@ -157,69 +507,172 @@ def _block_on_init(container, username, id_path, timeout=60):
     :type timeout: Integer
     """
     start_time = time.time()
-    command = '{} {}'.format(id_path, username)
-    still_making = container.exec_run(command).exit_code
-    while still_making:
-        time.sleep(0.1)
-        if (time.time() - start_time) > timeout:
-            raise RuntimeError('Failed to create user within {} seconds'.format(timeout))
-        still_making = container.exec_run(command).exit_code
+    if not (_announces_ready(container) and _wait_for_marker(container, timeout)):
+        command = '{} {}'.format(id_path, username)
+        delay = 0.05
+        while container.exec_run(command).exit_code:
+            if (time.time() - start_time) > timeout:
+                raise RuntimeError('Failed to create user within {} seconds'.format(timeout))
+            time.sleep(delay)
+            delay = min(delay * 2, 1)
+    return time.time() - start_time
 
 
-def set_container_signal_handlers(container, config, logger):
-    """Set all the OS signal handlers, so we proxy signals to the process(es)
-    inside the container.
+def _announces_ready(container):
+    """Determine if the container's command writes the ready marker to its output
 
-    :Returns: None
+    :Returns: Boolean
 
     :param container: The container created by ContainerShell
     :type container: docker.models.containers.Container
+    """
+    cmd = container.attrs.get('Config', {}).get('Cmd') or []
+    return any(dockage.READY_MARKER in str(part) for part in cmd)
 
-    :param config: The defined settings (or defaults) that define the behavior of Container Shell.
-    :type config: configparser.ConfigParser
 
-    :param logger: An object for writing errors/messages for debugging problems
-    :type logger: logging.Logger
+def _wait_for_marker(container, timeout):
+    """Follow the output of a container until it writes the ready marker.
+
+    Returns False if the container stops, or the marker isn't seen within the
+    timeout, so the caller can fall back to polling.
+
+    :Returns: Boolean
+
+    :param container: The container created by ContainerShell
+    :type container: docker.models.containers.Container
+
+    :param timeout: Maximum number of seconds to block
+    :type timeout: Integer
     """
-    persist = config['config']['persist']
-    persist_egrep = config['config']['persist_egrep']
-    ps_path = config['binaries']['ps']
-    hupped = functools.partial(kill_container, container, 'SIGHUP', persist, persist_egrep, ps_path, logger) #pylint: disable=C0301
-    signal.signal(signal.SIGHUP, hupped)
-    interrupt = functools.partial(kill_container, container, 'SIGINT', persist, persist_egrep, ps_path, logger) #pylint: disable=C0301
-    signal.signal(signal.SIGINT, interrupt)
-    quit_handler = functools.partial(kill_container, container, 'SIGQUIT', persist, persist_egrep, ps_path, logger) #pylint: disable=C0301
-    signal.signal(signal.SIGQUIT, quit_handler)
-    abort = functools.partial(kill_container, container, 'SIGABRT', persist, persist_egrep, ps_path, logger) #pylint: disable=C0301
-    signal.signal(signal.SIGABRT, abort)
-    termination = functools.partial(kill_container, container, 'SIGTERM', persist, persist_egrep, ps_path, logger) #pylint: disable=C0301
-    signal.signal(signal.SIGTERM, termination)
-
-
-def set_exec_signal_handlers(docker_client, exec_id, logger):
-    """Propagate signals to the PID for the ``docker exec`` instance.
-
-    This is mostly for OpenSSH support. So regardless of the program you run
-    inside the container, any of the "tear down" signals get cast to SIGTERM.
+    found = threading.Event()
+    done = threading.Event()
+    marker = dockage.READY_MARKER.encode()
+    # The log stream blocks on the daemon, so it's read in a thread to bound the wait.
+    stream = container.logs(stream=True, follow=True, stdout=True, stderr=False)
+
+    def follow():
+        output = b''
+        try:
+            for chunk in stream:
+                # Only keep enough of the tail to match a marker split across chunks
+                output = output[-len(marker):] + chunk
+                if marker in output:
+                    found.set()
+                    break
+        except Exception: #pylint: disable=W0703
+            pass
+        finally:
+            done.set()
 
-    :Returns: None
+    threading.Thread(target=follow, daemon=True).start()
+    done.wait(timeout)
+    if hasattr(stream, 'close'):
+        stream.close()
+    return found.is_set()
 
-    :param docker_client: For communicating with the Docker daemon.
-    :type docker_client: docker.client.DockerClient
 
-    :param exec_id: The Id -> hex mapping for the exec id.
-    :type exec_id: Dictionary
+# The signals that end a session.
+TEARDOWN_SIGNALS = ('SIGHUP', 'SIGINT', 'SIGQUIT', 'SIGABRT', 'SIGTERM')
 
-    :param logger: An object for writing errors/messages for debugging problems
-    :type logger: logging.Logger
+
+class Teardown:
+    """Cleans up after a session, exactly once, however the session ends.
+
+    The work is a list of steps, ran by ``run``; it's registered with
+    ``atexit``. Signal handlers only call ``request``, which records the signal
+    and notifies ``hangup``. That wakes up the PTY loop, which ends the session
+    and restores the terminal, so no Docker API call is ever made from inside a
+    signal handler, or while the terminal is mid-write.
+
+    The states go ``idle`` -> ``requested`` -> ``running`` -> ``done``. A
+    session that ends on its own skips ``requested``. Once ``running``, more
+    signals and more calls to ``run`` do nothing.
     """
-    logger.info("Setting EXEC signal handlers")
-    exec_handle = functools.partial(kill_exec, docker_client, exec_id, logger)
-    signal.signal(signal.SIGHUP, exec_handle)
-    signal.signal(signal.SIGINT, exec_handle)
-    signal.signal(signal.SIGQUIT, exec_handle)
-    signal.signal(signal.SIGABRT, exec_handle)
-    signal.signal(signal.SIGTERM, exec_handle)
+    IDLE = 'idle'
+    REQUESTED = 'requested'
+    RUNNING = 'running'
+    DONE = 'done'
+
+    def __init__(self, logger):
+        self.logger = logger
+        self.state = Teardown.IDLE
+        self.signal = None
+        self.hangup = dockerpty.io.Notifier()
+        self._steps = []
+        self._lock = threading.Lock()
+
+    def add(self, step, signalled_only=False):
+        """Add a step to the teardown.
+
+        Steps that only run when a signal ended the session run before the
+        rest, since they stop what the session left running.
+
+        :Returns: None
+
+        :param step: Called with no arguments; errors are logged, and the teardown goes on.
+        :type step: Callable
+
+        :param signalled_only: Set to True to skip the step if the session ended on its own.
+        :type signalled_only: Boolean
+        """
+        if signalled_only:
+            self._steps.insert(0, (step, signalled_only))
+        else:
+            self._steps.append((step, signalled_only))
+
+    def request(self, signum, frame=None): #pylint: disable=W0613
+        """The signal handler; only records the signal, and ends the session.
+
+        :Returns: None
+
+        :param signum: The signal that was received.
+        :type signum: Integer
+        """
+        # No lock; a handler runs on the main thread, which might already hold it.
+        if self.state == Teardown.IDLE:
+            self.signal = signal.Signals(signum).name
+            self.state = Teardown.REQUESTED
+        self.hangup.notify()
+
+    def run(self):
+        """Run the steps, unless they've already ran. Returns False if they have.
+
+        :Returns: Boolean
+        """
+        with self._lock:
+            if self.state in (Teardown.RUNNING, Teardown.DONE):
+                return False
+            signalled = self.state == Teardown.REQUESTED
+            self.state = Teardown.RUNNING
+        began = time.monotonic()
+        for step, signalled_only in self._steps:
+            if signalled_only and not signalled:
+                continue
+            try:
+                step()
+            except Exception as doh: #pylint: disable=W0703
+                self.logger.exception(doh)
+        self.state = Teardown.DONE
+        self.logger.debug('Session teardown after %s took %.6f sec',
+                          self.signal or 'exit', time.monotonic() - began)
+        return True
+
+
+def set_signal_handlers(teardown):
+    """Have the "tear down" signals end the session, and clean up after it.
+
+    When OpenSSH detects that a client has disconnected, it sends SIGHUP to the
+    process ran when that client connected. So regardless of the program you
+    run inside the container, any of these signals end the session. The
+    ``docker exec`` instance, if there is one, is then sent SIGTERM.
+
+    :Returns: None
+
+    :param teardown: Cleans up after the session.
+    :type teardown: Teardown
+    """
+    for signame in TEARDOWN_SIGNALS:
+        signal.signal(getattr(signal, signame), teardown.request)
 
 
 def ignore_not_found(func):
@@ -257,15 +710,8 @@ def _should_not_kill(container, persist, persist_egrep, ps_path, logger):
     :param logger: An object for writing errors/messages for debugging problems
     :type logger: logging.Logger
     """
-    ps_cmd = '{} auxwww'.format(ps_path.replace(';', ''))
-    regex = re.compile('({})'.format(persist_egrep))
-    _, ps_output = container.exec_run(ps_cmd)
-    # Minimizes the race between two sessions terminating at nearly the same time.
-    # If `container.exec_run(ps_cmd)` was ran after the `container.reload()` and inspecting
-    # it for execution IDs, then it's possible that a this thread's check of the container's
-    # process table could be interpreted as an active session to another thread that's
-    # terminating it's session just after this one. The result is that the container is kept
-    # when it should be deleted.
+    # Reading the process table no longer runs an exec inside the container,
+    # so this check can't be mistaken for another session's connection.
     container.reload()
     #pylint: disable=R1705
     if container.attrs['ExecIDs']:
@@ -273,16 +719,113 @@ def _should_not_kill(container, persist, persist_egrep, ps_path, logger):
         return True
     elif persist.lower().startswith('f'):
         return False
+    regex = _persist_regex(persist_egrep)
+    for command in dockage.processes(container, ps_path):
+        found = regex.search(command)
+        if found:
+            logger.debug("Persistence search results: %s", found)
+            return True
+    return False
+
+
+@functools.lru_cache(maxsize=4)
+def _persist_regex(persist_egrep):
+    """Compile the ``persist_egrep`` setting once, instead of every time a session ends"""
+    return re.compile('({})'.format(persist_egrep))
+
+
+def reap_container(container, the_signal, config, logger):
+    """Tear down the container when ContainerShell exits, without waiting on Docker.
+
+    The teardown is handed to a detached process, so the user's SSH session
+    ends as soon as they disconnect. Set ``reaper_slots=0`` to tear down the
+    container before exiting instead.
+
+    :Returns: None
+
+    :param container: The container created by ContainerShell
+    :type container: docker.models.containers.Container
+
+    :param the_signal: The Linux SIGNAL to set to the container in order to stop it.
+    :type the_signal: String
+
+    :param config: The defined settings (or defaults) that define the behavior of Container Shell.
+    :type config: configparser.ConfigParser
+
+    :param logger: An object for writing errors/messages for debugging problems
+    :type logger: logging.Logger
+    """
+    if _reaper_slots(config):
+        utils.detach(_reap, container.id, the_signal, config, logger)
     else:
-        found = re.search(regex, ps_output.decode(errors='ignore'))
-        logger.debug("Persistence search results: %s", found)
-        return bool(found)
+        _reap(container.id, the_signal, config, logger, container=container)
+
+
+def _reaper_slots(config):
+    """How many containers the host tears down at once; zero means don't detach"""
+    return config['config'].getint('reaper_slots')
+
+
+def _reap(container_id, the_signal, config, logger, container=None): #pylint: disable=R0913
+    """Apply the persist rules, and tear down the container; logs how long that took.
+
+    Runs in a detached process, so it needs its own connection to the daemon.
+    Returns whether the container was removed, or None if that failed.
+    """
+    began = time.monotonic()
+    removed = False
+    try:
+        with _reaper_slot(config):
+            waited = time.monotonic() - began
+            if container is None:
+                docker_client = docker.from_env(timeout=config['config'].getint('docker_timeout'))
+                container = docker_client.containers.get(container_id)
+            removed = kill_container(container,
+                                     the_signal,
+                                     config['config']['persist'],
+                                     config['config']['persist_egrep'],
+                                     config['binaries']['ps'],
+                                     logger)
+    except docker.errors.NotFound:
+        # Auto-removed before we got to it.
+        pass
+    except Exception as doh: #pylint: disable=W0703
+        logger.exception(doh)
+        return None
+    logger.info('Teardown container=%s removed=%s waited=%.6f total=%.6f',
+                container_id[:12], removed, waited, time.monotonic() - began)
+    return removed
+
+
+@contextlib.contextmanager
+def _reaper_slot(config):
+    """Bounds how many containers the host tears down at once.
+
+    Each slot is a lock file under ``state_dir``. A free slot is taken if there
+    is one, otherwise this waits on one of them. Without any slots, it never waits.
+    """
+    slots = _reaper_slots(config)
+    if not slots:
+        yield
+        return
+    locations = [os.path.join(config['config'].get('state_dir'), 'reaper-{}.lock'.format(index))
+                 for index in range(slots)]
+    for location in locations:
+        with utils.file_lock(location, blocking=False) as locked:
+            if locked:
+                yield
+                return
+    with utils.file_lock(locations[os.getpid() % slots]):
+        yield
+
 
 #pylint: disable=R0913
 def kill_container(container, the_signal, persist, persist_egrep, ps_path, logger):
-    """Tear down the container when ContainerShell exits
+    """Stop and remove the container, unless it should persist.
 
-    :Returns: None
+    Returns False if the container was kept.
+
+    :Returns: Boolean
 
     :param container: The container created by ContainerShell
     :type container: docker.models.containers.Container
@@ -295,7 +838,7 @@ def kill_container(container, the_signal, persist, persist_egrep, ps_path, logge
     :type logger: logging.Logger
     """
     if _should_not_kill(container, persist, persist_egrep, ps_path, logger):
-        return
+        return False
     logger.debug('Tearing down container')
     try:
         container.exec_run('kill -{} 1'.format(the_signal))
@@ -313,48 +856,7 @@ def kill_container(container, the_signal, persist, persist_egrep, ps_path, logge
         pass
     except Exception as doh: #pylint: disable=W0703
         logger.exception(doh)
-
-#pylint: disable=W0613
-def kill_exec(docker_client, exec_id, logger, *args, **kwargs):
-    """Send SIGTERM to terminate the PID from the ``docker exec`` instance.
-
-    :Returns: None
-
-    :param docker_client: For communicating with the Docker daemon.
-    :type docker_client: docker.client.DockerClient
-
-    :param exec_id: The Id -> hex mapping for the exec id.
-    :type exec_id: Dictionary
-
-    :param logger: An object for writing errors/messages for debugging problems
-    :type logger: logging.Logger
-    """
-    pid = int(docker_client.api.exec_inspect(exec_id['Id'])['Pid'])
-    os.kill(pid, 15) #SIGTERM
-    cycles = _block_on_pid(pid)
-    logger.debug("Exec blocked for %s sec on pid %s to exit gracefully", cycles, pid)
-
-
-def _block_on_pid(pid):
-    """It can take a few seconds for the process to gracefully exit.
-
-    Waits upwards of 60 seconds for the process to terminate. Returns the number
-    of seconds the pid took to terminate.
-
-    :Returns: Integer
-
-    :param pid: The process ID of the ``docker exec`` instance.
-    :type pid: Integer
-    """
-    for i in range(60):
-        try:
-            os.kill(pid, 0) # signal zero does nothing
-        except ProcessLookupError:
-            break
-        else:
-            time.sleep(1)
-    return i
-
+    return True
 
 def parse_cli(cli_args):
     """Intemperate the CLI arguments, and return a useful object
@@ -368,6 +870,18 @@ def parse_cli(cli_args):
     parser = argparse.ArgumentParser(description=description)
     parser.add_argument('-c', '--command', default='',
                         help='Execute a specific command, then terminate.')
+    parser.add_argument('--broker', action='store_true',
+                        help='Run the per-host broker that does the Docker work for logins.')
+    parser.add_argument('--compile-config', action='store_true',
+                        help='Validate the config, and compile it for faster logins.')
+    parser.add_argument('--refresh-image', action='store_true',
+                        help='Pull the container image, unless it was pulled within refresh_ttl.')
+    parser.add_argument('--sweep', action='store_true',
+                        help='Remove the containers of sessions that ended without cleaning up.')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='With --sweep, report what would be removed, without removing it.')
+    parser.add_argument('--min-age', type=int, default=None,
+                        help='With --sweep, ignore containers younger than this many seconds.')
 
     args = parser.parse_args(cli_args)
     return args
@@ -0,0 +1,400 @@
+# -*- coding: UTF-8 -*-
+"""A long-lived, per-host process that does the Docker work for logins.
+
+Every login is a brand new Python process. Without the broker, each one pays to
+import the Docker SDK, build a client, and open new HTTP connections to the
+daemon. The broker pays those costs once, and keeps warm keep-alive connections
+to the daemon. Logins become thin clients that ask the broker to find (or create)
+their container and create the ``exec``.
+
+The protocol is one JSON document per line over a unix socket. The hijacked
+``exec`` socket is handed back to the login via ``SCM_RIGHTS``, so terminal I/O
+flows directly between the login and the daemon; the broker is not a proxy.
+"""
+import os
+import pwd
+import json
+import array
+import socket
+import struct
+import functools
+import threading
+import socketserver
+from configparser import ConfigParser
+
+from container_shell.lib import utils
+
+docker = utils.LazyImport('docker')
+dockage = utils.LazyImport('container_shell.lib.dockage')
+pool = utils.LazyImport('container_shell.lib.pool')
+refresh = utils.LazyImport('container_shell.lib.refresh')
+entry = utils.LazyImport('container_shell.container_shell')
+
+MAX_MESSAGE = 1024 * 1024
+
+
+class BrokerError(RuntimeError):
+    """The broker failed to do what was requested"""
+
+
+class BrokerUnavailable(BrokerError):
+    """The broker isn't running, or can't handle the request; do the work directly"""
+
+
+class BrokerClient:
+    """Talks to the broker on behalf of a login.
+
+    Implements the subset of ``docker.APIClient`` that the PTY code needs for an
+    ``exec``, so it can be used in place of the Docker client.
+    """
+    def __init__(self, location, timeout):
+        self.location = location
+        self.timeout = timeout
+
+    @property
+    def api(self):
+        """Mimics ``docker.DockerClient.api``"""
+        return self
+
+    #pylint: disable=R0913
+    def login(self, username, user_uid, user_gid, tty, config):
+        """Find or create the user's container, and start an ``exec`` inside it.
+
+        :Returns: Tuple (container ID, exec ID, socket.socket)
+
+        :param username: The name of the user running Container Shell.
+        :type username: String
+
+        :param user_uid: The user-id (UID) of the user running Container Shell.
+        :type user_uid: Integer
+
+        :param user_gid: The group-id (GID) of the user running Container Shell.
+        :type user_gid: Integer
+
+        :param tty: If the user's session has a TTY.
+        :type tty: Boolean
+
+        :param config: The defined settings (or defaults) that define the behavior
+                       of Container Shell.
+        :type config: configparser.ConfigParser
+        """
+        reply, fds = self._request({'op' : 'login',
+                                    'username' : username,
+                                    'uid' : user_uid,
+                                    'gid' : user_gid,
+                                    'tty' : tty,
+                                    'config' : config_to_dict(config)})
+        if not fds:
+            raise BrokerError('Broker did not send the exec socket')
+        return reply['container_id'], reply['exec_id'], socket.socket(fileno=fds[0])
+
+    def exec_inspect(self, exec_id):
+        """Mimics ``docker.APIClient.exec_inspect``"""
+        reply, _ = self._request({'op' : 'exec_inspect', 'exec_id' : exec_id})
+        return reply['result']
+
+    def exec_resize(self, exec_id, height=None, width=None):
+        """Mimics ``docker.APIClient.exec_resize``"""
+        self._request({'op' : 'exec_resize', 'exec_id' : exec_id,
+                       'height' : height, 'width' : width})
+
+    def teardown(self, container_id, the_signal, config):
+        """Have the broker tear down the container once the user disconnects.
+
+        Returns once the broker has the request, not once the container is gone.
+
+        :Returns: None
+
+        :param container_id: The container the user was connected to.
+        :type container_id: String
+
+        :param the_signal: The Linux SIGNAL to send to the container in order to stop it.
+        :type the_signal: String
+
+        :param config: The defined settings (or defaults) that define the behavior
+                       of Container Shell.
+        :type config: configparser.ConfigParser
+        """
+        self._request({'op' : 'teardown',
+                       'container_id' : container_id,
+                       'signal' : the_signal,
+                       'config' : config_to_dict(config)})
+
+    def _request(self, message):
+        """Send a single request, and return the reply and any file descriptors"""
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            conn.settimeout(self.timeout)
+            try:
+                conn.connect(self.location)
+            except OSError as doh:
+                raise BrokerUnavailable('Unable to connect to broker: {}'.format(doh)) from doh
+            send_message(conn, message)
+            reply, fds = recv_message(conn)
+        finally:
+            conn.close()
+        if reply is None:
+            raise BrokerError('Broker closed the connection')
+        if 'error' in reply:
+            for a_fd in fds:
+                os.close(a_fd)
+            if reply.get('fallback'):
+                raise BrokerUnavailable(reply['error'])
+            raise BrokerError(reply['error'])
+        return reply, fds
+
+
+def send_message(conn, message, fds=()):
+    """Write a message, and optionally pass some file descriptors along with it.
+
+    :Returns: None
+
+    :param conn: The connection to write to.
+    :type conn: socket.socket
+
+    :param message: The JSON-able message to send.
+    :type message: Dictionary
+
+    :param fds: File descriptors to pass to the other process.
+    :type fds: List
+    """
+    payload = '{}\n'.format(json.dumps(message)).encode()
+    if fds:
+        ancillary = [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', fds))]
+        sent = conn.sendmsg([payload], ancillary)
+        payload = payload[sent:]
+    if payload:
+        conn.sendall(payload)
+
+
+def recv_message(conn):
+    """Read a message, along with any file descriptors passed with it.
+
+    Returns None for the message if the other side closed the connection.
+
+    :Returns: Tuple (Dictionary, List)
+
+    :param conn: The connection to read from.
+    :type conn: socket.socket
+    """
+    data = b''
+    fds = array.array('i')
+    while not data.endswith(b'\n'):
+        chunk, ancillary, _, _ = conn.recvmsg(4096, socket.CMSG_SPACE(fds.itemsize * 4))
+        for level, kind, cmsg_data in ancillary:
+            if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+                usable = len(cmsg_data) - (len(cmsg_data) % fds.itemsize)
+                fds.frombytes(cmsg_data[:usable])
+        if not chunk:
+            break
+        data += chunk
+        if len(data) > MAX_MESSAGE:
+            raise BrokerError('Message exceeds {} bytes'.format(MAX_MESSAGE))
+    if not data.endswith(b'\n'):
+        return None, list(fds)
+    return json.loads(data.decode()), list(fds)
+
+
+def config_to_dict(config):
+    """Serialize a config, so the broker uses the same settings as the login.
+
+    :Returns: Dictionary
+
+    :param config: The defined settings (or defaults) that define the behavior of Container Shell.
+    :type config: configparser.ConfigParser
+    """
+    return {section : dict(config[section]) for section in config.sections()}
+
+
+def config_from_dict(config_dict):
+    """The inverse of ``config_to_dict``
+
+    :Returns: configparser.ConfigParser
+
+    :param config_dict: The serialized config.
+    :type config_dict: Dictionary
+    """
+    config = ConfigParser()
+    config.read_dict(config_dict)
+    return config
+
+
+def serve(config, logger):
+    """Run the broker until it's killed.
+
+    :Returns: None
+
+    :param config: The defined settings (or defaults) that define the behavior of Container Shell.
+    :type config: configparser.ConfigParser
+
+    :param logger: An object for writing errors/messages for debugging problems
+    :type logger: logging.Logger
+    """
+    if os.getuid() != 0:
+        # The binary is setuid root; only the real root user may run the broker.
+        raise BrokerError('Only root may run the broker')
+    location = config['broker'].get('socket')
+    if not location:
+        raise BrokerError('No broker socket defined in the config')
+    os.makedirs(os.path.dirname(location), exist_ok=True)
+    if os.path.exists(location):
+        if _is_listening(location):
+            raise BrokerError('A broker is already listening on {}'.format(location))
+        os.unlink(location)
+    docker_client = dockage.local_client(config)
+    handler = functools.partial(_Handler, docker_client=docker_client, logger=logger)
+    # Only root (i.e. the setuid Container Shell) may connect.
+    prev_umask = os.umask(0o077)
+    try:
+        server = _Server(location, handler)
+    finally:
+        os.umask(prev_umask)
+    logger.info('Broker listening on %s', location)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.unlink(location)
+
+
+def _is_listening(location):
+    """Determine if some process accepts connections on the unix socket"""
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(location)
+    except OSError:
+        return False
+    finally:
+        conn.close()
+    return True
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """One thread per request, all sharing the same Docker client"""
+    daemon_threads = True
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    """Handles a single request from a login"""
+    def __init__(self, request, client_address, server, docker_client, logger): #pylint: disable=R0913
+        self.docker_client = docker_client
+        self.logger = logger
+        super().__init__(request, client_address, server)
+
+    def handle(self):
+        message, fds = recv_message(self.request)
+        for a_fd in fds:
+            os.close(a_fd)
+        if message is None:
+            return
+        close_after = []
+        try:
+            reply, reply_fds, close_after = dispatch(message, peer_uid(self.request),
+                                                     self.docker_client, self.logger)
+        except BrokerUnavailable as doh:
+            reply, reply_fds = {'error' : str(doh), 'fallback' : True}, []
+        except Exception as doh: #pylint: disable=W0703
+            self.logger.exception(doh)
+            reply, reply_fds = {'error' : str(doh)}, []
+        try:
+            send_message(self.request, reply, reply_fds)
+        finally:
+            # The login has its own copy of the socket now
+            for obj in close_after:
+                obj.close()
+
+
+def peer_uid(conn):
+    """Find the UID of the process on the other end of the unix socket
+
+    :Returns: Integer
+
+    :param conn: The connection from a login.
+    :type conn: socket.socket
+    """
+    creds = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+    _, uid, _ = struct.unpack('3i', creds)
+    return uid
+
+
+def dispatch(message, uid, docker_client, logger):
+    """Do the work for a single request.
+
+    :Returns: Tuple (reply, file descriptors to send, objects to close once sent)
+
+    :param message: The request from the login.
+    :type message: Dictionary
+
+    :param uid: The UID of the process that sent the request.
+    :type uid: Integer
+
+    :param docker_client: For communicating with the Docker daemon.
+    :type docker_client: docker.client.DockerClient
+
+    :param logger: An object for writing errors/messages for debugging problems
+    :type logger: logging.Logger
+    """
+    operation = message.get('op')
+    if operation == 'login':
+        return _login(message, uid, docker_client, logger)
+    if operation == 'exec_inspect':
+        return {'result' : docker_client.api.exec_inspect(message['exec_id'])}, [], []
+    if operation == 'exec_resize':
+        docker_client.api.exec_resize(message['exec_id'],
+                                      height=message['height'],
+                                      width=message['width'])
+        return {}, [], []
+    if operation == 'teardown':
+        # Reply right away, so the user's SSH session doesn't wait on Docker.
+        threading.Thread(target=_teardown, args=(message, docker_client, logger),
+                         name='teardown-{}'.format(message['container_id'][:12])).start()
+        return {}, [], []
+    raise BrokerError('Unknown operation: {}'.format(operation))
+
+
+def _login(message, uid, docker_client, logger):
+    """Find or create a container, and start an exec inside it"""
+    config = config_from_dict(message['config'])
+    if dockage.session_kind(config['config']['command']) != 'shared':
+        raise BrokerUnavailable('Broker only handles shared containers')
+    if not docker_client.api.base_url.startswith('http+docker://localhost'):
+        # TLS sockets can't be handed to another process.
+        raise BrokerUnavailable('Broker requires a unix socket connection to the daemon')
+    if uid == 0:
+        # The setuid Container Shell is trusted to say who the user is.
+        username, user_uid, user_gid = message['username'], message['uid'], message['gid']
+    else:
+        user_info = pwd.getpwuid(uid)
+        username, user_uid, user_gid = user_info.pw_name, user_info.pw_uid, user_info.pw_gid
+    tty = bool(message['tty'])
+    logger.info('Broker login for %s', username)
+    if not config['config'].get('auto_refresh').lower() == 'false':
+        refresh.update_image(docker_client, config, logger)
+    create_kwargs = dockage.build_args(config, username, user_uid, user_gid, logger)
+    create_kwargs['tty'] = tty
+    pooled = functools.partial(pool.claim, docker_client, config, username,
+                               user_uid, user_gid, logger)
+    container, _ = entry._get_container(docker_client, username, config, logger, #pylint: disable=W0212
+                                        pooled=pooled, **create_kwargs)
+    pool.refill_in_background(docker_client, config, logger)
+    exec_id = dockage.create_exec(docker_client, container, config, username, logger, tty=tty)
+    exec_socket = docker_client.api.exec_start(exec_id, socket=True, tty=tty)
+    reply = {'container_id' : container.id, 'exec_id' : exec_id}
+    return reply, [exec_socket.fileno()], [exec_socket]
+
+
+def _teardown(message, docker_client, logger):
+    """Tear down the container of a login that's already gone.
+
+    Shares the host's ``reaper_slots`` with the detached reapers.
+    """
+    config = config_from_dict(message['config'])
+    try:
+        container = docker_client.containers.get(message['container_id'])
+    except docker.errors.NotFound:
+        return
+    except Exception as doh: #pylint: disable=W0703
+        logger.exception(doh)
+        return
+    entry._reap(container.id, message['signal'], config, logger, #pylint: disable=W0212
+                container=container)
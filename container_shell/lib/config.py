@@ -1,13 +1,40 @@
 # -*- coding: UTF-8 -*-
 """Read the user-defined config file to dictate how to launch the continer"""
+import os
+import re
+import hashlib
+import marshal
+import logging
 from configparser import ConfigParser
 
+from container_shell.lib import utils
+
+dockage = utils.LazyImport('container_shell.lib.dockage')
+
 CONFIG_LOCATION = '/etc/container_shell/config.ini'
+# Can't live under the configured ``state_dir``; finding that means parsing the config.
+COMPILED_LOCATION = '/var/lib/container_shell/config.compiled'
+# Bump when the layout of the compiled config, or the default settings, change,
+# so old files are ignored.
+COMPILED_VERSION = 2
+# The sections that change *how* a container gets built. A change to any of
+# these means a container made before the change no longer matches the config.
+FINGERPRINT_SECTIONS = ('config', 'qos', 'mounts', 'dns')
+
 
+class Config(ConfigParser):
+    """A ConfigParser that can carry the values ``compile_config`` derived from it"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.compiled = {}
 
-def get_config(shell_command='', location=CONFIG_LOCATION):
+
+def get_config(shell_command='', location=CONFIG_LOCATION, compiled_location=COMPILED_LOCATION):
     """Read the supplied INI file, and return a usable object
 
+    If the INI file hasn't changed since it was last compiled, the compiled
+    version is used instead of parsing the INI file.
+
     :Returns: configparser.ConfigParser
 
     :param shell_command: Override the command to run in the shell with whatever
@@ -16,12 +43,22 @@ def get_config(shell_command='', location=CONFIG_LOCATION):
 
     :param location: The location of the config.ini file
     :type location: String
+
+    :param compiled_location: The location of the compiled config. Empty to always parse the INI.
+    :type compiled_location: String
     """
-    config = _default()
     using_defaults = False
+    compiled = load_compiled(location, compiled_location) if compiled_location else None
+    if compiled:
+        # Over the defaults, like the INI, in case a setting was added since it was compiled.
+        config = _default()
+        config.read_dict(compiled['sections'])
+        config.compiled = compiled['derived']
+    else:
+        config = _default()
     # Reading a user-defined config will cause any default values to be replaced
     # by the user-defined values.
-    if not config.read(location):
+    if not compiled and not config.read(location):
         # no config file exists. This section exists so we can communicate that
         # back up the stack.
         using_defaults = True
@@ -30,6 +67,159 @@ def get_config(shell_command='', location=CONFIG_LOCATION):
     return config, using_defaults, location
 
 
+def fingerprint(config):
+    """Create a stable hash of the settings that define how a container is built.
+
+    The ``command`` value is ignored because it's overridden per-login via the CLI.
+
+    :Returns: String
+
+    :param config: The defined settings (or defaults) that define the behavior of Container Shell.
+    :type config: configparser.ConfigParser
+    """
+    hasher = hashlib.sha256()
+    for section in FINGERPRINT_SECTIONS:
+        hasher.update('[{}]'.format(section).encode())
+        for key, value in sorted(config[section].items()):
+            if section == 'config' and key == 'command':
+                continue
+            hasher.update('{}={}\n'.format(key, value).encode())
+    return hasher.hexdigest()
+
+
+def compile_config(location=CONFIG_LOCATION, compiled_location=COMPILED_LOCATION):
+    """Validate the INI file, and save it along with the values derived from it.
+
+    Logins load the compiled config with a single read, instead of parsing the
+    INI file and re-deriving the container's QoS, mounts, and DNS settings.
+    Nothing is saved if the INI file is invalid.
+
+    :Returns: List
+
+    :param location: The location of the config.ini file
+    :type location: String
+
+    :param compiled_location: Where to save the compiled config.
+    :type compiled_location: String
+    """
+    key = _stat_key(location)
+    if key is None:
+        return ['Unable to read {}'.format(location)]
+    config = _default()
+    config.read(location)
+    errors = validate(config)
+    if errors:
+        return errors
+    compiled = {
+        'version' : COMPILED_VERSION,
+        'key' : key,
+        'sections' : {section : dict(config[section]) for section in config.sections()},
+        'derived' : {'template' : dockage.compile_template(config, logging.getLogger(__name__))},
+    }
+    os.makedirs(os.path.dirname(compiled_location), exist_ok=True)
+    tmp_location = '{}.{}.tmp'.format(compiled_location, os.getpid())
+    with open(tmp_location, 'wb') as the_file:
+        marshal.dump(compiled, the_file)
+    # Logins never see a partially written file
+    os.replace(tmp_location, compiled_location)
+    return []
+
+
+def load_compiled(location, compiled_location):
+    """Load the compiled config, if it was compiled from the current INI file.
+
+    :Returns: Dictionary or None
+
+    :param location: The location of the config.ini file
+    :type location: String
+
+    :param compiled_location: The location of the compiled config.
+    :type compiled_location: String
+    """
+    key = _stat_key(location)
+    if key is None:
+        return None
+    try:
+        with open(compiled_location, 'rb') as the_file:
+            compiled = marshal.load(the_file)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    if not isinstance(compiled, dict) or compiled.get('version') != COMPILED_VERSION:
+        return None
+    if compiled.get('key') != key:
+        return None
+    return compiled
+
+
+def _stat_key(location):
+    """Identifies a version of the INI file without reading it"""
+    try:
+        info = os.stat(location)
+    except OSError:
+        return None
+    return (info.st_dev, info.st_ino, info.st_size, info.st_mtime_ns)
+
+
+def validate(config):
+    """Find the values in a config that Container Shell can't use.
+
+    :Returns: List
+
+    :param config: The defined settings (or defaults) that define the behavior of Container Shell.
+    :type config: configparser.ConfigParser
+    """
+    errors = []
+    numbers = (('config', 'docker_timeout', int),
+               ('config', 'refresh_ttl', int),
+               ('config', 'state_ttl', int),
+               ('config', 'reaper_slots', int),
+               ('config', 'exec_grace', float),
+               ('logging', 'max_size', int),
+               ('logging', 'max_count', int),
+               ('pool', 'size', int),
+               ('qos', 'cpus', float),
+               ('qos', 'device_read_iops', int),
+               ('qos', 'device_write_iops', int),
+               ('qos', 'device_read_bps', int),
+               ('qos', 'device_write_bps', int))
+    for section, key, caster in numbers:
+        value = config[section].get(key, '')
+        if not value:
+            continue
+        try:
+            caster(value)
+        except ValueError:
+            errors.append('[{}] {}: expected {}, supplied {!r}'.format(section, key,
+                                                                      caster.__name__,
+                                                                      value))
+    provision = config['config'].get('provision', fallback='useradd')
+    if provision.lower() not in ('useradd', 'mount'):
+        errors.append('[config] provision: expected useradd or mount, supplied {!r}'.format(
+            provision))
+    if config['config'].get('pty_engine').lower() not in ('select', 'asyncio'):
+        errors.append('[config] pty_engine: expected select or asyncio, supplied {!r}'.format(
+            config['config'].get('pty_engine')))
+    if config['config'].get('background_refresh').lower() == 'true':
+        ttl = config['config'].get('refresh_ttl').strip()
+        if not (ttl.isdigit() and int(ttl) > 0):
+            errors.append('[config] background_refresh: requires a refresh_ttl above 0')
+    level = config['logging'].get('level').upper()
+    if not isinstance(logging.getLevelName(level), int):
+        errors.append('[logging] level: unknown level {!r}'.format(level))
+    try:
+        re.compile(config['config'].get('persist_egrep'))
+    except re.error as doh:
+        errors.append('[config] persist_egrep: {}'.format(doh))
+    for local_dir, container_dir in config['mounts'].items():
+        if not os.path.isabs(local_dir):
+            errors.append('[mounts] {}: host path must be absolute'.format(local_dir))
+        for mount_point in container_dir.replace(':ro', '').split(','):
+            if not os.path.isabs(mount_point.strip()):
+                msg = '[mounts] {}: container path {!r} must be absolute'
+                errors.append(msg.format(local_dir, mount_point))
+    return errors
+
+
 def _default():
     """Ensure the config object has the required minimum definitions
 
@@ -38,13 +228,15 @@ def _default():
     :param config: The config object to mutate
     :type config: configparser.ConfigParser
     """
-    config = ConfigParser()
+    config = Config()
     config.add_section('config')
     config.add_section('logging')
     config.add_section('dns')
     config.add_section('mounts')
     config.add_section('qos')
     config.add_section('binaries')
+    config.add_section('pool')
+    config.add_section('broker')
 
     config.set('config', 'image', 'debian:latest')
     config.set('config', 'hostname', 'someserver')
@@ -57,6 +249,16 @@ def _default():
     config.set('config', 'auto_remove', 'true')
     config.set('config', 'persist', '')
     config.set('config', 'persist_egrep', 'screen|tmux|coreutils')
+    config.set('config', 'state_dir', '/var/lib/container_shell')
+    config.set('config', 'refresh_ttl', '0')
+    config.set('config', 'background_refresh', 'false')
+    config.set('config', 'provision', 'useradd')
+    config.set('config', 'state_ttl', '60')
+    config.set('config', 'splice', 'false')
+    config.set('config', 'pty_engine', 'select')
+    config.set('config', 'log_latency', 'false')
+    config.set('config', 'reaper_slots', '4')
+    config.set('config', 'exec_grace', '60')
     config.set('logging', 'location', '/var/log/container_shell/messages.log')
     config.set('logging', 'max_size', '1024000') # 1MB
     config.set('logging', 'max_count', '3')
@@ -67,5 +269,7 @@ def _default():
     config.set('binaries', 'grep', '/usr/bin/grep')
     config.set('binaries', 'ps', '/usr/bin/ps')
     config.set('binaries', 'id', '/usr/bin/id')
+    config.set('pool', 'size', '0')
+    config.set('broker', 'socket', '')
 
     return config
@@ -1,10 +1,44 @@
 # -*- coding: UTF-8 -*-
 """Functions to help construct the docker container"""
+import os
 import sys
+import time
 import uuid
 
 import docker
 
+from container_shell.lib.config import fingerprint
+
+# Written to the container's output once the user's identity exists, so a
+# login can follow the container's logs instead of polling for the user.
+READY_MARKER = '__container_shell_ready__'
+# Every container made by Container Shell is labeled, so it can be found via
+# the daemon's filters instead of inspecting every container on the host.
+LABEL_USER = 'container_shell.user'
+LABEL_SESSION = 'container_shell.session'
+LABEL_CONFIG = 'container_shell.config'
+LABEL_CREATED = 'container_shell.created'
+# With ``provision=mount``, the shell every user gets inside the container.
+LOGIN_SHELL = '/bin/bash'
+# The host's own Docker daemon. Modes only root may run connect here, and
+# never to whatever DOCKER_HOST the caller of the setuid binary set.
+DOCKER_SOCKET = 'unix://var/run/docker.sock'
+# Where the host mounts the proc and cgroup filesystems.
+PROC_ROOT = '/proc'
+CGROUP_ROOT = '/sys/fs/cgroup'
+
+
+def local_client(config):
+    """Connect to the host's Docker daemon, ignoring the environment.
+
+    :Returns: docker.client.DockerClient
+
+    :param config: The defined settings (or defaults) that define the behavior of Container Shell.
+    :type config: configparser.ConfigParser
+    """
+    return docker.DockerClient(base_url=DOCKER_SOCKET,
+                               timeout=config['config'].getint('docker_timeout'))
+
 
 def build_args(config, username, user_uid, user_gid, logger):
     """Construct the arguments to use when creating the container
@@ -26,27 +60,255 @@ def build_args(config, username, user_uid, user_gid, logger):
     :param logger: An object for writing message to a file
     :type logger:
     """
-    qos_args = qos(config['qos'], logger)
-    container_kwargs = {
-        'image' : config['config'].get('image'),
-        'hostname' : config['config'].get('hostname'),
+    container_kwargs = create_template(config, logger)
+    container_kwargs.update({
         'tty' : sys.stdout.isatty(),
-        'init' : True,
-        'stdin_open' : True,
-        'dns' : dns(config['dns']['servers']),
-        'mounts' : mounts(config['mounts']),
         'command' : container_command(username=username,
                                       user_uid=user_uid,
                                       user_gid=user_gid,
                                       create_user=config['config']['create_user'],
                                       command=config['config']['command'],
                                       runuser=config['binaries']['runuser'],
-                                      useradd=config['binaries']['useradd']),
+                                      useradd=config['binaries']['useradd'],
+                                      ready_marker=_ready_marker(config['config']['command'])),
         'name' : generate_name(username, config['config']['command']),
+        'labels' : labels(config, username, session_kind(config['config']['command'])),
+    })
+    if provision_mode(config) == 'mount':
+        container_kwargs.update(identity_args(config, username, user_uid, user_gid,
+                                              container_kwargs['mounts']))
+    return container_kwargs
+
+
+def provision_mode(config):
+    """Determine how the user's identity is recreated inside the container.
+
+    ``useradd`` runs ``groupadd`` and ``useradd`` when the container starts.
+    ``mount`` bind mounts passwd and group files generated on the host, and
+    starts the container as the user, so the user exists the moment the
+    container starts.
+
+    :Returns: String
+
+    :param config: The defined settings (or defaults) that define the behavior of Container Shell.
+    :type config: configparser.ConfigParser
+    """
+    if not _should_create_user(config['config']['create_user']):
+        return ''
+    if config['config'].get('provision', fallback='useradd').lower() == 'mount':
+        return 'mount'
+    return 'useradd'
+
+
+#pylint: disable=R0913
+def identity_args(config, username, user_uid, user_gid, the_mounts):
+    """Construct the arguments that start the container as the user, for ``provision=mount``.
+
+    :Returns: Dictionary
+
+    :param config: The defined settings (or defaults) to use when creating the container
+    :type config: configparser.ConfigParser
+
+    :param username: The name of the user executing 'container_shell'
+    :param username: String
+
+    :param user_uid: The user-id (UID) of the user executing 'container_shell'
+    :type user_uid: Integer
+
+    :param user_gid: The group-id (GID) of the user executing 'container_shell'
+    :type user_gid: Integer
+
+    :param the_mounts: The mounts defined in the config.
+    :type the_mounts: List
+    """
+    home = '/home/{}'.format(username)
+    passwd, group = write_identity(config, username, user_uid, user_gid)
+    args = {
+        'user' : '{}:{}'.format(user_uid, user_gid),
+        'working_dir' : home,
+        'environment' : {'HOME' : home, 'USER' : username, 'LOGNAME' : username},
+        'command' : login_command(config['config']['command']),
+        # A new list; the mounts might belong to the compiled config.
+        'mounts' : the_mounts + [
+            docker.types.Mount(source=passwd, target='/etc/passwd', read_only=True, type='bind'),
+            docker.types.Mount(source=group, target='/etc/group', read_only=True, type='bind'),
+        ],
+    }
+    if not _is_mounted(home, the_mounts):
+        # Nothing from the host, so give the user a place to write like ``useradd -m`` would.
+        args['tmpfs'] = {home : 'uid={},gid={},mode=0700'.format(user_uid, user_gid)}
+    return args
+
+
+def write_identity(config, username, user_uid, user_gid):
+    """Generate the passwd and group files that define the user inside the container.
+
+    The files are only rewritten when their contents change, so containers that
+    already bind mount them are left alone.
+
+    :Returns: Tuple (passwd location, group location)
+
+    :param config: The defined settings (or defaults) to use when creating the container
+    :type config: configparser.ConfigParser
+
+    :param username: The name of the user executing 'container_shell'
+    :param username: String
+
+    :param user_uid: The user-id (UID) of the user executing 'container_shell'
+    :type user_uid: Integer
+
+    :param user_gid: The group-id (GID) of the user executing 'container_shell'
+    :type user_gid: Integer
+    """
+    directory = os.path.join(config['config'].get('state_dir'), 'identity', username)
+    os.makedirs(directory, exist_ok=True)
+    passwd = ['root:x:0:0:root:/root:/bin/bash',
+              'nobody:x:65534:65534:nobody:/nonexistent:/usr/sbin/nologin',
+              '{0}:x:{1}:{2}::/home/{0}:{3}'.format(username, user_uid, user_gid, LOGIN_SHELL)]
+    group = ['root:x:0:',
+             'nogroup:x:65534:',
+             '{0}:x:{1}:'.format(username, user_gid)]
+    passwd_location = _write_if_changed(os.path.join(directory, 'passwd'), passwd)
+    group_location = _write_if_changed(os.path.join(directory, 'group'), group)
+    return passwd_location, group_location
+
+
+def _write_if_changed(location, lines):
+    """Atomically replace a file, unless it already holds the lines.
+
+    :Returns: String (the location)
+
+    :param location: The absolute path to the file.
+    :type location: String
+
+    :param lines: The lines that make up the file.
+    :type lines: List
+    """
+    contents = '\n'.join(lines) + '\n'
+    try:
+        with open(location, encoding='utf-8') as the_file:
+            current = the_file.read()
+    except OSError:
+        current = None
+    if current != contents:
+        tmp_location = '{}.{}.tmp'.format(location, os.getpid())
+        with open(tmp_location, 'w', encoding='utf-8') as the_file:
+            the_file.write(contents)
+        os.chmod(tmp_location, 0o644)
+        os.replace(tmp_location, location)
+    return location
+
+
+def login_command(command):
+    """The command to run as the user, for ``provision=mount``.
+
+    A list, so the command doesn't need to be quoted for a shell.
+
+    :Returns: List
+
+    :param command: Override the default login shell.
+    :type command: String
+    """
+    if command:
+        return [LOGIN_SHELL, '-c', command]
+    return [LOGIN_SHELL, '-l']
+
+
+def _is_mounted(path, the_mounts):
+    """Determine if a path inside the container is provided by one of the mounts"""
+    for a_mount in the_mounts:
+        target = a_mount['Target'].rstrip('/')
+        if path == target or path.startswith(target + '/'):
+            return True
+    return False
+
+
+def create_template(config, logger):
+    """The arguments for creating a container that are the same for every user.
+
+    Uses the template saved by ``--compile-config`` when the config has one.
+
+    :Returns: Dictionary
+
+    :param config: The defined settings (or defaults) to use when creating the container
+    :type config: configparser.ConfigParser
+
+    :param logger: An object for writing message to a file
+    :type logger: logging.Logger
+    """
+    template = getattr(config, 'compiled', {}).get('template')
+    if template is None:
+        template = compile_template(config, logger)
+    return dict(template)
+
+
+def compile_template(config, logger):
+    """Derive the arguments for creating a container that are the same for every user.
+
+    Only contains builtin types, so the result can be saved with ``marshal``.
+
+    :Returns: Dictionary
+
+    :param config: The defined settings (or defaults) to use when creating the container
+    :type config: configparser.ConfigParser
+
+    :param logger: An object for writing message to a file
+    :type logger: logging.Logger
+    """
+    template = {
+        'image' : config['config'].get('image'),
+        'hostname' : config['config'].get('hostname'),
+        'init' : True,
+        'stdin_open' : True,
+        'dns' : dns(config['dns']['servers']),
+        'mounts' : [dict(a_mount) for a_mount in mounts(config['mounts'])],
         'auto_remove' : config['config']['auto_remove'].lower().startswith('t'),
     }
-    container_kwargs.update(qos_args)
-    return container_kwargs
+    template.update(qos(config['qos'], logger))
+    return template
+
+
+def labels(config, username, session):
+    """Construct the labels that identify a container made by Container Shell.
+
+    :Returns: Dictionary
+
+    :param config: The defined settings (or defaults) to use when creating the container
+    :type config: configparser.ConfigParser
+
+    :param username: The name of the user the container is for. Empty for pooled containers.
+    :type username: String
+
+    :param session: The kind of session the container is for; shared, standalone, or pool.
+    :type session: String
+    """
+    return {
+        LABEL_USER : username,
+        LABEL_SESSION : session,
+        LABEL_CONFIG : fingerprint(config),
+        LABEL_CREATED : str(int(time.time())),
+    }
+
+
+def _ready_marker(command):
+    # Standalone containers are attached to directly, so echoing anything
+    # would corrupt the SCP/SFTP protocol.
+    if session_kind(command) == 'shared':
+        return READY_MARKER
+    return ''
+
+
+def session_kind(command):
+    """Determine if the session runs in the user's shared container, or its own standalone one.
+
+    :Returns: String
+
+    :param command: The command being ran inside the container.
+    :type command: String
+    """
+    if command.startswith('scp') or command.endswith('sftp-server'):
+        return 'standalone'
+    return 'shared'
 
 
 def dns(addrs):
@@ -101,7 +363,8 @@ def mounts(mount_dict):
     return the_mounts
 
 #pylint: disable=R0913
-def container_command(username, user_uid, user_gid, create_user, command, runuser, useradd):
+def container_command(username, user_uid, user_gid, create_user, command, runuser, useradd,
+                      ready_marker=''):
     """Constructs the command to run within the container.
 
     Command created will create a user to execute a command within the container.
@@ -133,6 +396,9 @@ def container_command(username, user_uid, user_gid, create_user, command, runuse
     :param useradd: **Required** The absolute file path to the ``useradd`` command
                     inside the container
     :type usseradd: String
+
+    :param ready_marker: Optionally echo this value once the user has been created.
+    :type ready_marker: String
     """
     if _should_create_user(create_user):
         if command:
@@ -141,13 +407,12 @@ def container_command(username, user_uid, user_gid, create_user, command, runuse
         else:
             # if not a specific command, treat this as a login shell
             run_user = '{0} {1} -l {2}'.format(runuser, username, command)
-        make_group = '/usr/sbin/groupadd --gid {0} {1}'.format(user_gid, username)
-        make_user = '{0} -m --uid {1} --gid {2} -s /bin/bash {3} 2>/dev/null'.format(useradd,
-                                                                                     user_uid,
-                                                                                     user_gid,
-                                                                                     username)
-
+        make_group, make_user = _identity_commands(username, user_uid, user_gid, useradd)
         fix_pty_ownership = 'chown {0}:{0} /dev/pts/0 2>/dev/null'.format(username)
+        if ready_marker:
+            # Whether or not useradd made the user; it fails if the image already has them.
+            is_ready = 'id -u {0} >/dev/null 2>&1 && echo {1}'.format(username, ready_marker)
+            fix_pty_ownership = '{0} ; {1}'.format(fix_pty_ownership, is_ready)
         switch_dir = 'cd /home/{} 2>/dev/null'.format(username)
         everything = "/bin/bash -c '{0} && {1} && {2} ; {3} ; {4}'".format(make_group,
                                                                            make_user,
@@ -161,11 +426,51 @@ def container_command(username, user_uid, user_gid, create_user, command, runuse
     return everything
 
 
-def exec_command(container, config, username):
-    """The command to execute in the container.
+def provision_command(username, user_uid, user_gid, create_user, useradd):
+    """Constructs the command to recreate a user inside an already running container.
+
+    Used when a login claims an idle container from the warm pool, so the
+    identity is created with a single ``exec`` instead of at container start.
 
     :Returns: String
 
+    :param username: **Required** The name of user to create within the container
+    :type username: String
+
+    :param user_uid: **Required** The UID of the user to create within the container
+    :Type user_uid: Integer
+
+    :param user_gid: **Required** The GID of the user to create within the container
+    :Type user_gid: Integer
+
+    :param create_user: Recreate the user identity inside the container.
+    :type create_user: Boolean
+
+    :param useradd: **Required** The absolute file path to the ``useradd`` command
+                    inside the container
+    :type usseradd: String
+    """
+    if not _should_create_user(create_user):
+        return ''
+    make_group, make_user = _identity_commands(username, user_uid, user_gid, useradd)
+    return "/bin/bash -c '{0} && {1}'".format(make_group, make_user)
+
+
+def _identity_commands(username, user_uid, user_gid, useradd):
+    """Returns the ``groupadd`` and ``useradd`` syntax for recreating a user's identity"""
+    make_group = '/usr/sbin/groupadd --gid {0} {1}'.format(user_gid, username)
+    make_user = '{0} -m --uid {1} --gid {2} -s /bin/bash {3} 2>/dev/null'.format(useradd,
+                                                                                 user_uid,
+                                                                                 user_gid,
+                                                                                 username)
+    return make_group, make_user
+
+
+def exec_command(container, config, username, image=None):
+    """The command to execute in the container.
+
+    :Returns: String, or a List for ``provision=mount``
+
     :param container: The container to run a command against/inside of.
     :type container: docker.models.containers.Container
 
@@ -174,12 +479,18 @@ def exec_command(container, config, username):
 
     :param username: The name of the user executing ContainerShell.
     :type username: String
+
+    :param image: The container's image, if it was already fetched.
+    :type image: docker.models.images.Image
     """
+    if provision_mode(config) == 'mount':
+        return login_command(config['config']['command'])
     if _should_create_user(config['config']['create_user']):
         user = username
     else:
         # User is an empty string when the default user for an image is root
-        user = container.image.attrs['Config']['User'] or 'root'
+        image = image or container.image
+        user = image.attrs['Config']['User'] or 'root'
     override = config['config']['command']
     if override:
         syntax = '{} {} -c "{}"'.format(config['binaries']['runuser'],
@@ -190,7 +501,7 @@ def exec_command(container, config, username):
     return syntax
 
 
-def create_exec(docker_client, container, config, username, logger): #pylint: disable=W0613
+def create_exec(docker_client, container, config, username, logger, tty=None, image=None): #pylint: disable=W0613,R0913
     """Register a command to run against a container.
 
     :Returns: Dictionary
@@ -209,17 +520,108 @@ def create_exec(docker_client, container, config, username, logger): #pylint: di
 
     :param logger: An object for writing errors/messages for debugging problems
     :type logger: logging.Logger
+
+    :param tty: Allocate a TTY for the exec. Defaults to if stdin is a TTY.
+    :type tty: Boolean
+
+    :param image: The container's image, if it was already fetched.
+    :type image: docker.models.images.Image
     """
-    exec_cmd = exec_command(container, config, username)
+    if tty is None:
+        tty = sys.stdin.isatty()
+    exec_cmd = exec_command(container, config, username, image=image)
+    # Without ``runuser``, the daemon has to switch to the user. The name is
+    # resolved via the passwd file mounted into the container.
+    user = username if provision_mode(config) == 'mount' else ''
     exec_id = docker_client.api.exec_create(container.id,
                                             exec_cmd,
-                                            tty=sys.stdin.isatty(),
+                                            tty=tty,
                                             stdin=True,
                                             stdout=True,
-                                            stderr=True)
+                                            stderr=True,
+                                            user=user)
     return exec_id
 
 
+def processes(container, ps_path):
+    """Yields the command line of every process running inside the container.
+
+    The processes are found via the container's cgroup, and read from the
+    host's /proc, so nothing runs inside the container. When that isn't
+    possible (i.e. Container Shell can't see the host's PIDs), the Docker
+    ``top`` API is used, and failing that, ``ps`` is ran inside the container.
+
+    :Returns: Generator
+
+    :param container: A running container; its attributes must be current.
+    :type container: docker.models.containers.Container
+
+    :param ps_path: The absolute path location to the ``ps`` command in the container.
+    :type ps_path: String
+    """
+    pids = _cgroup_pids(container)
+    if pids:
+        for pid in pids:
+            command = _proc_command(pid)
+            if command:
+                yield command
+        return
+    try:
+        rows = container.top().get('Processes') or []
+    except docker.errors.NotFound:
+        raise
+    except docker.errors.APIError:
+        # The daemon runs ``ps`` on its host, which might not have one.
+        _, ps_output = container.exec_run('{} auxwww'.format(ps_path.replace(';', '')))
+        rows = [[line] for line in ps_output.decode(errors='ignore').splitlines()]
+    for row in rows:
+        yield ' '.join(row)
+
+
+def _cgroup_pids(container):
+    """The host PIDs in the container's cgroup; None if they can't be read"""
+    pid = (container.attrs.get('State') or {}).get('Pid')
+    if not pid:
+        return None
+    try:
+        with open(os.path.join(PROC_ROOT, str(pid), 'cgroup'), encoding='utf-8') as the_file:
+            lines = the_file.read().splitlines()
+    except OSError:
+        return None
+    for line in lines:
+        _, controllers, path = line.split(':', 2)
+        if container.id not in path:
+            # A PID from some other PID namespace.
+            continue
+        path = path.lstrip('/')
+        if controllers:
+            # cgroup v1 has a hierarchy per controller.
+            locations = [os.path.join(CGROUP_ROOT, name.replace('name=', ''), path)
+                         for name in controllers.split(',')]
+        else:
+            locations = [os.path.join(CGROUP_ROOT, path)]
+        for location in locations:
+            try:
+                with open(os.path.join(location, 'cgroup.procs'), encoding='utf-8') as the_file:
+                    # Empty when the container made child cgroups of its own.
+                    return [int(pid) for pid in the_file.read().split()] or None
+            except OSError:
+                continue
+    return None
+
+
+def _proc_command(pid):
+    """The name and command line of a host process; empty if it's already exited"""
+    try:
+        with open(os.path.join(PROC_ROOT, str(pid), 'comm'), 'rb') as the_file:
+            comm = the_file.read().rstrip(b'\n')
+        with open(os.path.join(PROC_ROOT, str(pid), 'cmdline'), 'rb') as the_file:
+            cmdline = the_file.read().replace(b'\0', b' ')
+    except OSError:
+        return ''
+    return '{} {}'.format(comm.decode(errors='ignore'), cmdline.decode(errors='ignore'))
+
+
 def _should_create_user(create_user):
     # the config object has a terrible "return binary" function, so check the
     # literal string value... Checking for "not false" makes it default to create
@@ -238,7 +640,7 @@ def generate_name(username, command):
     :param command: The command being ran inside the container.
     :type command: String
     """
-    if command.startswith('scp') or command.endswith('sftp-server'):
+    if session_kind(command) == 'standalone':
         # SCP & SFTP commands run in their own, standalone containers.
         # So they need a unique name.
         name = '{}-{}'.format(username, uuid.uuid4().hex[:6])
@@ -21,8 +21,11 @@ import os
 import fcntl
 import errno
 import struct
+import itertools
+import selectors
+import collections
+from ssl import SSLSocket, SSLWantReadError
 import select as builtin_select
-import six
 
 #pylint: disable=C0103
 def set_blocking(fd, blocking=True):
@@ -65,6 +68,175 @@ def select(read_streams, write_streams, timeout=0):
         raise doh
 
 
+class Selector:
+    """
+    Persistent readiness registrations, built on the `selectors` module.
+
+    Unlike `select()`, interest in an object is registered once, and kept
+    between calls. Callers only tell the Selector when interest changes (e.g.
+    a Stream's write buffer goes from empty to non-empty), so a wakeup costs
+    work proportional to the number of ready objects instead of every object
+    being watched. Uses epoll/kqueue when available, so it isn't limited by
+    FD_SETSIZE.
+
+    Any object with a `fileno()` can be watched. A reader and a writer may share
+    the same file descriptor (i.e. a Pump reading from the same socket a Stream
+    writes to).
+    """
+    def __init__(self):
+        self._selector = selectors.DefaultSelector()
+        self._readers = {}
+        self._writers = {}
+        self._fds = {}
+
+    def set_reading(self, obj, enabled=True):
+        """
+        Turn interest in `obj` being readable on or off.
+        """
+        self._update(obj, self._readers, enabled)
+
+    def set_writing(self, obj, enabled=True):
+        """
+        Turn interest in `obj` being writable on or off.
+        """
+        self._update(obj, self._writers, enabled)
+
+    def remove(self, obj):
+        """
+        Stop watching `obj` entirely. Safe to call after `obj` has been closed.
+        """
+        self.set_reading(obj, False)
+        self.set_writing(obj, False)
+
+    def select(self, timeout=None):
+        """
+        Wait up to `timeout` seconds, and return two lists of the objects that
+        are ready for reading, and ready for writing.
+        """
+        try:
+            events = self._selector.select(timeout)
+        except OSError as doh:
+            # POSIX signals interrupt select()
+            if doh.errno == errno.EINTR:
+                return ([], [])
+            raise doh
+        read_ready = []
+        write_ready = []
+        for key, mask in events:
+            if mask & selectors.EVENT_READ and key.fd in self._readers:
+                read_ready.append(self._readers[key.fd])
+            if mask & selectors.EVENT_WRITE and key.fd in self._writers:
+                write_ready.append(self._writers[key.fd])
+        return read_ready, write_ready
+
+    def close(self):
+        """
+        Release the underlying selector.
+        """
+        self._selector.close()
+
+    def _update(self, obj, interest, enabled):
+        fd = self._fds.get(obj)
+        if fd is None:
+            if not enabled:
+                return
+            # Remembered, so the registration can be removed after obj is closed.
+            fd = obj.fileno()
+            self._fds[obj] = fd
+        if enabled == (interest.get(fd) is obj):
+            return
+        if enabled:
+            interest[fd] = obj
+        else:
+            del interest[fd]
+            if self._readers.get(fd) is not obj and self._writers.get(fd) is not obj:
+                del self._fds[obj]
+        mask = 0
+        if fd in self._readers:
+            mask |= selectors.EVENT_READ
+        if fd in self._writers:
+            mask |= selectors.EVENT_WRITE
+        registered = fd in self._selector.get_map()
+        if not mask:
+            self._selector.unregister(fd)
+        elif registered:
+            self._selector.modify(fd, mask)
+        else:
+            self._selector.register(fd, mask)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.close()
+
+    def __repr__(self):
+        return "{cls}(readers={readers}, writers={writers})".format(
+            cls=type(self).__name__,
+            readers=len(self._readers),
+            writers=len(self._writers))
+
+
+class Notifier:
+    """
+    Wakes up a Selector from another thread.
+
+    The read end of a pipe is what gets selected on; ``notify`` writes a byte
+    to the other end.
+    """
+
+    def __init__(self):
+        self._read_fd, self._write_fd = os.pipe2(os.O_NONBLOCK | os.O_CLOEXEC)
+        self.closed = False
+
+    def fileno(self):
+        """
+        Returns the end of the pipe to select on.
+        """
+        return self._read_fd
+
+    def notify(self):
+        """
+        Make the Notifier readable. Safe to call from any thread, or more than once.
+        """
+        try:
+            os.write(self._write_fd, b'\0')
+        except OSError:
+            # Either the pipe is full, so it's already readable, or the
+            # Notifier was closed at the end of the session.
+            pass
+
+    def clear(self):
+        """
+        Consume any pending notifications; returns True if there were some.
+        """
+        notified = False
+        try:
+            while os.read(self._read_fd, 4096):
+                notified = True
+        except BlockingIOError:
+            pass
+        return notified
+
+    def close(self):
+        """
+        Close both ends of the pipe.
+        """
+        if not self.closed:
+            self.closed = True
+            os.close(self._read_fd)
+            os.close(self._write_fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.close()
+
+    def __repr__(self):
+        return "{cls}({fd})".format(cls=type(self).__name__, fd=self._read_fd)
+
+
 class Stream:
     """
     Generic Stream class.
@@ -77,18 +249,52 @@ class Stream:
         errno.EDEADLK,
         errno.EWOULDBLOCK,
     ]
+    # Limits on a single sendmsg()/writev() call. Anything past what the kernel
+    # buffer can take only adds to the cost of the call.
+    MAX_IOV = 64
+    MAX_GATHER = 256 * 1024
+    # Once this much is pending, the Stream is full until it drains to LOW_WATER.
+    HIGH_WATER = 1024 * 1024
+    LOW_WATER = 256 * 1024
 
-    def __init__(self, fd):
+    def __init__(self, fd, high_water=HIGH_WATER, low_water=LOW_WATER):
         """
         Initialize the Stream for the file descriptor `fd`.
 
         The `fd` object must have a `fileno()` method.
+
+        A Pump stops reading into the Stream once `high_water` bytes are
+        waiting to be written, until only `low_water` bytes are left.
         """
         self.fd = fd
-        self.buffer = b''
+        self.high_water = high_water
+        self.low_water = low_water
+        self.full = False
+        # Pending writes are a queue of memoryviews. A partial write slices the
+        # first view instead of copying everything that's still pending, so a
+        # large backlog costs the same per write as a small one.
+        self._chunks = collections.deque()
+        self._pending = 0
+        self._gather = True
         self.close_requested = False
         self.closed = False
 
+    @property
+    def buffer(self):
+        """
+        The data waiting to be written. Builds a copy, so it's meant for debugging.
+        """
+        return b''.join(self._chunks)
+
+    @buffer.setter
+    def buffer(self, data):
+        self._chunks.clear()
+        self._pending = 0
+        if data:
+            self._chunks.append(memoryview(bytes(data)))
+            self._pending = len(data)
+        self.full = self._pending >= self.high_water
+
     def fileno(self):
         """
         Return the fileno() of the file descriptor.
@@ -102,9 +308,12 @@ class Stream:
             return True
         return set_blocking(self.fd, value)
 
-    def read(self, n=4096):
+    def read(self, n=4096, wait=True):
         """
         Return `n` bytes of data from the Stream, or None at end of stream.
+
+        If `wait` is False, a non-blocking file descriptor with nothing to
+        read raises BlockingIOError, instead of being retried.
         """
         while True:
             try:
@@ -112,6 +321,25 @@ class Stream:
                     return self.fd.recv(n)
                 return os.read(self.fd.fileno(), n)
             except EnvironmentError as doh:
+                if not wait and isinstance(doh, BlockingIOError):
+                    raise doh
+                if doh.errno not in Stream.ERRNO_RECOVERABLE:
+                    raise doh
+
+    def read_into(self, buffer, wait=True):
+        """
+        Read into `buffer`, and return the number of bytes read; zero at end of stream.
+
+        The `wait` flag behaves the same as for `read`.
+        """
+        while True:
+            try:
+                if hasattr(self.fd, 'recv_into'):
+                    return self.fd.recv_into(buffer)
+                return os.readv(self.fd.fileno(), [buffer])
+            except EnvironmentError as doh:
+                if not wait and isinstance(doh, BlockingIOError):
+                    raise doh
                 if doh.errno not in Stream.ERRNO_RECOVERABLE:
                     raise doh
 
@@ -120,6 +348,13 @@ class Stream:
         Use select to find when the stream is writeable, and call do_write()
         to flush the internal buffer. Returns the number of bytes written.
 
+        Data is always accepted, but the Stream is marked `full` once the
+        pending data passes the high water mark.
+
+        Immutable data (i.e. bytes) is buffered without being copied. Anything
+        else (i.e. a view into a reused bytearray) is copied, but only the part
+        that couldn't be written right away.
+
         :Returns: Integer
 
         :param data: The stuff to write to the stream
@@ -128,39 +363,86 @@ class Stream:
         if not data:
             return 0
 
-        self.buffer += data
+        view = memoryview(data)
+        self._chunks.append(view)
+        self._pending += len(view)
         self.do_write()
+        if self._pending >= self.high_water:
+            self.full = True
+        if not view.readonly and self._chunks and self._chunks[-1].obj is view.obj:
+            # The caller is free to reuse its buffer once we return.
+            self._chunks[-1] = memoryview(bytes(self._chunks[-1]))
 
         return len(data)
 
     def do_write(self):
         """
         Flushes as much pending data from the internal write buffer as possible.
+
+        Several pending chunks are written with a single sendmsg()/writev()
+        call. Returns zero, and keeps the data buffered, if the file descriptor
+        isn't ready for more.
         """
         while True:
             try:
                 written = 0
 
-                if hasattr(self.fd, 'send'):
-                    written = self.fd.send(self.buffer)
-                else:
-                    written = os.write(self.fd.fileno(), self.buffer)
-
-                self.buffer = self.buffer[written:]
+                if self._chunks:
+                    written = self._send(self._gather_chunks())
+                    self._consume(written)
 
                 # try to close after writes if a close was requested
-                if self.close_requested and len(self.buffer) == 0: #pylint: disable=C1801
+                if self.close_requested and not self._pending:
                     self.close()
                 return written
             except EnvironmentError as doh:
+                if doh.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return 0
                 if doh.errno not in Stream.ERRNO_RECOVERABLE:
                     raise doh
 
+    def _gather_chunks(self):
+        """The pending chunks to hand to a single write call"""
+        chunks = []
+        size = 0
+        for chunk in itertools.islice(self._chunks, Stream.MAX_IOV):
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= Stream.MAX_GATHER:
+                break
+        return chunks
+
+    def _send(self, chunks):
+        """Write some pending chunks, returning how many bytes were written"""
+        if hasattr(self.fd, 'send'):
+            if self._gather and hasattr(self.fd, 'sendmsg'):
+                try:
+                    return self.fd.sendmsg(chunks)
+                except NotImplementedError:
+                    # TLS sockets can't gather writes
+                    self._gather = False
+            return self.fd.send(chunks[0])
+        return os.writev(self.fd.fileno(), chunks)
+
+    def _consume(self, written):
+        """Drop the bytes that were written from the front of the queue"""
+        self._pending -= written
+        while written:
+            chunk = self._chunks[0]
+            if written >= len(chunk):
+                self._chunks.popleft()
+                written -= len(chunk)
+            else:
+                self._chunks[0] = chunk[written:]
+                written = 0
+        if self._pending <= self.low_water:
+            self.full = False
+
     def needs_write(self):
         """
         Returns True if the stream has data waiting to be written.
         """
-        return len(self.buffer) > 0
+        return self._pending > 0
 
     def close(self):
         """Close the stream"""
@@ -168,7 +450,7 @@ class Stream:
 
         # We don't close the fd immediately, as there may still be data pending
         # to write.
-        if not self.closed and len(self.buffer) == 0: #pylint: disable=C1801
+        if not self.closed and not self._pending:
             self.closed = True
             if hasattr(self.fd, 'close'):
                 self.fd.close()
@@ -193,7 +475,13 @@ class Demuxer:
     The next 4 bytes indicate the length of the following chunk of data as an
     integer in big endian format. This much data must be consumed before the
     next 8-byte header is read.
+
+    Data is read straight into a reused buffer, and every frame in a read is
+    demuxed at once; a burst of small frames costs one syscall, not three per
+    frame.
     """
+    HEADER = struct.Struct('>BxxxL')
+    BUFFER_SIZE = 64 * 1024
 
     def __init__(self, stream):
         """
@@ -201,6 +489,10 @@ class Demuxer:
         """
         self.stream = stream
         self.remain = 0
+        self._buffer = bytearray(Demuxer.BUFFER_SIZE)
+        self._view = memoryview(self._buffer)
+        # Where an incomplete header was left by the previous read
+        self._partial = (0, 0)
 
     def fileno(self):
         """
@@ -214,29 +506,43 @@ class Demuxer:
         """Set the blocking value on the stream"""
         return self.stream.set_blocking(value)
 
-    #pylint: disable=R1710
-    def read(self, n=4096):
+    @property
+    def closed(self):
+        """
+        Delegates to the underlying Stream.
+        """
+        return getattr(self.stream, 'closed', False)
+
+    @property
+    def full(self):
+        """
+        Delegates to the underlying Stream.
+        """
+        return getattr(self.stream, 'full', False)
+
+    def read(self, n=4096, wait=True):
         """
         Read up to `n` bytes of data from the Stream, after demuxing.
 
         Less than `n` bytes of data may be returned depending on the available
         payload, but the number of bytes returned will never exceed `n`.
+        Returns None at the end of the stream. The `wait` flag is passed along
+        to the Stream; any headers already read are kept for the next call.
 
-        Because demuxing involves scanning 8-byte headers, the actual amount of
-        data read from the underlying stream may be greater than `n`.
+        The data is a memoryview into a buffer that's reused, so it's only
+        valid until the next call to `read`.
         """
-        size = self._next_packet_size(n)
-        if size <= 0:
-            return
-
-        data = six.binary_type()
-        while len(data) < size:
-            nxt = self.stream.read(size - len(data))
-            if not nxt:
-                # the stream has closed, return what data we got
-                return data
-            data = data + nxt
-        return data
+        if len(self._buffer) < n + Demuxer.HEADER.size:
+            self._grow(n + Demuxer.HEADER.size)
+        while True:
+            partial = self._compact() if self._partial[1] else 0
+            received = self.stream.read_into(self._view[partial:partial + n], wait=wait)
+            if not received:
+                return None
+            start, stop = self._demux(partial + received)
+            if start is not None:
+                return self._view[start:stop]
+            # Only headers so far; keep reading until there's some payload.
 
     def write(self, data):
         """
@@ -266,27 +572,78 @@ class Demuxer:
         """
         return self.stream.close()
 
-    def _next_packet_size(self, n=0):
-        size = 0
-
-        if self.remain > 0:
-            size = min(n, self.remain)
-            self.remain -= size
-        else:
-            data = six.binary_type()
-            while len(data) < 8:
-                nxt = self.stream.read(8 - len(data))
-                if not nxt:
-                    # The stream has closed, there's nothing more to read
-                    return 0
-                data = data + nxt
-
-            if len(data) == 8:
-                __, actual = struct.unpack('>BxxxL', data)
-                size = min(n, actual)
-                self.remain = actual - size
+    def _demux(self, end):
+        """
+        Strip the headers out of the first `end` bytes of the buffer, packing
+        the payloads together after the first one. Returns where the payload
+        starts and stops.
+
+        With frames about the size of a read (i.e. `cat` of a big file), most
+        reads hold the end of one frame and the start of the next; those only
+        move the smaller of the two payloads over the header between them.
+        """
+        header_size = Demuxer.HEADER.size
+        remain = self.remain
+        if remain >= end:
+            # Nothing but payload
+            self.remain = remain - end
+            self._partial = (0, 0)
+            return 0, end
+        if end - remain >= header_size:
+            __, size = Demuxer.HEADER.unpack_from(self._buffer, remain)
+            rest = end - remain - header_size
+            if size >= rest and remain + rest:
+                # The read holds one header, and no more than the rest of its frame.
+                self.remain = size - rest
+                self._partial = (0, 0)
+                if rest > remain:
+                    self._view[header_size:header_size + remain] = self._view[:remain]
+                    return header_size, end
+                self._view[remain:remain + rest] = self._view[remain + header_size:end]
+                return 0, remain + rest
+        view = self._view
+        offset = 0
+        start = stop = None
+        while offset < end:
+            if not self.remain:
+                if end - offset < header_size:
+                    break
+                __, self.remain = Demuxer.HEADER.unpack_from(self._buffer, offset)
+                offset += header_size
+                continue
+            chunk = min(self.remain, end - offset)
+            if start is None:
+                start = stop = offset
+            elif offset != stop:
+                view[stop:stop + chunk] = view[offset:offset + chunk]
+            stop += chunk
+            offset += chunk
+            self.remain -= chunk
+        self._partial = (offset, end) if offset < end else (0, 0)
+        return start, stop
+
+    def _compact(self):
+        """
+        Move an incomplete header to the front of the buffer, and return its size.
+        """
+        start, end = self._partial
+        size = end - start
+        if start:
+            self._view[:size] = self._view[start:end]
+            self._partial = (0, size)
         return size
 
+    def _grow(self, size):
+        """
+        Replace the buffer with a larger one, keeping any incomplete header.
+        """
+        start, end = self._partial
+        buffer = bytearray(size)
+        buffer[:end - start] = self._buffer[start:end]
+        self._buffer = buffer
+        self._view = memoryview(buffer)
+        self._partial = (0, end - start)
+
     def __repr__(self):
         return "{cls}({stream})".format(cls=type(self).__name__,
                                         stream=self.stream)
@@ -305,6 +662,12 @@ class Pump:
 
     Pumps are selectable based on the 'read' end of the pipe.
     """
+    # Reads start small, so keystrokes are cheap, and grow while the stream
+    # stays busy. A busy stream moves at most BUDGET bytes per wakeup, so it
+    # can't starve the other pumps.
+    MIN_READ = 4096
+    MAX_READ = 256 * 1024
+    BUDGET = 1024 * 1024
 
     def __init__(self,
                  from_stream,
@@ -322,6 +685,9 @@ class Pump:
         self.eof = False
         self.wait_for_output = wait_for_output
         self.propagate_close = propagate_close
+        self.read_size = Pump.MIN_READ
+        # How many reads were done at each size; for debugging
+        self.read_sizes = collections.Counter()
 
     def fileno(self):
         """
@@ -335,29 +701,71 @@ class Pump:
         """Set the blocking state of the from-stream"""
         return self.from_stream.set_blocking(value)
 
-    def flush(self, n=4096):
+    def flush(self, n=None):
         """
-        Flush `n` bytes of data from the reader Stream to the writer Stream.
+        Flush data from the reader Stream to the writer Stream.
+
+        Reads until the reader would block, the writer is full, or BUDGET bytes
+        have been flushed. The read size doubles while reads come back at least half full, and
+        halves while they come back mostly empty. If `n` is set, only a single
+        read of up to `n` bytes is done.
 
         Returns the number of bytes that were actually flushed. A return value
         of zero is not an error.
 
         If EOF has been reached, `None` is returned.
         """
+        flushed = 0
         try:
-            read = self.from_stream.read(n)
-
-            if read is None or len(read) == 0: #pylint: disable=C1801
-                self.eof = True
-                if self.propagate_close:
-                    self.to_stream.close()
-                return None
-
-            return self.to_stream.write(read)
+            while flushed < Pump.BUDGET and not self.to_stream_full():
+                size = n or self.read_size
+                try:
+                    read = self.from_stream.read(size, wait=False)
+                except (BlockingIOError, SSLWantReadError):
+                    break
+
+                if read is None or len(read) == 0: #pylint: disable=C1801
+                    self.eof = True
+                    if self.propagate_close:
+                        self.to_stream.close()
+                    return None
+
+                self.read_sizes[size] += 1
+                flushed += self.to_stream.write(read)
+                if n:
+                    break
+                self._adapt(size, len(read))
+            return flushed
         except OSError as doh:
             if doh.errno != errno.EPIPE:
                 raise doh
 
+    def _adapt(self, size, got):
+        """
+        Pick the next read size, based on how much of the last read was used.
+        """
+        if got * 2 >= size:
+            self.read_size = min(size * 2, Pump.MAX_READ)
+        elif got * 8 < size:
+            self.read_size = max(size // 2, Pump.MIN_READ)
+
+    def to_stream_full(self):
+        """
+        Returns True if the writer Stream can't take any more data for now.
+        """
+        return getattr(self.to_stream, 'full', False)
+
+    def wants_read(self):
+        """
+        Returns True if the Pump should be flushed when the reader is ready;
+        it's not at EOF, and the writer isn't full.
+
+        While this is False, the data waits in the kernel's buffers, so flow
+        control pushes back on whatever is writing it.
+        """
+        return not self.eof and not getattr(self.from_stream, 'closed', False) and \
+                not self.to_stream_full()
+
     def is_done(self):
         """
         Returns True if the read stream is done (either it's returned EOF or
@@ -372,3 +780,215 @@ class Pump:
             cls=type(self).__name__,
             from_stream=self.from_stream,
             to_stream=self.to_stream)
+
+
+class PipedStream:
+    """
+    Wraps the Stream a SplicePump writes to.
+
+    Data is spliced into a pipe, and from the pipe into the Stream's file
+    descriptor, so it never passes through Python. Anything the Stream already
+    buffered is written first, and data written the normal way queues up
+    behind whatever is still in the pipe.
+    """
+    PIPE_SIZE = 1024 * 1024
+    SPLICE_FLAGS = getattr(os, 'SPLICE_F_MOVE', 0) | getattr(os, 'SPLICE_F_NONBLOCK', 0)
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.queued = 0
+        self.close_requested = False
+        # Goes False once the kernel refuses to splice either end
+        self.spliceable = True
+        # Set when the pipe might be full, until some of it's written out
+        self.pipe_full = False
+        self._read_fd, self._write_fd = os.pipe2(os.O_NONBLOCK | os.O_CLOEXEC)
+        try:
+            fcntl.fcntl(self._write_fd, fcntl.F_SETPIPE_SZ, PipedStream.PIPE_SIZE)
+        except OSError:
+            # Over /proc/sys/fs/pipe-max-size; the default size still works.
+            pass
+
+    @property
+    def closed(self):
+        """
+        Delegates to the underlying Stream.
+        """
+        return self.stream.closed
+
+    @property
+    def full(self):
+        """
+        True while the pipe might be full, or the Stream is.
+        """
+        return self.pipe_full or self.stream.full
+
+    def fileno(self):
+        """
+        Returns the fileno() of the underlying Stream.
+        """
+        return self.stream.fileno()
+
+    def splice_from(self, fd, n):
+        """
+        Splice up to `n` bytes from `fd` into the pipe, then on toward the
+        Stream. Returns the number of bytes taken from `fd`; zero at EOF.
+        """
+        moved = os.splice(fd, self._write_fd, n, flags=PipedStream.SPLICE_FLAGS)
+        self.queued += moved
+        self.do_write()
+        return moved
+
+    def write(self, data):
+        """
+        Write `data` through the Stream, behind anything still in the pipe.
+        """
+        self._unpipe()
+        return self.stream.write(data)
+
+    def do_write(self):
+        """
+        Flush what the Stream has buffered, then what's in the pipe.
+        """
+        written = 0
+        if self.stream.needs_write():
+            written = self.stream.do_write()
+            if self.stream.needs_write():
+                return written
+        if self.queued:
+            try:
+                moved = os.splice(self._read_fd, self.stream.fileno(), self.queued,
+                                  flags=PipedStream.SPLICE_FLAGS)
+            except BlockingIOError:
+                moved = 0
+            except OSError as doh:
+                if doh.errno != errno.EINVAL:
+                    raise doh
+                # This kernel can't splice to the Stream.
+                self.spliceable = False
+                self._unpipe()
+                moved = 0
+            self.queued -= moved
+            written += moved
+            if moved:
+                self.pipe_full = False
+        if self.close_requested and not self.queued:
+            self.close()
+        return written
+
+    def needs_write(self):
+        """
+        Returns True if there's data in the pipe, or buffered by the Stream.
+        """
+        return self.queued > 0 or self.stream.needs_write()
+
+    def close(self):
+        """
+        Close the Stream, and the pipe, once the pipe is empty.
+        """
+        self.close_requested = True
+        if not self.queued and self._read_fd is not None:
+            os.close(self._read_fd)
+            os.close(self._write_fd)
+            self._read_fd = self._write_fd = None
+            self.stream.close()
+
+    def _unpipe(self):
+        """
+        Move anything still in the pipe into the Stream's buffer.
+        """
+        while self.queued:
+            data = os.read(self._read_fd, self.queued)
+            self.queued -= len(data)
+            self.stream.write(data)
+        self.pipe_full = False
+
+    def __repr__(self):
+        return "{cls}({stream})".format(cls=type(self).__name__,
+                                        stream=self.stream)
+
+
+class SplicePump(Pump):
+    """
+    A Pump that moves data between two file descriptors inside the kernel,
+    with os.splice().
+
+    Only for data that needs no demuxing (i.e. a TTY session), where both ends
+    are plain file descriptors; see `can_splice`. Once the pipe fills up
+    because the writer is behind, the Pump stops reading until it drains. If
+    the kernel can't splice one of the ends, or data was written the normal
+    way, data is copied like a regular Pump does.
+    """
+
+    def __init__(self,
+                 from_stream,
+                 to_stream,
+                 wait_for_output=True,
+                 propagate_close=True):
+        super().__init__(from_stream,
+                         PipedStream(to_stream),
+                         wait_for_output=wait_for_output,
+                         propagate_close=propagate_close)
+
+    def flush(self, n=None):
+        """
+        Same as Pump.flush, but the data doesn't pass through Python.
+        """
+        flushed = 0
+        try:
+            while flushed < Pump.BUDGET and not self.to_stream_full():
+                if not self.to_stream.spliceable or self.to_stream.stream.needs_write():
+                    # The data has to queue up behind what the Stream has buffered.
+                    copied = super().flush(n)
+                    return None if copied is None else flushed + copied
+
+                size = n or self.read_size
+                try:
+                    moved = self.to_stream.splice_from(self.from_stream.fileno(), size)
+                except BlockingIOError:
+                    # Either nothing to read, or no room left in the pipe.
+                    self.to_stream.pipe_full = self.to_stream.queued > 0
+                    break
+                except OSError as doh:
+                    if doh.errno != errno.EINVAL:
+                        raise doh
+                    # This kernel can't splice from the reader.
+                    self.to_stream.spliceable = False
+                    continue
+
+                if not moved:
+                    self.eof = True
+                    if self.propagate_close:
+                        self.to_stream.close()
+                    return None
+
+                self.read_sizes[size] += 1
+                flushed += moved
+                if n:
+                    break
+                self._adapt(size, moved)
+            return flushed
+        except OSError as doh:
+            if doh.errno != errno.EPIPE:
+                raise doh
+            # The writer went away; same as Pump.flush.
+            return None
+
+
+def can_splice(stream):
+    """
+    Returns True if the kernel can move data to, or from, the Stream with
+    os.splice(); a plain Stream, not a TLS socket, on Python 3.10+.
+    """
+    return hasattr(os, 'splice') and isinstance(stream, Stream) and \
+            not isinstance(stream.fd, SSLSocket)
+
+
+def make_pump(from_stream, to_stream, splice=False, **kwargs):
+    """
+    Returns a SplicePump if `splice` is set and both ends can be spliced,
+    otherwise a regular Pump. Any other arguments are passed to the Pump.
+    """
+    if splice and can_splice(from_stream) and can_splice(to_stream):
+        return SplicePump(from_stream, to_stream, **kwargs)
+    return Pump(from_stream, to_stream, **kwargs)
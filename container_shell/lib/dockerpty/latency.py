@@ -0,0 +1,160 @@
+# -*- coding: UTF-8 -*-
+"""
+ Records how responsive a PTY session is, for tracking down "laggy shell" reports.
+
+ Every event lands in a fixed-size, log-scale histogram, so a session that
+ lasts for weeks uses the same memory as one that lasts for seconds.
+"""
+import time
+from array import array
+
+
+class Histogram:
+    """
+    Counts durations, in microseconds, in log-scale buckets.
+
+    Each power of two is split into SUB_BUCKETS buckets, so a percentile is
+    reported to within 25% of the real value. Durations under SUB_BUCKETS
+    microseconds are exact, and anything past the last bucket is counted in
+    the last bucket. The largest duration is kept exactly.
+    """
+    SUB_BUCKETS = 4
+    # Covers up to 2**36 microseconds; about 19 hours.
+    BUCKETS = 36 * SUB_BUCKETS
+
+    def __init__(self):
+        self.counts = array('Q', bytes(8 * Histogram.BUCKETS))
+        self.count = 0
+        self.max = 0
+
+    def record(self, micros):
+        """
+        Count a duration of `micros` microseconds.
+        """
+        self.counts[min(Histogram.bucket(micros), Histogram.BUCKETS - 1)] += 1
+        self.count += 1
+        self.max = max(self.max, micros)
+
+    def percentile(self, percent):
+        """
+        Returns the duration, in microseconds, that `percent` percent of the
+        recorded durations are at or under. Zero if nothing was recorded.
+        """
+        if not self.count:
+            return 0
+        target = max(1, -(-self.count * percent // 100))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                if index == Histogram.BUCKETS - 1:
+                    # Everything past the end lands here.
+                    return self.max
+                # The top of the bucket; never more than the real max.
+                return min(Histogram.lower_bound(index + 1) - 1, self.max)
+        return self.max
+
+    @staticmethod
+    def bucket(micros):
+        """
+        Returns the index of the bucket that counts `micros`.
+        """
+        if micros < Histogram.SUB_BUCKETS:
+            return max(micros, 0)
+        shift = micros.bit_length() - 3
+        return (shift + 1) * Histogram.SUB_BUCKETS + ((micros >> shift) & 3)
+
+    @staticmethod
+    def lower_bound(index):
+        """
+        Returns the smallest duration counted by the bucket at `index`.
+        """
+        if index < Histogram.SUB_BUCKETS:
+            return index
+        shift = index // Histogram.SUB_BUCKETS - 1
+        return (Histogram.SUB_BUCKETS + index % Histogram.SUB_BUCKETS) << shift
+
+    def summary(self, name):
+        """
+        Returns the count, p50/p90/p99 and max as ``key=value`` pairs, in seconds.
+        """
+        fields = ['{}_count={}'.format(name, self.count)]
+        for label, value in (('p50', self.percentile(50)), ('p90', self.percentile(90)),
+                             ('p99', self.percentile(99)), ('max', self.max)):
+            fields.append('{}_{}={:.6f}'.format(name, label, value / 1000000))
+        return ' '.join(fields)
+
+
+class SessionLatency:
+    """
+    Times a PTY session from the user's point of view.
+
+    echo    From data being written to the container, until the next output
+            is delivered to the user; keystroke to echo.
+    resize  Calls to resize the container's PTY.
+    info    Calls to inspect the operation.
+
+    Also counts the bytes moved each way. The record is written as one log
+    line when the session ends::
+
+      Session latency echo_count=212 echo_p50=0.000447 ... bytes_in=212 bytes_out=9481
+    """
+    def __init__(self):
+        self.echo = Histogram()
+        self.resize = Histogram()
+        self.info = Histogram()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        # When input was sent, that's still waiting on output; zero if none is.
+        self._sent = 0
+
+    def sent(self, size):
+        """
+        Record that `size` bytes of input were written to the container.
+        """
+        if size:
+            self.bytes_in += size
+            if not self._sent:
+                self._sent = _now()
+
+    def delivered(self, size):
+        """
+        Record that `size` bytes of output were delivered to the user.
+        """
+        if size:
+            self.bytes_out += size
+            if self._sent:
+                self.echo.record(_now() - self._sent)
+                self._sent = 0
+
+    def timed(self, histogram, func, *args, **kwargs):
+        """
+        Call `func`, recording how long it took in `histogram`, even if it raises.
+        """
+        start = _now()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            histogram.record(_now() - start)
+
+    def log(self, logger):
+        """
+        Write the record for this session.
+
+        :Returns: None
+
+        :param logger: An object for writing errors/messages for debugging problems
+        :type logger: logging.Logger
+        """
+        fields = [self.echo.summary('echo'), self.resize.summary('resize'),
+                  self.info.summary('info'), 'bytes_in={}'.format(self.bytes_in),
+                  'bytes_out={}'.format(self.bytes_out)]
+        logger.info('Session latency %s', ' '.join(fields))
+
+
+def _now():
+    """
+    The monotonic clock, in whole microseconds. Not time.monotonic_ns; that
+    needs Python 3.7.
+    """
+    return round(time.monotonic() * 1000000)
@@ -17,11 +17,16 @@
  limitations under the License.
 """
 import sys
+import time
 import signal
+import asyncio
+import threading
 from ssl import SSLError
+from concurrent import futures
 
 from container_shell.lib.dockerpty import io
 from container_shell.lib.dockerpty import tty
+from container_shell.lib.dockerpty import latency
 
 
 class WINCHHandler:
@@ -101,13 +106,21 @@ class Operation:
         """Meta data for the operation."""
         raise NotImplementedError()
 
+    def watch(self, callback):
+        """
+        Call `callback` once the operation ends, if there's a way to be told.
+
+        Returns an object with a `close` method to stop watching, or None.
+        """
+        del callback # No way to be told, so it's never called; see RunOperation.watch
+
 #pylint: disable=R0902
 class ExecOperation(Operation):
     """
     class for handling `docker exec`-like command
     """
 
-    def __init__(self, client, exec_id, logger, interactive=True, stdout=None, stderr=None, stdin=None): #pylint: disable=C0301,R0913
+    def __init__(self, client, exec_id, logger, interactive=True, stdout=None, stderr=None, stdin=None, splice=False): #pylint: disable=C0301,R0913
         self.exec_id = exec_id
         self.client = client
         self.raw = None
@@ -117,6 +130,7 @@ class ExecOperation(Operation):
         self.stdin = stdin or sys.stdin
         self._info = None
         self.logger = logger
+        self.splice = splice
 
     def start(self, sockets=None, **kwargs): #pylint: disable=W0221
         """
@@ -126,9 +140,11 @@ class ExecOperation(Operation):
         pumps = []
 
         if self.interactive:
-            pumps.append(io.Pump(io.Stream(self.stdin), stream, wait_for_output=False))
+            pumps.append(io.make_pump(io.Stream(self.stdin), stream, splice=self.splice,
+                                      wait_for_output=False))
 
-        pumps.append(io.Pump(stream, io.Stream(self.stdout), propagate_close=False))
+        pumps.append(io.make_pump(stream, io.Stream(self.stdout), splice=self.splice,
+                                  propagate_close=False))
         return pumps
 
     def israw(self, **kwargs):
@@ -183,9 +199,11 @@ class RunOperation(Operation):
     class for handling `docker run`-like command
     """
     #pylint: disable=C0301,R0913
-    def __init__(self, client, container, interactive=True, stdout=None, stderr=None, stdin=None, logs=1):
+    def __init__(self, client, container, interactive=True, stdout=None, stderr=None, stdin=None, logs=1, splice=False, logger=None):
         """
         Initialize the PTY using the docker.Client instance and container dict.
+
+        Set `splice` to move data with os.splice(), where the streams allow it.
         """
         self.client = client
         self.container = container
@@ -195,6 +213,8 @@ class RunOperation(Operation):
         self.stderr = stderr or sys.stderr
         self.stdin = stdin or sys.stdin
         self.logs = logs
+        self.splice = splice
+        self.logger = logger
 
     def start(self, sockets=None, **kwargs): #pylint: disable=W0221
         """
@@ -208,13 +228,13 @@ class RunOperation(Operation):
 
         if pty_stdin and self.interactive:
             #pylint: disable=C0301
-            pumps.append(io.Pump(io.Stream(self.stdin), pty_stdin, wait_for_output=not sys.stdin.isatty()))
+            pumps.append(io.make_pump(io.Stream(self.stdin), pty_stdin, splice=self.splice, wait_for_output=not sys.stdin.isatty()))
 
         if pty_stdout:
-            pumps.append(io.Pump(pty_stdout, io.Stream(self.stdout), propagate_close=False))
+            pumps.append(io.make_pump(pty_stdout, io.Stream(self.stdout), splice=self.splice, propagate_close=False))
 
         if pty_stderr:
-            pumps.append(io.Pump(pty_stderr, io.Stream(self.stderr), propagate_close=False))
+            pumps.append(io.make_pump(pty_stderr, io.Stream(self.stderr), splice=self.splice, propagate_close=False))
 
         if not self.info()['State']['Running']:
             self.client.start(self.container, **kwargs) #pylint: disable=W0613
@@ -273,6 +293,62 @@ class RunOperation(Operation):
         """
         return self.client.inspect_container(self.container)
 
+    def watch(self, callback):
+        """
+        Call `callback` when Docker reports the container died.
+        """
+        return EventWatcher(self.client, self.container, callback)
+
+
+class EventWatcher:
+    """
+    Waits on the Docker event stream in a daemon thread, so a container dying
+    is noticed without polling the daemon.
+    """
+
+    def __init__(self, client, container, callback):
+        self.client = client
+        self.container = container
+        self.callback = callback
+        self.closed = False
+        self._events = None
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._watch, daemon=True)
+        self._thread.start()
+
+    def _watch(self):
+        try:
+            events = self.client.events(filters={'container' : self.container, 'event' : 'die'},
+                                        decode=True)
+            with self._lock:
+                if self.closed:
+                    events.close()
+                    return
+                self._events = events
+            for _ in events:
+                self.callback()
+                return
+        except Exception: #pylint: disable=W0703
+            # The stream is closed out from under us at the end of the session;
+            # if the daemon went away, socket EOF ends the session anyway.
+            pass
+
+    def close(self):
+        """
+        Stop watching for events.
+        """
+        with self._lock:
+            self.closed = True
+            if self._events is not None:
+                self._events.close()
+
+    def __repr__(self):
+        return "{cls}({container})".format(cls=type(self).__name__,
+                                           container=self.container)
+
+
+STATE_TTL = 60
+
 
 class PseudoTerminal:
     """
@@ -302,12 +378,27 @@ class PseudoTerminal:
     without adverse effects.
     """
 
-    def __init__(self, client, operation):
+    def __init__(self, client, operation, state_ttl=STATE_TTL, record_latency=False,
+                 hangup=None): #pylint: disable=R0913
         """
         Initialize the PTY using the docker.Client instance and container dict.
+
+        The session ends when the streams hit EOF, or Docker reports that the
+        container died. Otherwise, once there's activity, the operation is
+        inspected at most once every `state_ttl` seconds.
+
+        Set `record_latency` to time keystroke echo, and the Docker API calls,
+        and log a summary when the session ends.
+
+        The session also ends once the `hangup` io.Notifier is notified, so a
+        signal handler can end the session without doing any work itself.
         """
         self.client = client
         self.operation = operation
+        self.state_ttl = state_ttl
+        self.latency = latency.SessionLatency() if record_latency else None
+        self.hangup = hangup
+        self._checked = time.monotonic()
 
     def sockets(self):
         """Obtain the file-like objects for reading/writing streams
@@ -331,6 +422,8 @@ class PseudoTerminal:
             with WINCHHandler(self):
                 self._hijack_tty(pumps)
         finally:
+            self._log_read_sizes(pumps)
+            self._log_latency()
             if flags:
                 for (pump, flag) in zip(pumps, flags):
                     io.set_blocking(pump, flag)
@@ -350,48 +443,178 @@ class PseudoTerminal:
         if size is not None:
             rows, cols = size
             try:
-                self.operation.resize(height=rows, width=cols)
+                self._timed('resize', self.operation.resize, height=rows, width=cols)
             except IOError:  # Container already exited
                 pass
 
     def _hijack_tty(self, pumps):
-        with tty.Terminal(self.operation.stdin, raw=self.operation.israw()):
+        with tty.Terminal(self.operation.stdin, raw=self.operation.israw()), \
+             io.Selector() as selector, io.Notifier() as died:
             self.resize()
             keep_running = True
             stdin_stream = self._get_stdin_pump(pumps)
-            while keep_running:
-                read_pumps = [p for p in pumps if not p.eof]
-                write_streams = [p.to_stream for p in pumps if p.to_stream.needs_write()]
+            # Registered once; after that, interest only changes when a pump hits
+            # EOF, or a stream's write buffer goes between empty, non-empty and full.
+            for pump in pumps:
+                selector.set_reading(pump)
+                selector.set_writing(pump.to_stream, pump.to_stream.needs_write())
+            # No timeout; an idle session sleeps until there's I/O, or the
+            # container dies.
+            selector.set_reading(died)
+            if self.hangup is not None:
+                selector.set_reading(self.hangup)
+            watcher = self.operation.watch(died.notify)
+            try:
+                while keep_running:
+                    read_ready, write_ready = selector.select(timeout=None)
+                    try:
+                        for write_stream in write_ready:
+                            write_stream.do_write()
+                            self._update_interest(selector, pumps, write_stream)
+
+                        for pump in read_ready:
+                            if pump is died or pump is self.hangup:
+                                keep_running = False
+                                continue
+                            flushed = pump.flush()
+                            if self.latency is not None:
+                                self._record_flush(pump, flushed, stdin_stream)
+                            self._update_interest(selector, pumps, pump.to_stream)
+
+                        if self._is_done(pumps, stdin_stream):
+                            keep_running = False
 
-                read_ready, write_ready = io.select(read_pumps, write_streams, timeout=2)
-                try:
-                    for write_stream in write_ready:
-                        write_stream.do_write()
+                    except SSLError as doh:
+                        if 'The operation did not complete' not in doh.strerror:
+                            raise doh
+                    else:
+                        if keep_running and not self._is_running():
+                            keep_running = False
+            finally:
+                if watcher is not None:
+                    watcher.close()
 
-                    for pump in read_ready:
-                        pump.flush()
+    @staticmethod
+    def _is_done(pumps, stdin_stream):
+        """Decide if the session is over, based on the state of the pumps.
 
-                    if sys.stdin.isatty():
-                        if all([p.is_done() for p in pumps]):
-                            keep_running = False
-                    elif stdin_stream.is_done():
-                        # If stdin isn't a TTY, this is probably an SSH session.
-                        # The most common use case for an SSH session without a
-                        # TTY is SCP/SFTP; like, someone coping a file to a remote
-                        # server. Those file transfer clients mark the end of
-                        # the session by sending an empty packet, then waiting
-                        # for the TCP session to terminate, We need to break out
-                        # of this loop to return control to the calling application
-                        # so it can tear down the SCP/SFTP process running inside
-                        # the container.
-                        keep_running = False
-
-                except SSLError as doh:
-                    if 'The operation did not complete' not in doh.strerror:
-                        raise doh
-                else:
-                    if not self.operation.info()['State']['Running']: #pylint: disable=W0212
-                        keep_running = False
+        :Returns: Boolean
+
+        :param pumps: The list of pumps
+        :type pumps: List
+
+        :param stdin_stream: The Pump connected to stdin
+        :type stdin_stream: dockerpty.io.Pump
+        """
+        if sys.stdin.isatty():
+            return all([p.is_done() for p in pumps])
+        # If stdin isn't a TTY, this is probably an SSH session.
+        # The most common use case for an SSH session without a
+        # TTY is SCP/SFTP; like, someone coping a file to a remote
+        # server. Those file transfer clients mark the end of
+        # the session by sending an empty packet, then waiting
+        # for the TCP session to terminate, We need to break out
+        # of this loop to return control to the calling application
+        # so it can tear down the SCP/SFTP process running inside
+        # the container.
+        return stdin_stream.is_done()
+
+    def _is_running(self):
+        """Inspect the operation, unless it was inspected within the last ``state_ttl`` seconds.
+
+        :Returns: Boolean
+        """
+        now = time.monotonic()
+        if now - self._checked < self.state_ttl:
+            return True
+        self._checked = now
+        return self._timed('info', self.operation.info)['State']['Running']
+
+    def _timed(self, name, func, *args, **kwargs):
+        """Make a Docker API call, timing it if latency is being recorded.
+
+        :Returns: Whatever ``func`` returns
+
+        :param name: Which of the latency histograms to record the call in
+        :type name: String
+
+        :param func: The call to make
+        :type func: Callable
+        """
+        if self.latency is None:
+            return func(*args, **kwargs)
+        return self.latency.timed(getattr(self.latency, name), func, *args, **kwargs)
+
+    def _record_flush(self, pump, flushed, stdin_stream):
+        """Count the data a pump moved; input to the container, or output to the user.
+
+        :Returns: None
+
+        :param pump: The pump that was flushed
+        :type pump: dockerpty.io.Pump
+
+        :param flushed: What the flush returned
+        :type flushed: Integer or None
+
+        :param stdin_stream: The Pump connected to stdin
+        :type stdin_stream: dockerpty.io.Pump
+        """
+        if pump is stdin_stream:
+            self.latency.sent(flushed or 0)
+        else:
+            self.latency.delivered(flushed or 0)
+
+    def _log_latency(self):
+        """Write the latency summary for the session, if it was recorded.
+
+        :Returns: None
+        """
+        logger = getattr(self.operation, 'logger', None)
+        if self.latency is not None and logger is not None:
+            self.latency.log(logger)
+
+    def _log_read_sizes(self, pumps):
+        """Record the read sizes each pump picked, for tuning the pump limits.
+
+        :Returns: None
+
+        :param pumps: The list of pumps
+        :type pumps: List
+        """
+        logger = getattr(self.operation, 'logger', None)
+        if logger is None:
+            return
+        for pump in pumps:
+            logger.debug('%s read sizes %s', pump, dict(sorted(pump.read_sizes.items())))
+
+    @staticmethod
+    def _update_interest(selector, pumps, stream):
+        """Watch a stream for writability only while it has buffered data, and
+        read into it only while it isn't full.
+
+        Once a stream is closed, nothing reads from, or writes to, it again.
+
+        :Returns: None
+
+        :param selector: The registrations for the PTY loop
+        :type selector: dockerpty.io.Selector
+
+        :param pumps: The list of pumps
+        :type pumps: List
+
+        :param stream: A stream that was just written to
+        :type stream: dockerpty.io.Stream
+        """
+        if not getattr(stream, 'closed', False):
+            selector.set_writing(stream, stream.needs_write())
+            for pump in pumps:
+                if pump.to_stream is stream:
+                    selector.set_reading(pump, pump.wants_read())
+            return
+        selector.remove(stream)
+        for pump in pumps:
+            if pump.from_stream is stream or pump.to_stream is stream:
+                selector.remove(pump)
 
     @staticmethod
     def _get_stdin_pump(pumps):
@@ -409,3 +632,223 @@ class PseudoTerminal:
         else:
             raise RuntimeError('No pump for stdin found')
         return pump
+
+
+class AsyncPseudoTerminal(PseudoTerminal):
+    """
+    A PseudoTerminal driven by an asyncio event loop.
+
+    The pumps are flushed from `loop.add_reader` and `loop.add_writer`
+    callbacks. The Docker API calls made during the session (resizing the
+    PTY, inspecting the operation) run in a worker thread, so moving data never
+    waits on a round trip to the daemon. The session ends under the same
+    conditions as a PseudoTerminal.
+
+    Takes the same operations as a PseudoTerminal:
+
+        AsyncPseudoTerminal(client, RunOperation(client, container)).start()
+    """
+
+    def __init__(self, client, operation, state_ttl=STATE_TTL, record_latency=False,
+                 hangup=None): #pylint: disable=R0913
+        super().__init__(client, operation, state_ttl, record_latency, hangup)
+        self._loop = None
+        self._executor = None
+        self._done = None
+        self._pumps = []
+        self._stdin_stream = None
+        self._readers = {}
+        self._writers = {}
+        self._checking = False
+
+    def resize(self, size=None):
+        """
+        Resize the container's PTY, in the worker thread once the session
+        has started. Safe to call from a signal handler.
+        """
+        if self._loop is None:
+            super().resize(size)
+        else:
+            self._loop.call_soon_threadsafe(self._resize_soon, size)
+
+    def _hijack_tty(self, pumps):
+        executor = futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='dockerpty')
+        try:
+            with tty.Terminal(self.operation.stdin, raw=self.operation.israw()):
+                # Not asyncio.run; that needs Python 3.7
+                loop = asyncio.new_event_loop()
+                try:
+                    loop.run_until_complete(self._run(pumps, executor))
+                finally:
+                    loop.close()
+        finally:
+            # Don't hold up the end of the session on a call to a slow daemon.
+            executor.shutdown(wait=False)
+
+    async def _run(self, pumps, executor):
+        """Move data until the session ends.
+
+        :Returns: None
+
+        :param pumps: The list of pumps
+        :type pumps: List
+
+        :param executor: Where the Docker API calls are made
+        :type executor: concurrent.futures.Executor
+        """
+        loop = asyncio.get_event_loop()
+        self._loop = loop
+        self._executor = executor
+        self._done = loop.create_future()
+        self._pumps = pumps
+        self._stdin_stream = self._get_stdin_pump(pumps)
+        self._resize_soon(None)
+        for pump in pumps:
+            self._update_writer(pump.to_stream)
+        watcher = self.operation.watch(lambda: loop.call_soon_threadsafe(self._finish))
+        if self.hangup is not None:
+            loop.add_reader(self.hangup.fileno(), self._finish)
+        try:
+            await self._done
+        finally:
+            if watcher is not None:
+                watcher.close()
+            if self.hangup is not None:
+                loop.remove_reader(self.hangup.fileno())
+            for pump in list(self._readers):
+                self._remove_reader(pump)
+            for stream in list(self._writers):
+                self._remove_writer(stream)
+            self._loop = None
+
+    def _on_readable(self, pump):
+        """Flush a pump whose source is readable"""
+        try:
+            flushed = pump.flush()
+            if self.latency is not None:
+                self._record_flush(pump, flushed, self._stdin_stream)
+            self._update_writer(pump.to_stream)
+        except SSLError as doh:
+            if 'The operation did not complete' not in doh.strerror:
+                self._fail(doh)
+            return
+        except Exception as doh: #pylint: disable=W0703
+            self._fail(doh)
+            return
+        self._after_io()
+
+    def _on_writable(self, stream):
+        """Write out what a stream has buffered, now that it's writable"""
+        try:
+            stream.do_write()
+            self._update_writer(stream)
+        except SSLError as doh:
+            if 'The operation did not complete' not in doh.strerror:
+                self._fail(doh)
+            return
+        except Exception as doh: #pylint: disable=W0703
+            self._fail(doh)
+            return
+        self._after_io()
+
+    def _after_io(self):
+        """End the session if the pumps are done, otherwise check on the operation"""
+        if self._is_done(self._pumps, self._stdin_stream):
+            self._finish()
+        else:
+            self._check_running()
+
+    def _update_writer(self, stream):
+        """Watch a stream for writability only while it has buffered data, and
+        read into it only while it isn't full.
+
+        Once a stream is closed, nothing reads from, or writes to, it again.
+
+        :Returns: None
+
+        :param stream: A stream that was just written to
+        :type stream: dockerpty.io.Stream
+        """
+        if getattr(stream, 'closed', False):
+            self._remove_writer(stream)
+            for pump in self._pumps:
+                if pump.from_stream is stream or pump.to_stream is stream:
+                    self._remove_reader(pump)
+            return
+        if not stream.needs_write():
+            self._remove_writer(stream)
+        elif stream not in self._writers:
+            self._writers[stream] = stream.fileno()
+            self._loop.add_writer(self._writers[stream], self._on_writable, stream)
+        for pump in self._pumps:
+            if pump.to_stream is not stream:
+                continue
+            if not pump.wants_read():
+                self._remove_reader(pump)
+            elif pump not in self._readers:
+                self._readers[pump] = pump.fileno()
+                self._loop.add_reader(self._readers[pump], self._on_readable, pump)
+
+    def _remove_reader(self, pump):
+        """Stop reading for a pump. Safe to call after its stream is closed."""
+        fd = self._readers.pop(pump, None)
+        if fd is not None:
+            self._loop.remove_reader(fd)
+
+    def _remove_writer(self, stream):
+        """Stop waiting on a stream to be writable. Safe to call after it's closed."""
+        fd = self._writers.pop(stream, None)
+        if fd is not None:
+            self._loop.remove_writer(fd)
+
+    def _check_running(self):
+        """Inspect the operation in the worker thread, if it's been ``state_ttl`` seconds."""
+        now = time.monotonic()
+        if self._checking or now - self._checked < self.state_ttl:
+            return
+        self._checked = now
+        self._checking = True
+        inspecting = self._call_api(self._timed, 'info', self.operation.info)
+        inspecting.add_done_callback(self._checked_running)
+
+    def _checked_running(self, future):
+        """End the session if the inspection says the operation isn't running"""
+        self._checking = False
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            self._fail(future.exception())
+        elif not future.result()['State']['Running']:
+            self._finish()
+
+    def _resize_soon(self, size):
+        """Resize the PTY in the worker thread"""
+        self._call_api(super().resize, size).add_done_callback(self._resized)
+
+    def _resized(self, future):
+        """Log a resize that failed; the session goes on regardless"""
+        if future.cancelled() or future.exception() is None:
+            return
+        logger = getattr(self.operation, 'logger', None)
+        if logger is not None:
+            logger.error('Failed to resize PTY: %s', future.exception())
+
+    def _call_api(self, func, *args):
+        """Make a (blocking) Docker API call in the worker thread.
+
+        :Returns: asyncio.Future
+
+        :param func: The call to make
+        :type func: Callable
+        """
+        return self._loop.run_in_executor(self._executor, func, *args)
+
+    def _finish(self):
+        """End the session"""
+        if not self._done.done():
+            self._done.set_result(None)
+
+    def _fail(self, error):
+        """End the session, raising `error` from `start`"""
+        if not self._done.done():
+            self._done.set_exception(error)
@@ -0,0 +1,228 @@
+# -*- coding: UTF-8 -*-
+"""A warm pool of idle, already started containers that a login can claim"""
+import os
+import uuid
+import hashlib
+import threading
+
+import docker
+
+from container_shell.lib import utils, dockage, sweep
+from container_shell.lib.config import fingerprint
+
+POOL_LABEL = 'container_shell.pool'
+NAME_PREFIX = 'cspool-'
+# With stdin held open, this keeps an idle container running until it's claimed.
+IDLE_COMMAND = '/bin/bash'
+
+
+def pool_hash(docker_client, config):
+    """Identifies which pooled containers match the current config and image.
+
+    A change to the image digest, or to the settings that define how a container
+    is built, results in a new hash; which invalidates every idle container.
+
+    :Returns: String
+
+    :param docker_client: For communicating with the Docker daemon.
+    :type docker_client: docker.client.DockerClient
+
+    :param config: The defined settings (or defaults) that define the behavior of Container Shell.
+    :type config: configparser.ConfigParser
+    """
+    image_id = docker_client.images.get(config['config'].get('image')).id
+    hasher = hashlib.sha256()
+    hasher.update(fingerprint(config).encode())
+    hasher.update(image_id.encode())
+    return hasher.hexdigest()
+
+
+#pylint: disable=R0913
+def claim(docker_client, config, username, user_uid, user_gid, logger):
+    """Take an idle container from the warm pool, and make it the user's container.
+
+    Returns None when the pool is disabled or empty, or the user couldn't be
+    created inside the claimed container, in which case the caller should
+    create a container like normal.
+
+    A claimed container keeps the labels it was made with (Docker can't change
+    them), so its ``container_shell.user`` label is blank and its session is
+    ``pool``; look it up by name instead.
+
+    :Returns: docker.models.containers.Container
+
+    :param docker_client: For communicating with the Docker daemon.
+    :type docker_client: docker.client.DockerClient
+
+    :param config: The defined settings (or defaults) that define the behavior of Container Shell.
+    :type config: configparser.ConfigParser
+
+    :param username: The name of the user running Container Shell.
+    :type username: String
+
+    :param user_uid: The user-id (UID) of the user running Container Shell.
+    :type user_uid: Integer
+
+    :param user_gid: The group-id (GID) of the user running Container Shell.
+    :type user_gid: Integer
+
+    :param logger: An object for writing errors/messages for debugging problems
+    :type logger: logging.Logger
+    """
+    if not _size(config):
+        return None
+    digest = pool_hash(docker_client, config)
+    container = None
+    # Two logins must never rename the same idle container.
+    with utils.file_lock(_lock_location(config, 'claim')):
+        for idle in _idle_containers(docker_client, digest):
+            # Before it loses the pool's name, so ``--sweep`` never mistakes
+            # it for an old, abandoned container.
+            sweep.mark_claimed(config, idle.id, logger)
+            idle.rename(username)
+            container = idle
+            break
+    if container is None:
+        logger.info('Warm pool miss for %s', username)
+        return None
+    logger.info('Warm pool hit for %s, claimed %s', username, container.short_id)
+    provision = dockage.provision_command(username=username,
+                                          user_uid=user_uid,
+                                          user_gid=user_gid,
+                                          create_user=config['config']['create_user'],
+                                          useradd=config['binaries']['useradd'])
+    if provision:
+        result = container.exec_run(provision)
+        if result.exit_code:
+            # The user's login would fail in this container; make a new one instead.
+            logger.error('Unable to provision %s in pooled container %s, exit code %s: %s',
+                         username, container.short_id, result.exit_code,
+                         result.output.decode(errors='replace').strip())
+            _discard(container, logger)
+            return None
+        logger.debug('Provisioned %s in pooled container', username)
+    return container
+
+
+def refill(docker_client, config, logger):
+    """Top up the warm pool, and discard idle containers that no longer match the config.
+
+    Only one process refills the pool at a time; if another process is already
+    refilling, this returns immediately.
+
+    :Returns: Integer
+
+    :param docker_client: For communicating with the Docker daemon.
+    :type docker_client: docker.client.DockerClient
+
+    :param config: The defined settings (or defaults) that define the behavior of Container Shell.
+    :type config: configparser.ConfigParser
+
+    :param logger: An object for writing errors/messages for debugging problems
+    :type logger: logging.Logger
+    """
+    size = _size(config)
+    if not size:
+        return 0
+    with utils.file_lock(_lock_location(config, 'refill'), blocking=False) as locked:
+        if not locked:
+            logger.debug('Warm pool refill already in progress')
+            return 0
+        digest = pool_hash(docker_client, config)
+        idle = 0
+        filters = {'label' : POOL_LABEL, 'name' : NAME_PREFIX}
+        for container in docker_client.containers.list(all=True, filters=filters):
+            if not container.name.startswith(NAME_PREFIX):
+                continue
+            if container.labels.get(POOL_LABEL) == digest and container.status == 'running':
+                idle += 1
+            else:
+                logger.info('Discarding stale pooled container %s', container.short_id)
+                _discard(container, logger)
+        made = 0
+        for _ in range(size - idle):
+            container = docker_client.containers.create(**_pool_args(config, digest, logger))
+            container.start()
+            made += 1
+        logger.debug('Warm pool refilled with %s containers, %s already idle', made, idle)
+    return made
+
+
+def refill_in_background(docker_client, config, logger):
+    """Refill the warm pool without delaying the user's login.
+
+    :Returns: threading.Thread
+
+    :param docker_client: For communicating with the Docker daemon.
+    :type docker_client: docker.client.DockerClient
+
+    :param config: The defined settings (or defaults) that define the behavior of Container Shell.
+    :type config: configparser.ConfigParser
+
+    :param logger: An object for writing errors/messages for debugging problems
+    :type logger: logging.Logger
+    """
+    if not _size(config):
+        return None
+    # A daemon thread, so a user's short session never waits on the refill.
+    # Anything left undone is picked up by the next login.
+    worker = threading.Thread(target=_safe_refill,
+                              args=(docker_client, config, logger),
+                              daemon=True)
+    worker.start()
+    return worker
+
+
+def _safe_refill(docker_client, config, logger):
+    """Keeps errors in the background thread out of the user's terminal"""
+    try:
+        refill(docker_client, config, logger)
+    except Exception as doh: #pylint: disable=W0703
+        logger.exception(doh)
+
+
+def _idle_containers(docker_client, digest):
+    """Find the running, unclaimed containers that match the current pool hash"""
+    filters = {'label' : '{}={}'.format(POOL_LABEL, digest),
+               'name' : NAME_PREFIX,
+               'status' : 'running'}
+    # The daemon's "name" filter is a substring match, so double check it.
+    return [c for c in docker_client.containers.list(filters=filters)
+            if c.name.startswith(NAME_PREFIX)]
+
+
+def _discard(container, logger):
+    """Remove a pooled container, ignoring ones that are already gone"""
+    try:
+        container.remove(force=True)
+    except docker.errors.NotFound:
+        pass
+    except docker.errors.APIError as doh:
+        logger.exception(doh)
+
+
+def _size(config):
+    """The number of idle containers to keep around"""
+    if dockage.provision_mode(config) == 'mount':
+        # Idle containers are made before anyone logs in, so they can't have
+        # a user's passwd and group files mounted.
+        return 0
+    return config['pool'].getint('size')
+
+
+def _pool_args(config, digest, logger):
+    """Construct the arguments to use when creating an idle, pooled container"""
+    create_kwargs = dockage.create_template(config, logger)
+    create_kwargs.update({
+        'tty' : True,
+        'command' : IDLE_COMMAND,
+        'name' : '{}{}-{}'.format(NAME_PREFIX, digest[:12], uuid.uuid4().hex[:6]),
+        'labels' : dockage.labels(config, '', 'pool'),
+    })
+    create_kwargs['labels'][POOL_LABEL] = digest
+    return create_kwargs
+
+
+def _lock_location(config, name):
+    """The lock file used to coordinate pool work between logins"""
+    return os.path.join(config['config'].get('state_dir'), 'pool-{}.lock'.format(name))
@@ -0,0 +1,174 @@
+# -*- coding: UTF-8 -*-
+"""Stops the process of a ``docker exec`` session, from the host.
+
+The process is signaled through a pidfd when the kernel supports them (Linux
+5.3+), so a signal can never reach some other process that was given a
+recycled pid. Otherwise, the pid is signaled, and polled to see when it exits.
+"""
+import os
+import time
+import select
+import signal
+
+from container_shell.lib import utils
+
+# Seconds a ``docker exec`` process gets to exit after SIGTERM, before it's sent SIGKILL.
+EXEC_GRACE = 60
+# Seconds teardown waits on a shell to exit, before handing the rest of the grace off.
+EXEC_WAIT = 0.25
+
+
+#pylint: disable=W0613
+def kill_exec(docker_client, exec_id, logger, *args, grace=EXEC_GRACE, **kwargs):
+    """Send SIGTERM to terminate the PID from the ``docker exec`` instance.
+
+    Waits at most ``EXEC_WAIT`` seconds for the process to exit, so the user's
+    SSH session isn't held open. A process that's still running is handed off
+    to a detached process, which sends it SIGKILL if it's still running once
+    ``grace`` seconds have passed. Does nothing if the exec never started, or
+    has already exited; its pid could belong to anything by then.
+
+    :Returns: None
+
+    :param docker_client: For communicating with the Docker daemon.
+    :type docker_client: docker.client.DockerClient
+
+    :param exec_id: The Id -> hex mapping for the exec id.
+    :type exec_id: Dictionary
+
+    :param logger: An object for writing errors/messages for debugging problems
+    :type logger: logging.Logger
+
+    :param grace: Seconds the process gets to exit after SIGTERM, before it's sent SIGKILL.
+    :type grace: Float
+    """
+    info = docker_client.api.exec_inspect(exec_id['Id'])
+    pid = int(info.get('Pid') or 0)
+    if not (info.get('Running') and pid > 0):
+        logger.info("Exec pid %s not running, nothing to kill", pid)
+        return
+    began = time.monotonic()
+    try:
+        # Held from before the first signal, so neither can reach a recycled pid.
+        pid_fd = _open_pid(pid)
+    except ProcessLookupError:
+        logger.info("Exec pid %s already exited", pid)
+        return
+    try:
+        _send_signal(pid, pid_fd, signal.SIGTERM)
+        if not _wait_for_pid(pid, pid_fd, min(grace, EXEC_WAIT)):
+            # The detached process gets its own copy of the pidfd.
+            utils.detach(_escalate, pid, pid_fd, grace, began, logger)
+            return
+    except ProcessLookupError:
+        # Already gone
+        pass
+    finally:
+        if pid_fd is not None:
+            os.close(pid_fd)
+    logger.info("Exec pid %s exited %.6f sec after SIGTERM", pid, time.monotonic() - began)
+
+
+def _escalate(pid, pid_fd, grace, began, logger):
+    """Send SIGKILL to a process that's still running ``grace`` seconds after SIGTERM.
+
+    :Returns: None
+
+    :param pid: The process ID of the ``docker exec`` instance.
+    :type pid: Integer
+
+    :param pid_fd: From ``_open_pid``; None to poll the pid instead.
+    :type pid_fd: Integer
+
+    :param grace: Seconds the process gets to exit after SIGTERM, before it's sent SIGKILL.
+    :type grace: Float
+
+    :param began: When SIGTERM was sent, from ``time.monotonic``.
+    :type began: Float
+
+    :param logger: An object for writing errors/messages for debugging problems
+    :type logger: logging.Logger
+    """
+    the_signal = 'SIGTERM'
+    try:
+        remaining = max(0, grace - (time.monotonic() - began))
+        if not _wait_for_pid(pid, pid_fd, remaining):
+            the_signal = 'SIGKILL'
+            logger.warning("Exec pid %s still running %s sec after SIGTERM", pid, grace)
+            _send_signal(pid, pid_fd, signal.SIGKILL)
+            _wait_for_pid(pid, pid_fd, grace)
+    except ProcessLookupError:
+        # Already gone
+        pass
+    logger.info("Exec pid %s exited %.6f sec after %s", pid, time.monotonic() - began, the_signal)
+
+
+def _open_pid(pid):
+    """Open a pidfd for the process, or return None if the kernel doesn't
+    support them (they need Linux 5.3+).
+
+    Raises ProcessLookupError if the process doesn't exist.
+
+    :Returns: Integer or None
+
+    :param pid: The process ID of the ``docker exec`` instance.
+    :type pid: Integer
+    """
+    try:
+        return os.pidfd_open(pid)
+    except ProcessLookupError:
+        raise
+    except (AttributeError, OSError):
+        return None
+
+
+def _send_signal(pid, pid_fd, the_signal):
+    """Signal the process through its pidfd, if there is one"""
+    if pid_fd is None:
+        os.kill(pid, the_signal)
+    else:
+        signal.pidfd_send_signal(pid_fd, the_signal)
+
+
+def _wait_for_pid(pid, pid_fd, timeout):
+    """Block until the process exits, or ``timeout`` seconds pass.
+
+    Returns True if the process exited. With a pidfd, this returns the moment
+    the process exits.
+
+    :Returns: Boolean
+
+    :param pid: The process ID of the ``docker exec`` instance.
+    :type pid: Integer
+
+    :param pid_fd: From ``_open_pid``; None to poll the pid instead.
+    :type pid_fd: Integer
+
+    :param timeout: The most seconds to wait.
+    :type timeout: Float
+    """
+    if pid_fd is None:
+        return _poll_pid(pid, timeout)
+    poller = select.poll()
+    poller.register(pid_fd, select.POLLIN)
+    return bool(poller.poll(timeout * 1000))
+
+
+def _poll_pid(pid, timeout):
+    """The fallback for ``_wait_for_pid`` on kernels without pidfds.
+
+    Checks often at first, because most processes exit right away, then backs
+    off to checking 10 times a second.
+    """
+    deadline = time.monotonic() + timeout
+    delay = 0.001
+    while True:
+        try:
+            os.kill(pid, 0) # signal zero does nothing
+        except ProcessLookupError:
+            return True
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, 0.1)
@@ -0,0 +1,154 @@
+# -*- coding: UTF-8 -*-
+"""Keeps the container image up to date without pulling it on every login"""
+import os
+import sys
+import json
+import time
+import subprocess
+
+import docker
+
+from container_shell.lib import utils
+
+
+def update_image(docker_client, config, logger):
+    """Pull the container image, unless it was recently pulled by some other login.
+
+    When ``background_refresh`` is enabled (along with a ``refresh_ttl``), a
+    login never waits on the registry if the image is already local; a stale
+    image is refreshed by a separate process instead. Returns True if this call
+    pulled the image.
+
+    :Returns: Boolean
+
+    :param docker_client: For communicating with the Docker daemon.
+    :type docker_client: docker.client.DockerClient
+
+    :param config: The defined settings (or defaults) that define the behavior of Container Shell.
+    :type config: configparser.ConfigParser
+
+    :param logger: An object for writing errors/messages for debugging problems
+    :type logger: logging.Logger
+    """
+    image = config['config'].get('image')
+    # Without a TTL, no image is ever fresh, so every login would detach a pull.
+    background = (config['config'].get('background_refresh').lower() == 'true'
+                  and config['config'].getint('refresh_ttl') > 0)
+    if background and _is_local(docker_client, image):
+        if not _is_fresh(config, image):
+            logger.debug('Refreshing image %s in the background', image)
+            _spawn_refresh(logger)
+        return False
+    return refresh_image(docker_client, config, logger)
+
+
+def refresh_image(docker_client, config, logger):
+    """Pull the container image if the last successful pull is older than ``refresh_ttl``.
+
+    A host-wide lock ensures concurrent logins share a single pull. Returns
+    True if this call pulled the image.
+
+    :Returns: Boolean
+
+    :param docker_client: For communicating with the Docker daemon.
+    :type docker_client: docker.client.DockerClient
+
+    :param config: The defined settings (or defaults) that define the behavior of Container Shell.
+    :type config: configparser.ConfigParser
+
+    :param logger: An object for writing errors/messages for debugging problems
+    :type logger: logging.Logger
+    """
+    image = config['config'].get('image')
+    if not config['config'].getint('refresh_ttl'):
+        # Caching is disabled, so pull on every login.
+        docker_client.images.pull(image)
+        return True
+    if _is_fresh(config, image) and _is_local(docker_client, image):
+        logger.debug('Image %s was refreshed within the TTL, skipping pull', image)
+        return False
+    with utils.file_lock(_location(config, 'refresh.lock')):
+        # Some other login might have pulled the image while we waited on the lock.
+        if _is_fresh(config, image) and _is_local(docker_client, image):
+            logger.debug('Image %s was refreshed by another login', image)
+            return False
+        previous = _read_cache(config).get(image, {}).get('digest')
+        start = time.time()
+        pulled = docker_client.images.pull(image)
+        logger.info('Pulled image %s in %.3f seconds, digest %s (previously %s)',
+                    image, time.time() - start, pulled.id, previous)
+        _write_cache(config, image, pulled.id)
+    return True
+
+
+def _spawn_refresh(logger):
+    """Start ``container_shell --refresh-image`` in its own session, without waiting on it.
+
+    A new process instead of a fork, since the caller has threads running (the
+    login's executor, or the broker's handlers).
+    """
+    command = [sys.executable]
+    if not getattr(sys, 'frozen', False):
+        # Not the PyInstaller binary, so run the module with the interpreter.
+        command += ['-m', 'container_shell.container_shell']
+    try:
+        #pylint: disable=R1732
+        subprocess.Popen(command + ['--refresh-image'],
+                         stdin=subprocess.DEVNULL,
+                         stdout=subprocess.DEVNULL,
+                         stderr=subprocess.DEVNULL,
+                         close_fds=True,
+                         start_new_session=True)
+    except OSError as doh:
+        logger.exception(doh)
+
+
+def refresh_out_of_band(config, logger):
+    """For ``container_shell --refresh-image``; makes its own connection to the daemon"""
+    try:
+        docker_client = docker.from_env(timeout=config['config'].getint('docker_timeout'))
+        refresh_image(docker_client, config, logger)
+    except Exception as doh: #pylint: disable=W0703
+        logger.exception(doh)
+
+
+def _is_local(docker_client, image):
+    """Determine if the image already exists on the host"""
+    try:
+        docker_client.images.get(image)
+    except docker.errors.ImageNotFound:
+        return False
+    return True
+
+
+def _is_fresh(config, image):
+    """Determine if the last successful pull of an image is within the TTL"""
+    ttl = config['config'].getint('refresh_ttl')
+    pulled = _read_cache(config).get(image, {}).get('pulled', 0)
+    return (time.time() - pulled) < ttl
+
+
+def _read_cache(config):
+    """Load the record of previous pulls; an unreadable record is treated as empty"""
+    try:
+        with open(_location(config, 'refresh.json'), encoding='utf-8') as the_file:
+            return json.load(the_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_cache(config, image, digest):
+    """Record a successful pull. Only call this while holding the refresh lock."""
+    cache = _read_cache(config)
+    cache[image] = {'pulled' : time.time(), 'digest' : digest}
+    location = _location(config, 'refresh.json')
+    tmp_location = '{}.tmp'.format(location)
+    with open(tmp_location, 'w', encoding='utf-8') as the_file:
+        json.dump(cache, the_file)
+    # Readers never see a partially written file
+    os.replace(tmp_location, location)
+
+
+def _location(config, name):
+    """The location of a file used for tracking image refreshes"""
+    return os.path.join(config['config'].get('state_dir'), name)
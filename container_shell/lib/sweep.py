@@ -0,0 +1,239 @@
+# -*- coding: UTF-8 -*-
+"""Finds and removes the containers that sessions leaked.
+
+A session tears down its container when it ends, but a session that's killed
+with SIGKILL, or by the OOM killer, never gets the chance. ``container_shell
+--sweep`` is meant to be ran by cron (or a systemd timer) to clean up after them.
+
+Every session holds a shared lock on a file named after its container for as
+long as it runs. The kernel releases the lock however the session ends, so a
+container whose lock can be taken has no session attached to it. A container
+is only removed if it also has no ``exec`` sessions, and nothing the
+``persist`` setting says to keep.
+"""
+import os
+import time
+import contextlib
+
+from container_shell.lib import utils
+
+docker = utils.LazyImport('docker')
+dockage = utils.LazyImport('container_shell.lib.dockage')
+latency = utils.LazyImport('container_shell.lib.dockerpty.latency')
+pool = utils.LazyImport('container_shell.lib.pool')
+entry = utils.LazyImport('container_shell.container_shell')
+futures = utils.LazyImport('concurrent.futures')
+
+# Containers created (or claimed from the warm pool) less than this many
+# seconds ago might belong to a login that hasn't taken its session lock yet.
+MIN_AGE = 300
+
+# The session locks held by this process. Never released on purpose; they go
+# away when the process does.
+_SESSIONS = contextlib.ExitStack()
+
+
+def hold_session(config, container_id, logger):
+    """Mark the container as in use until this process exits.
+
+    :Returns: None
+
+    :param config: The defined settings (or defaults) that define the behavior of Container Shell.
+    :type config: configparser.ConfigParser
+
+    :param container_id: The container the user is connected to.
+    :type container_id: String
+
+    :param logger: An object for writing errors/messages for debugging problems
+    :type logger: logging.Logger
+    """
+    try:
+        _SESSIONS.enter_context(utils.file_lock(_session_location(config, container_id),
+                                                shared=True))
+    except OSError as doh:
+        logger.error('Unable to lock session for container %s: %s', container_id[:12], doh)
+
+
+def mark_claimed(config, container_id, logger):
+    """Record that a warm pool container was just claimed by a login.
+
+    A claimed container keeps the created label from when the pool made it,
+    so until the login takes its session lock, the container would otherwise
+    look old and unused.
+
+    :Returns: None
+
+    :param config: The defined settings (or defaults) that define the behavior of Container Shell.
+    :type config: configparser.ConfigParser
+
+    :param container_id: The pooled container being claimed.
+    :type container_id: String
+
+    :param logger: An object for writing errors/messages for debugging problems
+    :type logger: logging.Logger
+    """
+    location = _claimed_location(config, container_id)
+    try:
+        os.makedirs(os.path.dirname(location), exist_ok=True)
+        os.close(os.open(location, os.O_WRONLY | os.O_CREAT, 0o600))
+        os.utime(location)
+    except OSError as doh:
+        logger.error('Unable to mark container %s as claimed: %s', container_id[:12], doh)
+
+
+def sweep(docker_client, config, logger, dry_run=False, min_age=MIN_AGE):
+    """Remove the containers that no session is using.
+
+    That's containers that were never started, or have exited, along with
+    running ones that have no session attached, and nothing the ``persist``
+    setting says to keep. Idle warm pool containers are removed once the pool
+    is disabled.
+
+    Containers are checked and removed in parallel; no more than
+    ``reaper_slots`` at once, across every sweep and teardown on the host.
+    Prints a line per container that was (or with ``dry_run``, would be)
+    removed, followed by a summary.
+
+    :Returns: Dictionary
+
+    :param docker_client: For communicating with the Docker daemon.
+    :type docker_client: docker.client.DockerClient
+
+    :param config: The defined settings (or defaults) that define the behavior of Container Shell.
+    :type config: configparser.ConfigParser
+
+    :param logger: An object for writing errors/messages for debugging problems
+    :type logger: logging.Logger
+
+    :param dry_run: Set to True to report the orphaned containers, without removing them.
+    :type dry_run: Boolean
+
+    :param min_age: Ignore containers created less than this many seconds ago.
+    :type min_age: Integer
+    """
+    began = time.monotonic()
+    filters = {'label' : dockage.LABEL_SESSION}
+    # While the warm pool is enabled, its idle containers are looked after by
+    # the pool refill. Once it's disabled, nothing else removes them.
+    keep_pool = pool._size(config) #pylint: disable=W0212
+    found = [container for container in docker_client.containers.list(all=True, filters=filters)
+             if not (keep_pool and container.name.startswith(pool.NAME_PREFIX))]
+    stats = {'found' : len(found), 'young' : 0, 'live' : 0, 'kept' : 0,
+             'orphaned' : 0, 'removed' : 0, 'errors' : 0}
+    candidates = []
+    for container in found:
+        if _age(container, config) < min_age:
+            stats['young'] += 1
+        else:
+            candidates.append(container)
+    timings = latency.Histogram()
+    workers = max(entry._reaper_slots(config), 1) #pylint: disable=W0212
+    with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        checks = [executor.submit(_sweep_one, container, config, logger, dry_run)
+                  for container in candidates]
+        for container, check in zip(candidates, checks):
+            outcome, elapsed = check.result()
+            stats[outcome] += 1
+            if outcome in ('orphaned', 'removed'):
+                timings.record(int(elapsed * 1000000))
+                print('{} {} ({})'.format('Would remove' if dry_run else 'Removed',
+                                          container.name, container.short_id))
+    if not dry_run:
+        _forget_sessions(docker_client, config, logger)
+    summary = ' '.join(['{}={}'.format(name, count) for name, count in stats.items()])
+    summary = '{} {} total={:.6f}'.format(summary, timings.summary('teardown'),
+                                          time.monotonic() - began)
+    print('{}: {}'.format('Dry run' if dry_run else 'Swept', summary))
+    logger.info('Sweep dry_run=%s %s', dry_run, summary)
+    return stats
+
+
+def _sweep_one(container, config, logger, dry_run):
+    """Check, and unless ``dry_run``, remove one container.
+
+    Returns the outcome (the ``stats`` key to count) and how many seconds it took.
+    """
+    began = time.monotonic()
+    location = _session_location(config, container.id)
+    try:
+        with utils.file_lock(location, blocking=False) as unused:
+            # Holding the lock keeps a new session from starting mid-teardown.
+            if not unused:
+                outcome = 'live'
+            elif container.status != 'running' or container.name.startswith(pool.NAME_PREFIX):
+                # Nothing a user ran is inside, so there's nothing to persist.
+                outcome = 'orphaned' if dry_run else _remove(container)
+            elif dry_run:
+                keep = entry._should_not_kill(container, #pylint: disable=W0212
+                                              config['config']['persist'],
+                                              config['config']['persist_egrep'],
+                                              config['binaries']['ps'],
+                                              logger)
+                outcome = 'kept' if keep else 'orphaned'
+            else:
+                removed = entry._reap(container.id, #pylint: disable=W0212
+                                      config['config']['term_signal'],
+                                      config,
+                                      logger,
+                                      container=container)
+                outcome = {True : 'removed', False : 'kept', None : 'errors'}[removed]
+    except Exception as doh: #pylint: disable=W0703
+        logger.exception(doh)
+        outcome = 'errors'
+    return outcome, time.monotonic() - began
+
+
+def _remove(container):
+    """Remove a container that was never started, has exited, or was left in the warm pool"""
+    try:
+        container.remove(force=True)
+    except docker.errors.NotFound:
+        pass
+    return 'removed'
+
+
+def _forget_sessions(docker_client, config, logger):
+    """Delete the session lock, and claim, files of containers that no longer exist"""
+    try:
+        names = os.listdir(_sessions_dir(config))
+    except FileNotFoundError:
+        return
+    # Listed after the lock files, so a container made in between can't be missed.
+    existing = {container.id for container in docker_client.containers.list(
+        all=True, filters={'label' : dockage.LABEL_SESSION})}
+    for name in names:
+        container_id, _ = os.path.splitext(name)
+        if container_id in existing:
+            continue
+        try:
+            os.unlink(os.path.join(_sessions_dir(config), name))
+        except OSError as doh:
+            logger.debug('Unable to delete session file %s: %s', name, doh)
+
+
+def _age(container, config):
+    """Seconds since Container Shell created the container, or claimed it from the warm pool"""
+    try:
+        created = int(container.labels.get(dockage.LABEL_CREATED, 0))
+    except ValueError:
+        created = 0
+    try:
+        created = max(created, os.stat(_claimed_location(config, container.id)).st_mtime)
+    except OSError:
+        pass
+    return time.time() - created
+
+
+def _session_location(config, container_id):
+    """The lock file held by every session connected to a container"""
+    return os.path.join(_sessions_dir(config), '{}.lock'.format(container_id))
+
+
+def _claimed_location(config, container_id):
+    """Where ``mark_claimed`` records when a pooled container was claimed"""
+    return os.path.join(_sessions_dir(config), '{}.claimed'.format(container_id))
+
+
+def _sessions_dir(config):
+    """Where the session lock files are kept"""
+    return os.path.join(config['config'].get('state_dir'), 'sessions')
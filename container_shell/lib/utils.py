@@ -2,8 +2,86 @@
 """Generic functions that don't find into different modules"""
 import os
 import sys
+import time
+import fcntl
 import logging
 import logging.handlers
+import importlib
+import contextlib
+
+
+class LazyImport:
+    """Defers importing a module until one of its attributes is first used.
+
+    Keeps logins that never touch Docker from paying to load the Docker SDK
+    (and ``requests``, ``urllib3``, etc). Modules loaded this way must be
+    passed to PyInstaller via ``--hidden-import``.
+    """
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+    def __repr__(self):
+        return "{cls}({name})".format(cls=type(self).__name__, name=self._name)
+
+
+class PhaseTimer:
+    """Times the phases of a single login, and writes them as one log record.
+
+    Durations come from a monotonic clock, so they're unaffected by changes to
+    the wall clock. The record is a line of ``key=value`` pairs in seconds,
+    so per-phase percentiles can be computed from the log alone::
+
+      Login timings path=shared config=0.000912 client=0.010224 ... total=0.231020
+    """
+    def __init__(self):
+        self.began = time.monotonic()
+        self.path = ''
+        self.phases = {}
+        self._logged = False
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Time the code in the ``with`` block as the named phase"""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0) + time.monotonic() - start
+
+    def timed(self, name, func):
+        """Wrap a callable, so every call is timed as the named phase"""
+        def wrapper(*args, **kwargs):
+            with self.phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    def mark(self, name):
+        """Record the time from the start of the login until now; only the first call counts"""
+        self.phases.setdefault(name, time.monotonic() - self.began)
+
+    def log(self, logger):
+        """Write the record for this login. Only the first call writes anything.
+
+        :Returns: None
+
+        :param logger: An object for writing errors/messages for debugging problems
+        :type logger: logging.Logger
+        """
+        if self._logged:
+            return
+        self._logged = True
+        fields = ['path={}'.format(self.path or 'unknown')]
+        # Copy; the image refresh might still be running on another thread.
+        for name, value in list(self.phases.items()):
+            fields.append('{}={:.6f}'.format(name, value))
+        fields.append('total={:.6f}'.format(time.monotonic() - self.began))
+        logger.info('Login timings %s', ' '.join(fields))
 
 
 def skip_container(username, skip_users):
@@ -32,6 +110,73 @@ def printerr(message):
     sys.stderr.flush()
 
 
+@contextlib.contextmanager
+def file_lock(location, blocking=True, shared=False):
+    """A host-wide lock, so different Container Shell processes can coordinate work.
+
+    Yields True if the lock was obtained, and False if ``blocking`` is False and
+    some other process already holds the lock.
+
+    :Returns: Generator
+
+    :param location: The filesystem location of the lock file.
+    :type location: String
+
+    :param blocking: Set to False to give up immediately if the lock is held.
+    :type blocking: Boolean
+
+    :param shared: Set to True so any number of processes can hold the lock at
+                   once; only an exclusive lock has to wait on them.
+    :type shared: Boolean
+    """
+    os.makedirs(os.path.dirname(location), exist_ok=True)
+    lock_fd = os.open(location, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        flags = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        if not blocking:
+            flags |= fcntl.LOCK_NB
+        try:
+            fcntl.flock(lock_fd, flags)
+        except BlockingIOError:
+            yield False
+        else:
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_fd, fcntl.LOCK_UN)
+    finally:
+        os.close(lock_fd)
+
+
+def detach(func, *args, **kwargs):
+    """Run a function in a fully detached process, so the caller never waits on it.
+
+    The process is double-forked into its own session, and its stdio points to
+    /dev/null so it doesn't hold the user's SSH session open.
+
+    :Returns: None
+
+    :param func: The function to run in the detached process.
+    :type func: Callable
+    """
+    pid = os.fork()
+    if pid:
+        # Reap the intermediate child; the grandchild is adopted by init.
+        os.waitpid(pid, 0)
+        return
+    try:
+        os.setsid()
+        if os.fork():
+            return
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for std_fd in (0, 1, 2):
+            os.dup2(devnull, std_fd)
+        func(*args, **kwargs)
+    finally:
+        # Never return to the caller's code, or run its atexit handlers.
+        os._exit(0) #pylint: disable=W0212
+
+
 class WorldWritableFileHandler(logging.handlers.RotatingFileHandler):
     """Creates a log file that any user can write to"""
     def _open(self):
@@ -1,7 +1,11 @@
 # -*- coding: UTF-8 -*-
 """A suite of unit test for the dockerpty.io module"""
+import os
 import errno
+import socket
+import struct
 import unittest
+import threading
 from unittest.mock import patch, MagicMock
 
 from container_shell.lib.dockerpty import  io
@@ -22,6 +26,11 @@ class FakeFD(FakeObj):
         return 'some file descriptor object'
 
 
+def frame(payload, kind=1):
+    """Multiplex some data the same way Docker does when there's no TTY"""
+    return struct.pack('>BxxxL', kind, len(payload)) + payload
+
+
 class TestFunctions(unittest.TestCase):
     """A suite of test cases for the functions in dockerpty.io"""
     @patch.object(io.fcntl, 'fcntl')
@@ -80,6 +89,139 @@ class TestFunctions(unittest.TestCase):
             io.select(MagicMock(), MagicMock())
 
 
+class TestSelector(unittest.TestCase):
+    """A set of test cases for the ``Selector`` object"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.left, self.right = socket.socketpair()
+        self.selector = io.Selector()
+
+    def tearDown(self):
+        """Runs after every test case"""
+        self.selector.close()
+        self.left.close()
+        self.right.close()
+
+    def test_reading(self):
+        """``dockerpty.io`` Selector.select returns readers with data"""
+        self.selector.set_reading(self.left)
+        self.right.send(b'woot')
+
+        read_ready, write_ready = self.selector.select(timeout=1)
+
+        self.assertEqual(read_ready, [self.left])
+        self.assertEqual(write_ready, [])
+
+    def test_not_ready(self):
+        """``dockerpty.io`` Selector.select doesn't return readers without data"""
+        self.selector.set_reading(self.left)
+
+        read_ready, _ = self.selector.select(timeout=0)
+
+        self.assertEqual(read_ready, [])
+
+    def test_shared_fd(self):
+        """``dockerpty.io`` Selector supports a reader and a writer sharing a file descriptor"""
+        writer = io.Stream(self.left)
+        self.selector.set_reading(self.left)
+        self.selector.set_writing(writer)
+        self.right.send(b'woot')
+
+        read_ready, write_ready = self.selector.select(timeout=1)
+
+        self.assertEqual(read_ready, [self.left])
+        self.assertEqual(write_ready, [writer])
+
+    def test_writing_off(self):
+        """``dockerpty.io`` Selector.set_writing can turn off interest in writing"""
+        self.selector.set_reading(self.left)
+        self.selector.set_writing(self.left)
+        self.selector.set_writing(self.left, False)
+
+        _, write_ready = self.selector.select(timeout=0)
+
+        self.assertEqual(write_ready, [])
+
+    def test_no_change(self):
+        """``dockerpty.io`` Selector only touches the registration when interest changes"""
+        self.selector.set_writing(self.left)
+        with patch.object(self.selector._selector, 'modify') as fake_modify:
+            self.selector.set_writing(self.left)
+            self.selector.set_writing(self.left)
+
+        self.assertFalse(fake_modify.called)
+
+    def test_remove_closed(self):
+        """``dockerpty.io`` Selector.remove works after the object is closed"""
+        self.selector.set_reading(self.left)
+        self.left.close()
+
+        self.selector.remove(self.left)
+
+        self.assertEqual(self.selector._selector.get_map(), {})
+
+    def test_select_interrupts(self):
+        """``dockerpty.io`` Selector.select returns empty lists if interrupted by a signal"""
+        with patch.object(self.selector._selector, 'select') as fake_select:
+            fake_select.side_effect = InterruptedError(errno.EINTR, 'testing')
+            output = self.selector.select(timeout=0)
+
+        self.assertEqual(output, ([], []))
+
+    def test_select_error(self):
+        """``dockerpty.io`` Selector.select raises unexpected errors"""
+        with patch.object(self.selector._selector, 'select') as fake_select:
+            fake_select.side_effect = OSError(errno.EBADF, 'testing')
+            with self.assertRaises(OSError):
+                self.selector.select(timeout=0)
+
+
+class TestNotifier(unittest.TestCase):
+    """A set of test cases for the ``Notifier`` object"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.notifier = io.Notifier()
+        self.selector = io.Selector()
+        self.selector.set_reading(self.notifier)
+
+    def tearDown(self):
+        """Runs after every test case"""
+        self.selector.close()
+        self.notifier.close()
+
+    def test_notify(self):
+        """``dockerpty.io`` Notifier.notify wakes up the selector"""
+        self.notifier.notify()
+
+        read_ready, _ = self.selector.select(timeout=1)
+
+        self.assertEqual(read_ready, [self.notifier])
+
+    def test_idle(self):
+        """``dockerpty.io`` Notifier isn't readable until notified"""
+        read_ready, _ = self.selector.select(timeout=0)
+
+        self.assertEqual(read_ready, [])
+
+    def test_clear(self):
+        """``dockerpty.io`` Notifier.clear consumes every pending notification"""
+        self.notifier.notify()
+        self.notifier.notify()
+
+        cleared = self.notifier.clear()
+        read_ready, _ = self.selector.select(timeout=0)
+
+        self.assertTrue(cleared)
+        self.assertEqual(read_ready, [])
+
+    def test_notify_closed(self):
+        """``dockerpty.io`` Notifier.notify is harmless once closed"""
+        self.selector.remove(self.notifier)
+        self.notifier.close()
+
+        self.notifier.notify()
+
+
 class TestStream(unittest.TestCase):
     """A suite of test cases for the Stream object"""
     def test_recoverable_errors(self):
@@ -154,6 +296,39 @@ class TestStream(unittest.TestCase):
         with self.assertRaises(OSError):
             io.Stream(fake_fd).read()
 
+    def test_read_no_wait(self):
+        """``dockerpty.io`` Stream.read raises BlockingIOError when told not to wait"""
+        left, right = socket.socketpair()
+        right.setblocking(False)
+        try:
+            with self.assertRaises(BlockingIOError):
+                io.Stream(right).read(wait=False)
+        finally:
+            left.close()
+            right.close()
+
+    def test_read_into(self):
+        """``dockerpty.io`` Stream.read_into fills the buffer, and returns how much was read"""
+        fake_fd = MagicMock()
+        fake_fd.recv_into.return_value = 4
+
+        output = io.Stream(fake_fd).read_into(bytearray(10))
+        expected = 4
+
+        self.assertEqual(output, expected)
+
+    def test_read_into_os(self):
+        """``dockerpty.io`` Stream.read_into works with file descriptors that aren't sockets"""
+        read_fd, write_fd = os.pipe()
+        buffer = bytearray(10)
+        os.write(write_fd, b'woot')
+        with open(read_fd, 'rb') as the_file:
+            output = io.Stream(the_file).read_into(buffer)
+        os.close(write_fd)
+
+        self.assertEqual(output, 4)
+        self.assertEqual(bytes(buffer[:4]), b'woot')
+
     def test_write(self):
         """``dockerpty.io`` Stream.write adds to the buffer, then calls 'do_write'"""
         data = b'yay bites!'
@@ -196,9 +371,10 @@ class TestStream(unittest.TestCase):
     def test_do_write(self):
         """``dockerpty.io`` Stream.do_write returns how many bytes were written"""
         fake_fd = MagicMock()
-        fake_fd.send.return_value = 93
+        fake_fd.sendmsg.return_value = 93
 
         stream = io.Stream(fake_fd)
+        stream.buffer = b'a' * 100
         written = stream.do_write()
         expected = 93
 
@@ -217,25 +393,108 @@ class TestStream(unittest.TestCase):
 
         self.assertTrue(fake_close.called)
 
-    @patch.object(io.os, 'write')
-    def test_do_write_os_write(self, fake_write):
-        """``dockerpty.io`` Stream.do_write calls os.write when the file descriptor has no 'send' method"""
+    @patch.object(io.os, 'writev')
+    def test_do_write_os_write(self, fake_writev):
+        """``dockerpty.io`` Stream.do_write calls os.writev when the file descriptor has no 'send' method"""
         fake_fd = FakeFD()
         fake_fd.fileno = lambda: 32
+        fake_writev.return_value = 9
+        stream = io.Stream(fake_fd)
+        stream.buffer = b'some data'
 
-        io.Stream(fake_fd).do_write()
+        stream.do_write()
 
-        self.assertTrue(fake_write.called)
+        self.assertTrue(fake_writev.called)
 
     def test_do_write_error(self):
         """``dockerpty.io`` Stream.do_write closes when requested after writing"""
         fake_fd = MagicMock()
         error = OSError()
         error.errno = 2346
-        fake_fd.send.side_effect = [error]
+        fake_fd.sendmsg.side_effect = [error]
+        stream = io.Stream(fake_fd)
+        stream.buffer = b'some data'
 
         with self.assertRaises(OSError):
-            io.Stream(fake_fd).do_write()
+            stream.do_write()
+
+    def test_do_write_partial(self):
+        """``dockerpty.io`` Stream.do_write keeps the unwritten data, in order"""
+        fake_fd = MagicMock()
+        fake_fd.sendmsg.return_value = 5
+        stream = io.Stream(fake_fd)
+        stream.do_write = lambda: None
+        stream.write(b'abc')
+        stream.write(b'defgh')
+        del stream.do_write
+
+        stream.do_write()
+
+        self.assertEqual(stream.buffer, b'fgh')
+        self.assertTrue(stream.needs_write())
+
+    def test_do_write_gathers(self):
+        """``dockerpty.io`` Stream.do_write writes every pending chunk with a single call"""
+        fake_fd = MagicMock()
+        fake_fd.sendmsg.return_value = 0
+        stream = io.Stream(fake_fd)
+
+        stream.write(b'abc')
+        stream.write(b'def')
+        the_args, _ = fake_fd.sendmsg.call_args
+
+        self.assertEqual([bytes(x) for x in the_args[0]], [b'abc', b'def'])
+
+    def test_do_write_no_gather(self):
+        """``dockerpty.io`` Stream.do_write falls back to 'send' for sockets without 'sendmsg' (i.e. TLS)"""
+        fake_fd = MagicMock()
+        fake_fd.sendmsg.side_effect = NotImplementedError()
+        fake_fd.send.return_value = 3
+        stream = io.Stream(fake_fd)
+
+        stream.write(b'abc')
+
+        self.assertTrue(fake_fd.send.called)
+        self.assertFalse(stream.needs_write())
+
+    def test_do_write_would_block(self):
+        """``dockerpty.io`` Stream.do_write keeps the data buffered when the socket is full"""
+        fake_fd = MagicMock()
+        fake_fd.sendmsg.side_effect = BlockingIOError(errno.EAGAIN, 'testing')
+        stream = io.Stream(fake_fd)
+
+        stream.write(b'abc')
+
+        self.assertEqual(stream.buffer, b'abc')
+
+    def test_write_copies_mutable(self):
+        """``dockerpty.io`` Stream.write copies unwritten data from buffers the caller might reuse"""
+        fake_fd = MagicMock()
+        fake_fd.sendmsg.return_value = 1
+        data = bytearray(b'abc')
+        stream = io.Stream(fake_fd)
+
+        stream.write(data)
+        data[:] = b'xyz'
+
+        self.assertEqual(stream.buffer, b'bc')
+
+    def test_backlog(self):
+        """``dockerpty.io`` Stream delivers a large backlog intact to a slow reader"""
+        left, right = socket.socketpair()
+        left.setblocking(False)
+        stream = io.Stream(left)
+        data = bytes(range(256)) * 4096
+        for index in range(0, len(data), 1000):
+            stream.write(data[index:index + 1000])
+        received = b''
+        while len(received) < len(data):
+            received += right.recv(65536)
+            stream.do_write()
+        left.close()
+        right.close()
+
+        self.assertEqual(received, data)
 
     def test_needs_write(self):
         """``dockerpty.io`` Stream.needs_write Returns True when there's data in the buffer"""
@@ -252,6 +511,44 @@ class TestStream(unittest.TestCase):
 
         self.assertFalse(stream.needs_write())
 
+    def test_full(self):
+        """``dockerpty.io`` Stream is full once the pending data passes the high water mark"""
+        left, right = socket.socketpair()
+        left.setblocking(False)
+        stream = io.Stream(left, high_water=1024, low_water=256)
+        with patch.object(stream, 'do_write'):
+            stream.write(b'a' * 1000)
+            before = stream.full
+            stream.write(b'a' * 100)
+        left.close()
+        right.close()
+
+        self.assertFalse(before)
+        self.assertTrue(stream.full)
+
+    def test_full_low_water(self):
+        """``dockerpty.io`` Stream stays full until it drains to the low water mark"""
+        left, right = socket.socketpair()
+        left.setblocking(False)
+        stream = io.Stream(left, high_water=1024, low_water=256)
+        with patch.object(stream, 'do_write'):
+            stream.write(b'a' * 2048)
+        stream._consume(1024)
+        drained_some = stream.full
+        stream._consume(1024 - 256)
+        left.close()
+        right.close()
+
+        self.assertTrue(drained_some)
+        self.assertFalse(stream.full)
+
+    def test_full_buffer(self):
+        """``dockerpty.io`` Stream is full if the buffer is set past the high water mark"""
+        stream = io.Stream(MagicMock(), high_water=4, low_water=2)
+        stream.buffer = b'some data'
+
+        self.assertTrue(stream.full)
+
     def test_close(self):
         """``dockerpty.io`` Stream.close closes the file descriptor"""
         fake_fd = MagicMock()
@@ -287,6 +584,16 @@ class TestStream(unittest.TestCase):
 
 class TestDemuxer(unittest.TestCase):
     """A suite of test cases for the Demuxer object"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.left, self.right = socket.socketpair()
+        self.demuxer = io.Demuxer(io.Stream(self.right))
+
+    def tearDown(self):
+        """Runs after every test case"""
+        self.left.close()
+        self.right.close()
+
     def test_init(self):
         """``dockerpty.io`` Demuxer only requires a Stream for init"""
         fake_stream = MagicMock()
@@ -314,35 +621,153 @@ class TestDemuxer(unittest.TestCase):
         self.assertTrue(fake_stream.set_blocking.called)
 
     def test_read(self):
-        """``dockerpty.io`` Demuxer reads N bytes of data, and returns it"""
-        fake_stream = MagicMock()
-        fake_stream.read.return_value = b'some data!'
-        demuxer = io.Demuxer(fake_stream)
-        demuxer._next_packet_size = lambda x: 10
+        """``dockerpty.io`` Demuxer strips the header, and returns the payload"""
+        self.left.sendall(frame(b'some data!'))
 
-        data = demuxer.read()
+        data = self.demuxer.read()
         expected = b'some data!'
 
         self.assertEqual(data, expected)
 
+    def test_read_memoryview(self):
+        """``dockerpty.io`` Demuxer returns the payload as a memoryview, not a copy"""
+        self.left.sendall(frame(b'some data!'))
+
+        data = self.demuxer.read()
+
+        self.assertTrue(isinstance(data, memoryview))
+
+    def test_read_many_frames(self):
+        """``dockerpty.io`` Demuxer returns every buffered frame from a single read"""
+        self.left.sendall(frame(b'out') + frame(b'err', kind=2) + frame(b'more'))
+
+        data = self.demuxer.read()
+        expected = b'outerrmore'
+
+        self.assertEqual(data, expected)
+
+    def test_read_n(self):
+        """``dockerpty.io`` Demuxer never returns more than N bytes"""
+        self.left.sendall(frame(b'a' * 100))
+
+        data = self.demuxer.read(20)
+
+        self.assertTrue(len(data) <= 20)
+
+    def test_read_remain(self):
+        """``dockerpty.io`` Demuxer tracks how much of a partial frame is left"""
+        self.left.sendall(frame(b'a' * 100))
+
+        data = self.demuxer.read(20)
+
+        self.assertEqual(self.demuxer.remain, 100 - len(data))
+
+    def test_read_partial_frame(self):
+        """``dockerpty.io`` Demuxer returns the rest of a partial frame on the next read"""
+        self.left.sendall(frame(b'some data!')[:12])
+        first = bytes(self.demuxer.read())
+        self.left.sendall(frame(b'some data!')[12:] + frame(b'next'))
+
+        second = self.demuxer.read()
+
+        self.assertEqual(first, b'some')
+        self.assertEqual(second, b' data!next')
+
+    def test_read_split_header(self):
+        """``dockerpty.io`` Demuxer handles a header split across reads"""
+        self.left.sendall(frame(b'first') + frame(b'second')[:3])
+        first = bytes(self.demuxer.read())
+        self.left.sendall(frame(b'second')[3:])
+
+        second = self.demuxer.read()
+
+        self.assertEqual(first, b'first')
+        self.assertEqual(second, b'second')
+
+    def test_read_only_headers(self):
+        """``dockerpty.io`` Demuxer keeps reading if it only got headers"""
+        self.left.sendall(frame(b'') + frame(b'woot')[:8])
+        self.left.sendall(b'woot')
+
+        data = self.demuxer.read()
+        expected = b'woot'
+
+        self.assertEqual(data, expected)
+
+    def test_read_frame_boundary(self):
+        """``dockerpty.io`` Demuxer handles a read with the end of one frame, and the start of the next"""
+        first, second = os.urandom(100), os.urandom(100)
+        self.left.sendall(frame(first) + frame(second))
+
+        data = b''
+        while len(data) < 200:
+            data += self.demuxer.read(40)
+
+        self.assertEqual(data, first + second)
+
+    def test_read_frame_boundary_short_tail(self):
+        """``dockerpty.io`` Demuxer handles a read that's mostly the start of the next frame"""
+        first, second = os.urandom(100), os.urandom(100)
+        self.left.sendall(frame(first) + frame(second))
+        self.demuxer.read(90)
+
+        data = self.demuxer.read(100)
+
+        self.assertEqual(data, first[82:] + second[:74])
+        self.assertEqual(self.demuxer.remain, 26)
+
+    def test_read_frame_boundary_long_tail(self):
+        """``dockerpty.io`` Demuxer handles a read that's mostly the end of the previous frame"""
+        first, second = os.urandom(100), os.urandom(100)
+        self.left.sendall(frame(first) + frame(second))
+        self.demuxer.read(20)
+
+        data = self.demuxer.read(100)
+
+        self.assertEqual(data, first[12:] + second[:4])
+        self.assertEqual(self.demuxer.remain, 96)
+
+    def test_read_grows(self):
+        """``dockerpty.io`` Demuxer grows its buffer for reads larger than the default"""
+        payload = os.urandom(io.Demuxer.BUFFER_SIZE * 2)
+        self.left.sendall(frame(payload))
+        self.left.close()
+
+        data = b''
+        while True:
+            chunk = self.demuxer.read(len(payload))
+            if chunk is None:
+                break
+            data += chunk
+
+        self.assertEqual(data, payload)
+
     def test_read_zero(self):
-        """``dockerpty.io`` Demuxer returns None if there's no data to read"""
-        fake_stream = MagicMock()
-        demuxer = io.Demuxer(fake_stream)
-        demuxer._next_packet_size = lambda x: 0
+        """``dockerpty.io`` Demuxer returns None at the end of the stream"""
+        self.left.close()
 
-        output = demuxer.read()
+        output = self.demuxer.read()
 
         self.assertTrue(output is None)
 
+    def test_read_no_wait(self):
+        """``dockerpty.io`` Demuxer keeps a header it read when told not to wait for the payload"""
+        self.right.setblocking(False)
+        self.left.sendall(frame(b'woot')[:8])
+        with self.assertRaises(BlockingIOError):
+            self.demuxer.read(wait=False)
+        self.left.sendall(b'woot')
+
+        data = self.demuxer.read(wait=False)
+
+        self.assertEqual(data, b'woot')
+
     def test_read_closed_stream(self):
         """``dockerpty.io`` Demuxer returns as much as it can if the stream closes"""
-        fake_stream = MagicMock()
-        fake_stream.read.side_effect = [b'some', b'']
-        demuxer = io.Demuxer(fake_stream)
-        demuxer._next_packet_size = lambda x: 10
+        self.left.sendall(frame(b'some data!')[:12])
+        self.left.close()
 
-        output = demuxer.read()
+        output = self.demuxer.read()
         expected = b'some'
 
         self.assertEqual(output, expected)
@@ -365,6 +790,14 @@ class TestDemuxer(unittest.TestCase):
 
         self.assertTrue(fake_stream.needs_write.called)
 
+    def test_full(self):
+        """``dockerpty.io`` Demuxer proxies to the Stream for 'full'"""
+        fake_stream = MagicMock()
+        fake_stream.full = True
+        demuxer = io.Demuxer(fake_stream)
+
+        self.assertTrue(demuxer.full)
+
     def test_needs_write_no_attr(self):
         """``dockerpty.io`` Demuxer return False if the Stream object has no 'needs_write' attribute"""
         fake_stream = FakeObj()
@@ -410,40 +843,6 @@ class TestDemuxer(unittest.TestCase):
 
         self.assertEqual(the_repr, expected)
 
-    def test_next_packet_size(self):
-        """``dockerpty.io`` Demuxer pulls the payload size from the header from Docker"""
-        fake_stream = MagicMock()
-        fake_stream.read.return_value = b'12345678'
-        demuxer = io.Demuxer(fake_stream)
-
-        answer = demuxer._next_packet_size()
-        expected = 0
-
-        self.assertEqual(answer, expected)
-
-    def test_next_packet_size_remain(self):
-        """``dockerpty.io`` Demuxer _next_packet_size handles remainders"""
-        fake_stream = MagicMock()
-        fake_stream.read.return_value = b'12345678'
-        demuxer = io.Demuxer(fake_stream)
-        demuxer.remain = 2
-
-        answer = demuxer._next_packet_size()
-        expected = 0
-
-        self.assertEqual(answer, expected)
-
-    def test_next_packet_size_zero_read(self):
-        """``dockerpty.io`` Demuxer '_next_packet_size' returns zero if nothing is read from the Stream"""
-        fake_stream = MagicMock()
-        fake_stream.read.return_value = b''
-        demuxer = io.Demuxer(fake_stream)
-
-        answer = demuxer._next_packet_size()
-        expected = 0
-
-        self.assertEqual(answer, expected)
-
 
 class TestPump(unittest.TestCase):
     """A suite of test cases for the Pump object"""
@@ -451,6 +850,7 @@ class TestPump(unittest.TestCase):
         """``dockerpty.io`` Pump requires two Streams for init"""
         fake_from_stream = MagicMock()
         fake_to_stream = MagicMock()
+        fake_to_stream.full = False
 
         pump = io.Pump(fake_from_stream, fake_to_stream)
 
@@ -461,6 +861,7 @@ class TestPump(unittest.TestCase):
         fake_from_stream = MagicMock()
         fake_from_stream.fileno.return_value = 9001
         fake_to_stream = MagicMock()
+        fake_to_stream.full = False
         pump = io.Pump(fake_from_stream, fake_to_stream)
 
         fileno = pump.fileno()
@@ -472,6 +873,7 @@ class TestPump(unittest.TestCase):
         """``dockerpty.io`` Pump.set_blocking adjusts the 'from_stream''"""
         fake_from_stream = MagicMock()
         fake_to_stream = MagicMock()
+        fake_to_stream.full = False
         pump = io.Pump(fake_from_stream, fake_to_stream)
 
         pump.set_blocking('some value')
@@ -481,8 +883,9 @@ class TestPump(unittest.TestCase):
     def test_flush(self):
         """``dockerpty.io`` Pump.flush returns the number of bytes written into the 'to_stream'"""
         fake_from_stream = MagicMock()
-        fake_from_stream.read.return_value = b'some bytes'
+        fake_from_stream.read.side_effect = [b'some bytes', BlockingIOError()]
         fake_to_stream = MagicMock()
+        fake_to_stream.full = False
         fake_to_stream.write = lambda x: len(x)
         pump = io.Pump(fake_from_stream, fake_to_stream)
 
@@ -491,11 +894,168 @@ class TestPump(unittest.TestCase):
 
         self.assertEqual(written, expected)
 
+    def test_flush_drains(self):
+        """``dockerpty.io`` Pump.flush keeps reading until the 'from_stream' would block"""
+        fake_from_stream = MagicMock()
+        fake_from_stream.read.side_effect = [b'a', b'b', b'c', BlockingIOError()]
+        fake_to_stream = MagicMock()
+        fake_to_stream.full = False
+        fake_to_stream.write = lambda x: len(x)
+        pump = io.Pump(fake_from_stream, fake_to_stream)
+
+        written = pump.flush()
+
+        self.assertEqual(written, 3)
+        self.assertEqual(fake_from_stream.read.call_count, 4)
+
+    def test_flush_tls(self):
+        """``dockerpty.io`` Pump.flush stops reading when a TLS socket needs more data"""
+        fake_from_stream = MagicMock()
+        fake_from_stream.read.side_effect = [b'a', io.SSLWantReadError()]
+        fake_to_stream = MagicMock()
+        fake_to_stream.full = False
+        fake_to_stream.write = lambda x: len(x)
+        pump = io.Pump(fake_from_stream, fake_to_stream)
+
+        written = pump.flush()
+
+        self.assertEqual(written, 1)
+
+    def test_flush_budget(self):
+        """``dockerpty.io`` Pump.flush stops once it's flushed the budget"""
+        fake_from_stream = MagicMock()
+        fake_from_stream.read.side_effect = lambda n, wait: b'a' * n
+        fake_to_stream = MagicMock()
+        fake_to_stream.full = False
+        fake_to_stream.write = lambda x: len(x)
+        pump = io.Pump(fake_from_stream, fake_to_stream)
+
+        written = pump.flush()
+
+        self.assertTrue(io.Pump.BUDGET <= written < io.Pump.BUDGET + io.Pump.MAX_READ)
+
+    def test_flush_full(self):
+        """``dockerpty.io`` Pump.flush stops reading once the 'to_stream' is full"""
+        source, source_peer = socket.socketpair()
+        dest, dest_peer = socket.socketpair()
+        source.setblocking(False)
+        dest.setblocking(False)
+        source_peer.sendall(b'a' * 64 * 1024)
+        to_stream = io.Stream(dest, high_water=4096, low_water=1024)
+        # Fill the writer's socket, so everything that's read gets buffered.
+        try:
+            while True:
+                dest.send(b'a' * 64 * 1024)
+        except BlockingIOError:
+            pass
+        pump = io.Pump(io.Stream(source), to_stream)
+
+        pump.flush()
+        pump.flush()
+        pending = to_stream._pending
+        wants_read = pump.wants_read()
+        for a_socket in (source, source_peer, dest, dest_peer):
+            a_socket.close()
+
+        self.assertTrue(to_stream.full)
+        self.assertTrue(pending < 4096 + io.Pump.MIN_READ * 2)
+        self.assertFalse(wants_read)
+
+    def test_wants_read(self):
+        """``dockerpty.io`` Pump.wants_read is True while there's room in the 'to_stream'"""
+        fake_from_stream = MagicMock()
+        fake_from_stream.closed = False
+        fake_to_stream = MagicMock()
+        fake_to_stream.full = False
+        pump = io.Pump(fake_from_stream, fake_to_stream)
+
+        self.assertTrue(pump.wants_read())
+
+    def test_wants_read_eof(self):
+        """``dockerpty.io`` Pump.wants_read is False at EOF"""
+        fake_from_stream = MagicMock()
+        fake_from_stream.closed = False
+        fake_to_stream = MagicMock()
+        fake_to_stream.full = False
+        pump = io.Pump(fake_from_stream, fake_to_stream)
+        pump.eof = True
+
+        self.assertFalse(pump.wants_read())
+
+    def test_flush_n(self):
+        """``dockerpty.io`` Pump.flush only does one read if told how much to read"""
+        fake_from_stream = MagicMock()
+        fake_from_stream.read.return_value = b'some bytes'
+        fake_to_stream = MagicMock()
+        fake_to_stream.full = False
+        fake_to_stream.write = lambda x: len(x)
+        pump = io.Pump(fake_from_stream, fake_to_stream)
+
+        pump.flush(10)
+
+        self.assertEqual(fake_from_stream.read.call_count, 1)
+
+    def test_flush_grows(self):
+        """``dockerpty.io`` Pump.flush increases the read size while reads come back full"""
+        fake_from_stream = MagicMock()
+        fake_from_stream.read.side_effect = [b'a' * io.Pump.MIN_READ, BlockingIOError()]
+        fake_to_stream = MagicMock()
+        fake_to_stream.full = False
+        fake_to_stream.write = lambda x: len(x)
+        pump = io.Pump(fake_from_stream, fake_to_stream)
+
+        pump.flush()
+
+        self.assertEqual(pump.read_size, io.Pump.MIN_READ * 2)
+
+    def test_flush_max_read(self):
+        """``dockerpty.io`` Pump.flush doesn't grow the read size past MAX_READ"""
+        fake_from_stream = MagicMock()
+        fake_from_stream.read.side_effect = [b'a' * io.Pump.MAX_READ, BlockingIOError()]
+        fake_to_stream = MagicMock()
+        fake_to_stream.full = False
+        fake_to_stream.write = lambda x: len(x)
+        pump = io.Pump(fake_from_stream, fake_to_stream)
+        pump.read_size = io.Pump.MAX_READ
+
+        pump.flush()
+
+        self.assertEqual(pump.read_size, io.Pump.MAX_READ)
+
+    def test_flush_shrinks(self):
+        """``dockerpty.io`` Pump.flush decreases the read size for keystrokes"""
+        fake_from_stream = MagicMock()
+        fake_from_stream.read.side_effect = [b'a', BlockingIOError()]
+        fake_to_stream = MagicMock()
+        fake_to_stream.full = False
+        fake_to_stream.write = lambda x: len(x)
+        pump = io.Pump(fake_from_stream, fake_to_stream)
+        pump.read_size = io.Pump.MAX_READ
+
+        pump.flush()
+
+        self.assertEqual(pump.read_size, io.Pump.MAX_READ // 2)
+
+    def test_flush_read_sizes(self):
+        """``dockerpty.io`` Pump.flush counts the reads done at each size"""
+        fake_from_stream = MagicMock()
+        fake_from_stream.read.side_effect = [b'a' * io.Pump.MIN_READ, b'a', BlockingIOError()]
+        fake_to_stream = MagicMock()
+        fake_to_stream.full = False
+        fake_to_stream.write = lambda x: len(x)
+        pump = io.Pump(fake_from_stream, fake_to_stream)
+
+        pump.flush()
+        expected = {io.Pump.MIN_READ : 1, io.Pump.MIN_READ * 2 : 1}
+
+        self.assertEqual(pump.read_sizes, expected)
+
     def test_flush_eof(self):
         """``dockerpty.io`` Pump.flush returns None when the 'from_stream' reaches EOF"""
         fake_from_stream = MagicMock()
         fake_from_stream.read.return_value = b''
         fake_to_stream = MagicMock()
+        fake_to_stream.full = False
         pump = io.Pump(fake_from_stream, fake_to_stream)
 
         written = pump.flush()
@@ -510,6 +1070,7 @@ class TestPump(unittest.TestCase):
         fake_from_stream = MagicMock()
         fake_from_stream.read.side_effect = [error]
         fake_to_stream = MagicMock()
+        fake_to_stream.full = False
         pump = io.Pump(fake_from_stream, fake_to_stream)
 
         with self.assertRaises(OSError):
@@ -519,6 +1080,7 @@ class TestPump(unittest.TestCase):
         """``dockerpty.io`` Pump.is_done returns False if the to_stream.needs_write is True"""
         fake_from_stream = MagicMock()
         fake_to_stream = MagicMock()
+        fake_to_stream.full = False
         fake_to_stream.needs_write.return_value = True
         pump = io.Pump(fake_from_stream, fake_to_stream)
 
@@ -528,6 +1090,7 @@ class TestPump(unittest.TestCase):
         """``dockerpty.io`` Pump.is_done returns True if the to_stream.needs_write is False and the pump reaches EOF"""
         fake_from_stream = MagicMock()
         fake_to_stream = MagicMock()
+        fake_to_stream.full = False
         fake_to_stream.needs_write.return_value = False
         pump = io.Pump(fake_from_stream, fake_to_stream)
         pump.eof = True
@@ -547,5 +1110,178 @@ class TestPump(unittest.TestCase):
         self.assertEqual(the_repr, expected)
 
 
+@unittest.skipUnless(hasattr(os, 'splice'), 'os.splice requires Linux and Python 3.10+')
+class TestSplicePump(unittest.TestCase):
+    """A suite of test cases for the SplicePump object"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.source, self.source_peer = socket.socketpair()
+        self.dest, self.dest_peer = socket.socketpair()
+        self.source.setblocking(False)
+        self.dest.setblocking(False)
+        self.pump = io.SplicePump(io.Stream(self.source), io.Stream(self.dest))
+
+    def tearDown(self):
+        """Runs after every test case"""
+        for a_socket in (self.source, self.source_peer, self.dest, self.dest_peer):
+            a_socket.close()
+
+    def test_flush(self):
+        """``dockerpty.io`` SplicePump.flush moves the data, and returns how much"""
+        self.source_peer.sendall(b'some data')
+
+        flushed = self.pump.flush()
+        received = self.dest_peer.recv(1024)
+
+        self.assertEqual(flushed, 9)
+        self.assertEqual(received, b'some data')
+
+    def test_flush_eof(self):
+        """``dockerpty.io`` SplicePump.flush returns None at EOF, and closes the 'to_stream'"""
+        self.source_peer.close()
+
+        flushed = self.pump.flush()
+
+        self.assertTrue(flushed is None)
+        self.assertTrue(self.pump.eof)
+        self.assertTrue(self.pump.to_stream.closed)
+
+    def test_read_sizes(self):
+        """``dockerpty.io`` SplicePump.flush counts the splices done at each size"""
+        self.source_peer.sendall(b'some data')
+
+        self.pump.flush()
+
+        self.assertEqual(self.pump.read_sizes, {io.Pump.MIN_READ : 1})
+
+    def test_slow_writer(self):
+        """``dockerpty.io`` SplicePump keeps the data in order when the writer falls behind"""
+        payload = os.urandom(8 * 1024 * 1024)
+        def send():
+            self.source_peer.sendall(payload)
+            self.source_peer.shutdown(socket.SHUT_WR)
+        sender = threading.Thread(target=send)
+        sender.start()
+        self.dest_peer.setblocking(False)
+        received = []
+        fell_behind = False
+        with io.Selector() as selector:
+            selector.set_reading(self.pump)
+            while not self.pump.is_done():
+                read_ready, write_ready = selector.select(timeout=1)
+                if read_ready:
+                    self.pump.flush()
+                if write_ready:
+                    self.pump.to_stream.do_write()
+                selector.set_reading(self.pump, self.pump.wants_read())
+                if self.pump.to_stream.closed:
+                    selector.remove(self.pump.to_stream)
+                else:
+                    selector.set_writing(self.pump.to_stream, self.pump.to_stream.needs_write())
+                fell_behind = fell_behind or self.pump.to_stream.needs_write()
+                if fell_behind:
+                    try:
+                        chunk = self.dest_peer.recv(1024 * 1024)
+                        while chunk:
+                            received.append(chunk)
+                            chunk = self.dest_peer.recv(1024 * 1024)
+                    except BlockingIOError:
+                        pass
+        sender.join()
+        self.dest_peer.setblocking(True)
+        while True:
+            chunk = self.dest_peer.recv(1024 * 1024)
+            if not chunk:
+                break
+            received.append(chunk)
+
+        self.assertTrue(fell_behind)
+        self.assertEqual(b''.join(received), payload)
+
+    def test_pipe_full(self):
+        """``dockerpty.io`` SplicePump stops reading, instead of copying, once the pipe fills up"""
+        # Fill the writer's socket, so nothing comes out of the pipe.
+        try:
+            while True:
+                self.dest.send(b'a' * 64 * 1024)
+        except BlockingIOError:
+            pass
+        self.source_peer.sendall(b'a' * 64 * 1024)
+
+        for _ in range(64):
+            self.pump.flush()
+            if self.pump.to_stream.full:
+                break
+
+        self.assertTrue(self.pump.to_stream.pipe_full)
+        self.assertFalse(self.pump.to_stream.stream.needs_write())
+        self.assertFalse(self.pump.wants_read())
+
+    @patch.object(io.os, 'splice')
+    def test_cannot_splice(self, fake_splice):
+        """``dockerpty.io`` SplicePump copies the data if the kernel can't splice the reader"""
+        fake_splice.side_effect = OSError(errno.EINVAL, 'testing')
+        self.source_peer.sendall(b'some data')
+
+        flushed = self.pump.flush()
+        received = self.dest_peer.recv(1024)
+
+        self.assertEqual(flushed, 9)
+        self.assertEqual(received, b'some data')
+        self.assertFalse(self.pump.to_stream.spliceable)
+
+    def test_writes_queue_behind(self):
+        """``dockerpty.io`` PipedStream writes data behind what's still in the pipe"""
+        piped = self.pump.to_stream
+        read_fd, write_fd = os.pipe()
+        os.write(write_fd, b'first ')
+        os.close(write_fd)
+        with patch.object(piped, 'do_write'):
+            piped.splice_from(read_fd, 1024)
+        os.close(read_fd)
+
+        piped.write(b'second')
+        received = self.dest_peer.recv(1024)
+
+        self.assertEqual(received, b'first second')
+
+
+class TestMakePump(unittest.TestCase):
+    """A suite of test cases for the ``make_pump`` and ``can_splice`` functions"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.left, self.right = socket.socketpair()
+
+    def tearDown(self):
+        """Runs after every test case"""
+        self.left.close()
+        self.right.close()
+
+    @unittest.skipUnless(hasattr(os, 'splice'), 'os.splice requires Linux and Python 3.10+')
+    def test_splice(self):
+        """``dockerpty.io`` 'make_pump' returns a SplicePump when both ends can be spliced"""
+        pump = io.make_pump(io.Stream(self.left), io.Stream(self.right), splice=True)
+
+        self.assertTrue(isinstance(pump, io.SplicePump))
+
+    def test_no_splice(self):
+        """``dockerpty.io`` 'make_pump' returns a Pump unless told to splice"""
+        pump = io.make_pump(io.Stream(self.left), io.Stream(self.right))
+
+        self.assertFalse(isinstance(pump, io.SplicePump))
+
+    def test_demuxer(self):
+        """``dockerpty.io`` 'make_pump' returns a Pump for Demuxer streams"""
+        pump = io.make_pump(io.Demuxer(io.Stream(self.left)), io.Stream(self.right), splice=True)
+
+        self.assertFalse(isinstance(pump, io.SplicePump))
+
+    def test_tls(self):
+        """``dockerpty.io`` 'can_splice' is False for TLS sockets"""
+        fake_fd = MagicMock(spec=io.SSLSocket)
+
+        self.assertFalse(io.can_splice(io.Stream(fake_fd)))
+
+
 if __name__ == '__main__':
     unittest.main()
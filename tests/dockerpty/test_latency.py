@@ -0,0 +1,169 @@
+# -*- coding: UTF-8 -*-
+"""A suite of unit tests for the dockerpty.latency module"""
+import unittest
+from unittest.mock import patch, MagicMock
+
+from container_shell.lib.dockerpty import latency
+
+
+class TestHistogram(unittest.TestCase):
+    """A set of test cases for the Histogram object"""
+    def test_buckets(self):
+        """``dockerpty.latency`` Histogram buckets are contiguous, and each holds its lower bound"""
+        for index in range(latency.Histogram.BUCKETS):
+            lower = latency.Histogram.lower_bound(index)
+            upper = latency.Histogram.lower_bound(index + 1) - 1
+
+            self.assertEqual(latency.Histogram.bucket(lower), index)
+            self.assertEqual(latency.Histogram.bucket(upper), index)
+
+    def test_bucket_precision(self):
+        """``dockerpty.latency`` Histogram buckets are within 25% of the durations they hold"""
+        for micros in (5, 77, 1000, 123456, 98765432):
+            index = latency.Histogram.bucket(micros)
+            upper = latency.Histogram.lower_bound(index + 1) - 1
+
+            self.assertTrue(upper - micros <= micros * 0.25)
+
+    def test_record(self):
+        """``dockerpty.latency`` Histogram 'record' counts durations, and keeps the max"""
+        histogram = latency.Histogram()
+
+        for micros in (10, 20, 5000):
+            histogram.record(micros)
+
+        self.assertEqual(histogram.count, 3)
+        self.assertEqual(histogram.max, 5000)
+        self.assertEqual(sum(histogram.counts), 3)
+
+    def test_record_huge(self):
+        """``dockerpty.latency`` Histogram counts durations past the last bucket in the last bucket"""
+        histogram = latency.Histogram()
+
+        histogram.record(2 ** 50)
+
+        self.assertEqual(histogram.counts[-1], 1)
+        self.assertEqual(histogram.percentile(99), 2 ** 50)
+
+    def test_fixed_size(self):
+        """``dockerpty.latency`` Histogram doesn't grow as durations are recorded"""
+        histogram = latency.Histogram()
+        size = len(histogram.counts)
+
+        for micros in range(0, 10 ** 6, 997):
+            histogram.record(micros)
+
+        self.assertEqual(len(histogram.counts), size)
+
+    def test_percentile(self):
+        """``dockerpty.latency`` Histogram 'percentile' is close to the real percentile"""
+        histogram = latency.Histogram()
+        for micros in range(1, 1001):
+            histogram.record(micros)
+
+        p50 = histogram.percentile(50)
+        p99 = histogram.percentile(99)
+
+        self.assertTrue(500 <= p50 <= 500 * 1.25)
+        self.assertTrue(990 <= p99 <= 1000)
+
+    def test_percentile_empty(self):
+        """``dockerpty.latency`` Histogram 'percentile' is zero when nothing was recorded"""
+        histogram = latency.Histogram()
+
+        self.assertEqual(histogram.percentile(50), 0)
+
+    def test_summary(self):
+        """``dockerpty.latency`` Histogram 'summary' formats the percentiles in seconds"""
+        histogram = latency.Histogram()
+        histogram.record(1500)
+
+        summary = histogram.summary('echo')
+        expected = 'echo_count=1 echo_p50=0.001500 echo_p90=0.001500 echo_p99=0.001500 echo_max=0.001500'
+
+        self.assertEqual(summary, expected)
+
+
+class TestSessionLatency(unittest.TestCase):
+    """A set of test cases for the SessionLatency object"""
+    @patch.object(latency.time, 'monotonic')
+    def test_echo(self, fake_monotonic):
+        """``dockerpty.latency`` SessionLatency times from input sent, until output is delivered"""
+        fake_monotonic.side_effect = [1.0, 1.00025]
+        session = latency.SessionLatency()
+
+        session.sent(1)
+        session.delivered(1)
+
+        self.assertEqual(session.echo.count, 1)
+        self.assertEqual(session.echo.max, 250)
+
+    @patch.object(latency.time, 'monotonic')
+    def test_echo_first_input(self, fake_monotonic):
+        """``dockerpty.latency`` SessionLatency times from the first input still waiting on output"""
+        fake_monotonic.side_effect = [1.0, 1.0005]
+        session = latency.SessionLatency()
+
+        session.sent(1)
+        session.sent(1)
+        session.delivered(5)
+
+        self.assertEqual(session.echo.max, 500)
+        self.assertEqual(session.bytes_in, 2)
+        self.assertEqual(session.bytes_out, 5)
+
+    def test_output_only(self):
+        """``dockerpty.latency`` SessionLatency doesn't time output that wasn't preceded by input"""
+        session = latency.SessionLatency()
+
+        session.delivered(100)
+
+        self.assertEqual(session.echo.count, 0)
+        self.assertEqual(session.bytes_out, 100)
+
+    def test_nothing_moved(self):
+        """``dockerpty.latency`` SessionLatency ignores flushes that moved nothing"""
+        session = latency.SessionLatency()
+
+        session.sent(0)
+        session.delivered(1)
+
+        self.assertEqual(session.echo.count, 0)
+
+    def test_timed(self):
+        """``dockerpty.latency`` SessionLatency 'timed' records a call, and returns its result"""
+        session = latency.SessionLatency()
+
+        result = session.timed(session.info, lambda x: x * 2, 21)
+
+        self.assertEqual(result, 42)
+        self.assertEqual(session.info.count, 1)
+
+    def test_timed_error(self):
+        """``dockerpty.latency`` SessionLatency 'timed' records calls that raise"""
+        session = latency.SessionLatency()
+        fake_func = MagicMock(side_effect=IOError('testing'))
+
+        with self.assertRaises(IOError):
+            session.timed(session.resize, fake_func)
+
+        self.assertEqual(session.resize.count, 1)
+
+    def test_log(self):
+        """``dockerpty.latency`` SessionLatency 'log' writes one summary line"""
+        session = latency.SessionLatency()
+        session.sent(3)
+        session.delivered(7)
+        fake_logger = MagicMock()
+
+        session.log(fake_logger)
+        line = fake_logger.info.call_args[0][1]
+
+        self.assertEqual(fake_logger.info.call_count, 1)
+        self.assertTrue('echo_count=1' in line)
+        self.assertTrue('resize_p99=' in line)
+        self.assertTrue(line.endswith('bytes_in=3 bytes_out=7'))
+
+
+if __name__ == '__main__':
+    unittest.main()
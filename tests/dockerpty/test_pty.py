@@ -1,6 +1,9 @@
 # -*- coding: UTF-8 -*-
 """A suite of unit tests for the dockerpty.io.pty module"""
+import time
+import socket
 import unittest
+import threading
 from unittest.mock import patch, MagicMock
 
 from ssl import SSLError
@@ -172,6 +175,61 @@ class TestRunOperation(unittest.TestCase):
         self.assertTrue(fake_client.inspect_container.called)
         self.assertEqual(the_args, expected_args)
 
+    @patch.object(pty, 'EventWatcher')
+    def test_watch(self, fake_EventWatcher):
+        """``dockerpty.pty`` RunOperation 'watch' waits on Docker events for the container"""
+        run_operation = pty.RunOperation(MagicMock(), 'some-container')
+
+        watcher = run_operation.watch('some callback')
+
+        self.assertTrue(watcher is fake_EventWatcher.return_value)
+
+
+class TestEventWatcher(unittest.TestCase):
+    """A suite of test cases for the EventWatcher object"""
+    def test_die(self):
+        """``dockerpty.pty`` EventWatcher calls the callback when the container dies"""
+        fake_client = MagicMock()
+        fake_client.events.return_value.__iter__.return_value = iter([{'status' : 'die'}])
+        fake_callback = MagicMock()
+
+        watcher = pty.EventWatcher(fake_client, 'some-container', fake_callback)
+        watcher._thread.join(timeout=1)
+
+        self.assertTrue(fake_callback.called)
+
+    def test_filters(self):
+        """``dockerpty.pty`` EventWatcher only asks for 'die' events of the container"""
+        fake_client = MagicMock()
+
+        watcher = pty.EventWatcher(fake_client, 'some-container', MagicMock())
+        watcher._thread.join(timeout=1)
+        _, the_kwargs = fake_client.events.call_args
+        expected = {'container' : 'some-container', 'event' : 'die'}
+
+        self.assertEqual(the_kwargs['filters'], expected)
+
+    def test_close(self):
+        """``dockerpty.pty`` EventWatcher 'close' closes the event stream"""
+        fake_client = MagicMock()
+        watcher = pty.EventWatcher(fake_client, 'some-container', MagicMock())
+        watcher._thread.join(timeout=1)
+
+        watcher.close()
+
+        self.assertTrue(fake_client.events.return_value.close.called)
+
+    def test_error(self):
+        """``dockerpty.pty`` EventWatcher doesn't call the callback if the stream breaks"""
+        fake_client = MagicMock()
+        fake_client.events.side_effect = RuntimeError('testing')
+        fake_callback = MagicMock()
+
+        watcher = pty.EventWatcher(fake_client, 'some-container', fake_callback)
+        watcher._thread.join(timeout=1)
+
+        self.assertFalse(fake_callback.called)
+
 
 class TestPseudoTerminal(unittest.TestCase):
     """A suite of test cases for the PseudoTerminal object"""
@@ -207,6 +265,22 @@ class TestPseudoTerminal(unittest.TestCase):
 
         self.assertTrue(fake_hijack_tty.called)
 
+    @patch.object(pty.io, 'set_blocking')
+    @patch.object(pty.PseudoTerminal, '_hijack_tty')
+    @patch.object(pty, 'WINCHHandler')
+    def test_start_read_sizes(self, fake_WINCHHandler, fake_hijack_tty, fake_set_blocking):
+        """``dockerpty.pty`` PseudoTerminal 'start' logs the read sizes the pumps used"""
+        fake_client = MagicMock()
+        fake_exec_operation = MagicMock()
+        pump = pty.io.Pump(MagicMock(), MagicMock())
+        pump.read_sizes[4096] = 3
+        fake_exec_operation.start.return_value = [pump]
+
+        pty.PseudoTerminal(fake_client, fake_exec_operation).start()
+        the_args, _ = fake_exec_operation.logger.debug.call_args
+
+        self.assertEqual(the_args[-1], {4096 : 3})
+
     def test_resize(self):
         """``dockerpty.pty`` PseudoTerminal 'resize' adjusts the containers PTY"""
         fake_client = MagicMock()
@@ -236,11 +310,12 @@ class TestPseudoTerminal(unittest.TestCase):
 
         pty.PseudoTerminal(fake_client, fake_run_operation).resize(size=(300,400))
 
-    @patch.object(pty.io, 'select')
+    @patch.object(pty.io, 'Selector')
     @patch.object(pty.PseudoTerminal, '_get_stdin_pump')
     @patch.object(pty.tty, 'Terminal')
-    def test_hijack_tty(self, fake_Terminal, fake_get_stdin_pump, fake_select):
+    def test_hijack_tty(self, fake_Terminal, fake_get_stdin_pump, fake_Selector):
         """``dockerpty.pty`` PseudoTerminal '_hijack_tty' runs until all Pumps are done"""
+        fake_select = fake_Selector.return_value.__enter__.return_value.select
         fake_select.return_value = ([], [])
         fake_client = MagicMock()
         fake_run_operation = MagicMock()
@@ -253,11 +328,12 @@ class TestPseudoTerminal(unittest.TestCase):
         # It simply terminating is test enough ;)
 
     @patch.object(pty.sys.stdin, 'isatty')
-    @patch.object(pty.io, 'select')
+    @patch.object(pty.io, 'Selector')
     @patch.object(pty.PseudoTerminal, '_get_stdin_pump')
     @patch.object(pty.tty, 'Terminal')
-    def test_hijack_tty_not_tty(self, fake_Terminal, fake_get_stdin_pump, fake_select, fake_isatty):
+    def test_hijack_tty_not_tty(self, fake_Terminal, fake_get_stdin_pump, fake_Selector, fake_isatty):
         """``dockerpty.pty`` PseudoTerminal '_hijack_tty' terminates in non-TTY runtimes"""
+        fake_select = fake_Selector.return_value.__enter__.return_value.select
         fake_select.return_value = ([], [])
         fake_client = MagicMock()
         fake_run_operation = MagicMock()
@@ -270,11 +346,12 @@ class TestPseudoTerminal(unittest.TestCase):
 
         # It simply terminating is test enough ;)
 
-    @patch.object(pty.io, 'select')
+    @patch.object(pty.io, 'Selector')
     @patch.object(pty.PseudoTerminal, '_get_stdin_pump')
     @patch.object(pty.tty, 'Terminal')
-    def test_hijack_tty_ok_ssl_error(self, fake_Terminal, fake_get_stdin_pump, fake_select):
+    def test_hijack_tty_ok_ssl_error(self, fake_Terminal, fake_get_stdin_pump, fake_Selector):
         """``dockerpty.pty`` PseudoTerminal '_hijack_tty' can handle some SSL errors"""
+        fake_select = fake_Selector.return_value.__enter__.return_value.select
         fake_select.return_value = ([], [])
         fake_client = MagicMock()
         fake_run_operation = MagicMock()
@@ -288,11 +365,12 @@ class TestPseudoTerminal(unittest.TestCase):
         pty.PseudoTerminal(fake_client, fake_run_operation)._hijack_tty(fake_pumps)
 
 
-    @patch.object(pty.io, 'select')
+    @patch.object(pty.io, 'Selector')
     @patch.object(pty.PseudoTerminal, '_get_stdin_pump')
     @patch.object(pty.tty, 'Terminal')
-    def test_hijack_tty_bad_ssl_error(self, fake_Terminal, fake_get_stdin_pump, fake_select):
+    def test_hijack_tty_bad_ssl_error(self, fake_Terminal, fake_get_stdin_pump, fake_Selector):
         """``dockerpty.pty`` PseudoTerminal '_hijack_tty' raises if it catches an expected SSL error"""
+        fake_select = fake_Selector.return_value.__enter__.return_value.select
         fake_select.return_value = ([], [])
         fake_client = MagicMock()
         fake_run_operation = MagicMock()
@@ -306,6 +384,153 @@ class TestPseudoTerminal(unittest.TestCase):
         with self.assertRaises(SSLError):
             pty.PseudoTerminal(fake_client, fake_run_operation)._hijack_tty(fake_pumps)
 
+    @patch.object(pty.sys.stdin, 'isatty')
+    @patch.object(pty.PseudoTerminal, '_get_stdin_pump')
+    @patch.object(pty.tty, 'Terminal')
+    def test_hijack_tty_pumps(self, fake_Terminal, fake_get_stdin_pump, fake_isatty):
+        """``dockerpty.pty`` PseudoTerminal '_hijack_tty' moves data between real sockets"""
+        fake_isatty.return_value = True
+        source, source_peer = socket.socketpair()
+        dest, dest_peer = socket.socketpair()
+        pump = io.Pump(io.Stream(source), io.Stream(dest))
+        pump.set_blocking(False)
+        source_peer.sendall(b'some data')
+        source_peer.close()
+        fake_operation = MagicMock()
+        fake_operation.info.return_value = {'State' : {'Running' : True}}
+
+        pty.PseudoTerminal(MagicMock(), fake_operation)._hijack_tty([pump])
+        received = dest_peer.recv(1024)
+        source.close()
+        dest_peer.close()
+
+        self.assertEqual(received, b'some data')
+        self.assertTrue(pump.eof)
+        self.assertFalse(fake_operation.info.called)
+
+    @patch.object(pty.sys.stdin, 'isatty')
+    @patch.object(pty.PseudoTerminal, '_get_stdin_pump')
+    @patch.object(pty.tty, 'Terminal')
+    def test_hijack_tty_died(self, fake_Terminal, fake_get_stdin_pump, fake_isatty):
+        """``dockerpty.pty`` PseudoTerminal '_hijack_tty' stops when the operation reports it ended"""
+        fake_isatty.return_value = True
+        source, source_peer = socket.socketpair()
+        dest, dest_peer = socket.socketpair()
+        pump = io.Pump(io.Stream(source), io.Stream(dest))
+        pump.set_blocking(False)
+        fake_operation = MagicMock()
+        fake_watcher = MagicMock()
+        def fake_watch(callback):
+            callback()
+            return fake_watcher
+        fake_operation.watch.side_effect = fake_watch
+
+        pty.PseudoTerminal(MagicMock(), fake_operation)._hijack_tty([pump])
+        for a_socket in (source, source_peer, dest, dest_peer):
+            a_socket.close()
+
+        self.assertFalse(pump.eof)
+        self.assertTrue(fake_watcher.close.called)
+
+    @patch.object(pty.sys.stdin, 'isatty')
+    @patch.object(pty.PseudoTerminal, '_get_stdin_pump')
+    @patch.object(pty.tty, 'Terminal')
+    def test_hijack_tty_hangup(self, fake_Terminal, fake_get_stdin_pump, fake_isatty):
+        """``dockerpty.pty`` PseudoTerminal '_hijack_tty' stops once the hangup Notifier is notified"""
+        fake_isatty.return_value = True
+        source, source_peer = socket.socketpair()
+        dest, dest_peer = socket.socketpair()
+        pump = io.Pump(io.Stream(source), io.Stream(dest))
+        pump.set_blocking(False)
+        with io.Notifier() as hangup:
+            threading.Timer(0.05, hangup.notify).start()
+            pty.PseudoTerminal(MagicMock(), MagicMock(), hangup=hangup)._hijack_tty([pump])
+        for a_socket in (source, source_peer, dest, dest_peer):
+            a_socket.close()
+
+        self.assertFalse(pump.eof)
+
+    @patch.object(pty.sys.stdin, 'isatty')
+    @patch.object(pty.io, 'Selector')
+    @patch.object(pty.PseudoTerminal, '_get_stdin_pump')
+    @patch.object(pty.tty, 'Terminal')
+    def test_hijack_tty_not_running(self, fake_Terminal, fake_get_stdin_pump, fake_Selector, fake_isatty):
+        """``dockerpty.pty`` PseudoTerminal '_hijack_tty' stops once the state is stale, and it's not running"""
+        fake_isatty.return_value = True
+        fake_select = fake_Selector.return_value.__enter__.return_value.select
+        fake_pump = MagicMock()
+        fake_pump.is_done.return_value = False
+        fake_select.return_value = ([fake_pump], [])
+        fake_operation = MagicMock()
+        fake_operation.info.return_value = {'State' : {'Running' : False}}
+
+        pty.PseudoTerminal(MagicMock(), fake_operation, state_ttl=0)._hijack_tty([fake_pump])
+
+        self.assertTrue(fake_operation.info.called)
+
+    def test_record_latency(self):
+        """``dockerpty.pty`` PseudoTerminal only records latency when told to"""
+        quiet = pty.PseudoTerminal(MagicMock(), MagicMock())
+        recording = pty.PseudoTerminal(MagicMock(), MagicMock(), record_latency=True)
+
+        self.assertTrue(quiet.latency is None)
+        self.assertTrue(isinstance(recording.latency, pty.latency.SessionLatency))
+
+    def test_resize_latency(self):
+        """``dockerpty.pty`` PseudoTerminal 'resize' times the API call"""
+        pterminal = pty.PseudoTerminal(MagicMock(), MagicMock(), record_latency=True)
+
+        pterminal.resize(size=(24, 80))
+
+        self.assertEqual(pterminal.latency.resize.count, 1)
+
+    def test_is_running_latency(self):
+        """``dockerpty.pty`` PseudoTerminal '_is_running' times the API call"""
+        fake_operation = MagicMock()
+        fake_operation.info.return_value = {'State' : {'Running' : True}}
+        pterminal = pty.PseudoTerminal(MagicMock(), fake_operation, record_latency=True)
+        pterminal._checked -= 61
+
+        pterminal._is_running()
+
+        self.assertEqual(pterminal.latency.info.count, 1)
+
+    @patch.object(pty.io, 'set_blocking')
+    @patch.object(pty.PseudoTerminal, '_hijack_tty')
+    @patch.object(pty, 'WINCHHandler')
+    def test_start_logs_latency(self, fake_WINCHHandler, fake_hijack_tty, fake_set_blocking):
+        """``dockerpty.pty`` PseudoTerminal 'start' logs the latency summary"""
+        fake_operation = MagicMock()
+        fake_operation.start.return_value = []
+        pterminal = pty.PseudoTerminal(MagicMock(), fake_operation, record_latency=True)
+
+        pterminal.start()
+        messages = [call[0][0] for call in fake_operation.logger.info.call_args_list]
+
+        self.assertTrue('Session latency %s' in messages)
+
+    def test_is_running_cached(self):
+        """``dockerpty.pty`` PseudoTerminal '_is_running' doesn't inspect within the TTL"""
+        fake_operation = MagicMock()
+        fake_operation.info.return_value = {'State' : {'Running' : False}}
+        pterminal = pty.PseudoTerminal(MagicMock(), fake_operation, state_ttl=60)
+
+        running = pterminal._is_running()
+
+        self.assertTrue(running)
+        self.assertFalse(fake_operation.info.called)
+
+    def test_is_running_stale(self):
+        """``dockerpty.pty`` PseudoTerminal '_is_running' inspects once the TTL passes"""
+        fake_operation = MagicMock()
+        fake_operation.info.return_value = {'State' : {'Running' : False}}
+        pterminal = pty.PseudoTerminal(MagicMock(), fake_operation, state_ttl=60)
+        pterminal._checked -= 61
+
+        running = pterminal._is_running()
+
+        self.assertFalse(running)
+
     def test_get_stdin_pump(self):
         """``dockerpty.pty`` PseudoTerminal '_get_stdin_pump' returns the Pump object for stdin"""
         fake_pump = MagicMock()
@@ -326,5 +551,275 @@ class TestPseudoTerminal(unittest.TestCase):
             pty.PseudoTerminal._get_stdin_pump(fake_pumps)
 
 
+class _RecordingStream(io.Stream):
+    """A Stream that remembers the most data it ever had waiting to be written"""
+    peak = 0
+
+    def write(self, data):
+        written = super().write(data)
+        self.peak = max(self.peak, self._pending)
+        return written
+
+
+def _run_session(pty_cls, payload, slow=False):
+    """Send ``payload`` through a Pump in a session, and return what came out the other side"""
+    source, source_peer = socket.socketpair()
+    dest, dest_peer = socket.socketpair()
+    pump = io.Pump(io.Stream(source), _RecordingStream(dest, high_water=64 * 1024,
+                                                       low_water=16 * 1024))
+    pump.set_blocking(False)
+    dest.setblocking(False)
+    sender = threading.Thread(target=lambda: (source_peer.sendall(payload), source_peer.close()))
+    received = []
+    def receive():
+        data = dest_peer.recv(16384)
+        while data:
+            received.append(data)
+            if slow:
+                time.sleep(0.001)
+            data = dest_peer.recv(16384)
+    receiver = threading.Thread(target=receive)
+    fake_operation = MagicMock()
+    fake_operation.watch.return_value = None
+    fake_operation.israw.return_value = False
+    sender.start()
+    receiver.start()
+    pty_cls(MagicMock(), fake_operation)._hijack_tty([pump])
+    dest.close()
+    sender.join()
+    receiver.join()
+    source.close()
+    dest_peer.close()
+    return b''.join(received), pump, fake_operation
+
+
+def _echo_session(pty_cls, keystrokes):
+    """Type keystrokes into a session, where the container echoes them back; returns the PseudoTerminal"""
+    stdin, client_in = socket.socketpair()
+    stdout, client_out = socket.socketpair()
+    container, container_peer = socket.socketpair()
+    stdin_pump = io.Pump(io.Stream(stdin), io.Stream(container), propagate_close=False)
+    stdout_pump = io.Pump(io.Stream(container), io.Stream(stdout), wait_for_output=False)
+    for pump in (stdin_pump, stdout_pump):
+        pump.set_blocking(False)
+
+    def type_keys():
+        for _ in range(keystrokes):
+            client_in.sendall(b'x')
+            client_out.recv(1)
+        client_in.close()
+
+    def echo_keys():
+        key = container_peer.recv(1)
+        while key:
+            container_peer.sendall(key)
+            key = container_peer.recv(1)
+
+    threads = [threading.Thread(target=type_keys), threading.Thread(target=echo_keys)]
+    for thread in threads:
+        thread.start()
+    fake_operation = MagicMock()
+    fake_operation.watch.return_value = None
+    fake_operation.israw.return_value = False
+    pterminal = pty_cls(MagicMock(), fake_operation, record_latency=True)
+    with patch.object(pty_cls, '_get_stdin_pump', return_value=stdin_pump):
+        pterminal._hijack_tty([stdin_pump, stdout_pump])
+    container_peer.shutdown(socket.SHUT_RDWR)
+    for thread in threads:
+        thread.join()
+    for a_socket in (stdin, stdout, client_out, container, container_peer):
+        a_socket.close()
+    return pterminal
+
+
+class TestAsyncPseudoTerminal(unittest.TestCase):
+    """A set of test cases for the AsyncPseudoTerminal"""
+    @patch.object(pty.sys.stdin, 'isatty')
+    @patch.object(pty.PseudoTerminal, '_get_stdin_pump')
+    @patch.object(pty.tty, 'Terminal')
+    def test_parity(self, fake_Terminal, fake_get_stdin_pump, fake_isatty):
+        """``dockerpty.pty`` AsyncPseudoTerminal moves the same data as a PseudoTerminal"""
+        fake_isatty.return_value = True
+        payload = bytes(range(256)) * 8192
+
+        expected, sync_pump, _ = _run_session(pty.PseudoTerminal, payload)
+        received, async_pump, _ = _run_session(pty.AsyncPseudoTerminal, payload)
+
+        self.assertEqual(expected, payload)
+        self.assertEqual(received, expected)
+        self.assertEqual(async_pump.eof, sync_pump.eof)
+
+    @patch.object(pty.sys.stdin, 'isatty')
+    @patch.object(pty.tty, 'Terminal')
+    def test_not_tty(self, fake_Terminal, fake_isatty):
+        """``dockerpty.pty`` AsyncPseudoTerminal ends when stdin is done, if stdin isn't a TTY"""
+        fake_isatty.return_value = False
+
+        with patch.object(pty.AsyncPseudoTerminal, '_get_stdin_pump', side_effect=lambda pumps: pumps[0]):
+            received, pump, _ = _run_session(pty.AsyncPseudoTerminal, b'some data')
+
+        self.assertEqual(received, b'some data')
+        self.assertTrue(pump.is_done())
+
+    @patch.object(pty.sys.stdin, 'isatty')
+    @patch.object(pty.tty, 'Terminal')
+    def test_no_info(self, fake_Terminal, fake_isatty):
+        """``dockerpty.pty`` AsyncPseudoTerminal doesn't inspect the operation within the TTL"""
+        fake_isatty.return_value = True
+
+        with patch.object(pty.AsyncPseudoTerminal, '_get_stdin_pump'):
+            _, _, fake_operation = _run_session(pty.AsyncPseudoTerminal, b'some data')
+
+        self.assertFalse(fake_operation.info.called)
+
+    @patch.object(pty.sys.stdin, 'isatty')
+    @patch.object(pty.AsyncPseudoTerminal, '_get_stdin_pump')
+    @patch.object(pty.tty, 'Terminal')
+    def test_died(self, fake_Terminal, fake_get_stdin_pump, fake_isatty):
+        """``dockerpty.pty`` AsyncPseudoTerminal stops when the operation reports it ended"""
+        fake_isatty.return_value = True
+        source, source_peer = socket.socketpair()
+        dest, dest_peer = socket.socketpair()
+        pump = io.Pump(io.Stream(source), io.Stream(dest))
+        pump.set_blocking(False)
+        fake_operation = MagicMock()
+        fake_watcher = MagicMock()
+        def fake_watch(callback):
+            threading.Timer(0.05, callback).start()
+            return fake_watcher
+        fake_operation.watch.side_effect = fake_watch
+
+        pty.AsyncPseudoTerminal(MagicMock(), fake_operation)._hijack_tty([pump])
+        for a_socket in (source, source_peer, dest, dest_peer):
+            a_socket.close()
+
+        self.assertFalse(pump.eof)
+        self.assertTrue(fake_watcher.close.called)
+
+    @patch.object(pty.sys.stdin, 'isatty')
+    @patch.object(pty.AsyncPseudoTerminal, '_get_stdin_pump')
+    @patch.object(pty.tty, 'Terminal')
+    def test_hangup(self, fake_Terminal, fake_get_stdin_pump, fake_isatty):
+        """``dockerpty.pty`` AsyncPseudoTerminal stops once the hangup Notifier is notified"""
+        fake_isatty.return_value = True
+        source, source_peer = socket.socketpair()
+        dest, dest_peer = socket.socketpair()
+        pump = io.Pump(io.Stream(source), io.Stream(dest))
+        pump.set_blocking(False)
+        with io.Notifier() as hangup:
+            threading.Timer(0.05, hangup.notify).start()
+            pty.AsyncPseudoTerminal(MagicMock(), MagicMock(), hangup=hangup)._hijack_tty([pump])
+        for a_socket in (source, source_peer, dest, dest_peer):
+            a_socket.close()
+
+        self.assertFalse(pump.eof)
+
+    @patch.object(pty.sys.stdin, 'isatty')
+    @patch.object(pty.AsyncPseudoTerminal, '_get_stdin_pump')
+    @patch.object(pty.tty, 'Terminal')
+    def test_not_running(self, fake_Terminal, fake_get_stdin_pump, fake_isatty):
+        """``dockerpty.pty`` AsyncPseudoTerminal stops once the state is stale, and it's not running"""
+        fake_isatty.return_value = True
+        source, source_peer = socket.socketpair()
+        dest, dest_peer = socket.socketpair()
+        pump = io.Pump(io.Stream(source), io.Stream(dest))
+        pump.set_blocking(False)
+        source_peer.sendall(b'some data')
+        fake_operation = MagicMock()
+        fake_operation.watch.return_value = None
+        fake_operation.info.return_value = {'State' : {'Running' : False}}
+
+        pty.AsyncPseudoTerminal(MagicMock(), fake_operation, state_ttl=0)._hijack_tty([pump])
+        received = dest_peer.recv(1024)
+        for a_socket in (source, source_peer, dest, dest_peer):
+            a_socket.close()
+
+        self.assertEqual(received, b'some data')
+        self.assertTrue(fake_operation.info.called)
+
+    @patch.object(pty.sys.stdin, 'isatty')
+    @patch.object(pty.AsyncPseudoTerminal, '_get_stdin_pump')
+    @patch.object(pty.tty, 'Terminal')
+    def test_bad_ssl_error(self, fake_Terminal, fake_get_stdin_pump, fake_isatty):
+        """``dockerpty.pty`` AsyncPseudoTerminal raises unexpected SSLErrors"""
+        fake_isatty.return_value = True
+        source, source_peer = socket.socketpair()
+        dest, dest_peer = socket.socketpair()
+        pump = io.Pump(io.Stream(source), io.Stream(dest))
+        pump.set_blocking(False)
+        source_peer.sendall(b'some data')
+        fake_operation = MagicMock()
+        fake_operation.watch.return_value = None
+        error = SSLError()
+        error.strerror = 'some other error'
+
+        with patch.object(pump, 'flush', side_effect=error):
+            with self.assertRaises(SSLError):
+                pty.AsyncPseudoTerminal(MagicMock(), fake_operation)._hijack_tty([pump])
+        for a_socket in (source, source_peer, dest, dest_peer):
+            a_socket.close()
+
+    @patch.object(pty.sys.stdin, 'isatty')
+    @patch.object(pty.tty, 'Terminal')
+    def test_slow_api(self, fake_Terminal, fake_isatty):
+        """``dockerpty.pty`` AsyncPseudoTerminal moves data while waiting on the Docker API"""
+        fake_isatty.return_value = True
+        resized = threading.Event()
+        release = threading.Event()
+        callers = []
+        def fake_resize(**kwargs):
+            callers.append(threading.current_thread())
+            resized.set()
+            release.wait(5)
+
+        with patch.object(pty.AsyncPseudoTerminal, '_get_stdin_pump'), \
+             patch.object(pty.PseudoTerminal, 'resize', autospec=True) as fake_super_resize:
+            fake_super_resize.side_effect = lambda pterminal, size=None: fake_resize()
+            started = time.monotonic()
+            received, _, _ = _run_session(pty.AsyncPseudoTerminal, b'some data')
+            elapsed = time.monotonic() - started
+        release.set()
+
+        self.assertEqual(received, b'some data')
+        self.assertTrue(resized.is_set())
+        self.assertFalse(callers[0] is threading.main_thread())
+        self.assertTrue(elapsed < 5)
+
+    @patch.object(pty.sys.stdin, 'isatty')
+    @patch.object(pty.PseudoTerminal, '_get_stdin_pump')
+    @patch.object(pty.tty, 'Terminal')
+    def test_backpressure(self, fake_Terminal, fake_get_stdin_pump, fake_isatty):
+        """``dockerpty.pty`` Both engines stop reading while a slow reader catches up"""
+        fake_isatty.return_value = True
+        payload = bytes(range(256)) * 8192
+
+        for pty_cls in (pty.PseudoTerminal, pty.AsyncPseudoTerminal):
+            received, pump, _ = _run_session(pty_cls, payload, slow=True)
+
+            self.assertEqual(received, payload)
+            self.assertTrue(pump.to_stream.peak < 64 * 1024 + io.Pump.MAX_READ)
+
+    @patch.object(pty.sys.stdin, 'isatty')
+    @patch.object(pty.tty, 'Terminal')
+    def test_echo_latency(self, fake_Terminal, fake_isatty):
+        """``dockerpty.pty`` Both engines time keystrokes until they're echoed"""
+        fake_isatty.return_value = True
+        for pty_cls in (pty.PseudoTerminal, pty.AsyncPseudoTerminal):
+            pterminal = _echo_session(pty_cls, keystrokes=20)
+
+            self.assertEqual(pterminal.latency.echo.count, 20)
+            self.assertEqual(pterminal.latency.bytes_in, 20)
+            self.assertEqual(pterminal.latency.bytes_out, 20)
+
+    def test_resize_not_started(self):
+        """``dockerpty.pty`` AsyncPseudoTerminal 'resize' calls the API directly outside a session"""
+        fake_operation = MagicMock()
+        fake_operation.israw.return_value = True
+
+        pty.AsyncPseudoTerminal(MagicMock(), fake_operation).resize(size=(24, 80))
+
+        fake_operation.resize.assert_called_with(height=24, width=80)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,261 @@
+# -*- coding: UTF-8 -*-
+"""A suite of unit tests for the ``broker.py`` module"""
+import os
+import time
+import socket
+import tempfile
+import unittest
+import threading
+from unittest.mock import patch, MagicMock
+
+from container_shell.lib import broker
+from container_shell.lib.config import _default
+
+
+class TestMessages(unittest.TestCase):
+    """A suite of test cases for sending and receiving broker messages"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.left, self.right = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    def tearDown(self):
+        """Runs after every test case"""
+        self.left.close()
+        self.right.close()
+
+    def test_round_trip(self):
+        """``broker`` 'send_message' and 'recv_message' round trip a message"""
+        broker.send_message(self.left, {'op' : 'testing', 'value' : [1, 2]})
+
+        message, fds = broker.recv_message(self.right)
+
+        self.assertEqual(message, {'op' : 'testing', 'value' : [1, 2]})
+        self.assertEqual(fds, [])
+
+    def test_passes_fds(self):
+        """``broker`` 'send_message' passes file descriptors to the other process"""
+        read_fd, write_fd = os.pipe()
+        broker.send_message(self.left, {}, [write_fd])
+        os.close(write_fd)
+
+        _, fds = broker.recv_message(self.right)
+        os.write(fds[0], b'woot')
+        os.close(fds[0])
+        data = os.read(read_fd, 4)
+        os.close(read_fd)
+
+        self.assertEqual(data, b'woot')
+
+    def test_closed(self):
+        """``broker`` 'recv_message' returns None if the other side closes the connection"""
+        self.left.close()
+
+        message, _ = broker.recv_message(self.right)
+
+        self.assertTrue(message is None)
+
+
+class TestConfig(unittest.TestCase):
+    """A suite of test cases for (de)serializing the config"""
+    def test_round_trip(self):
+        """``broker`` 'config_from_dict' is the inverse of 'config_to_dict'"""
+        config = _default()
+        config['config']['command'] = 'some command'
+
+        output = broker.config_from_dict(broker.config_to_dict(config))
+
+        self.assertEqual(output, config)
+
+
+class TestBrokerClient(unittest.TestCase):
+    """A suite of test cases for the ``BrokerClient`` object"""
+    def test_unavailable(self):
+        """``broker`` BrokerClient raises BrokerUnavailable when the broker isn't running"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            client = broker.BrokerClient(os.path.join(tmp_dir, 'broker.sock'), timeout=1)
+
+            with self.assertRaises(broker.BrokerUnavailable):
+                client.exec_inspect('abc')
+
+    def test_api(self):
+        """``broker`` BrokerClient mimics the 'api' attribute of the Docker client"""
+        client = broker.BrokerClient('/some/socket', timeout=1)
+
+        self.assertTrue(client.api is client)
+
+    @patch.object(broker, 'recv_message')
+    @patch.object(broker, 'send_message')
+    @patch.object(broker.socket, 'socket')
+    def test_fallback(self, fake_socket, fake_send_message, fake_recv_message):
+        """``broker`` BrokerClient raises BrokerUnavailable when the broker can't handle a request"""
+        fake_recv_message.return_value = ({'error' : 'testing', 'fallback' : True}, [])
+        client = broker.BrokerClient('/some/socket', timeout=1)
+
+        with self.assertRaises(broker.BrokerUnavailable):
+            client.exec_inspect('abc')
+
+    @patch.object(broker, 'recv_message')
+    @patch.object(broker, 'send_message')
+    @patch.object(broker.socket, 'socket')
+    def test_error(self, fake_socket, fake_send_message, fake_recv_message):
+        """``broker`` BrokerClient raises BrokerError when the broker fails a request"""
+        fake_recv_message.return_value = ({'error' : 'testing'}, [])
+        client = broker.BrokerClient('/some/socket', timeout=1)
+
+        with self.assertRaises(broker.BrokerError):
+            client.exec_inspect('abc')
+
+
+class TestServe(unittest.TestCase):
+    """A suite of test cases for the ``serve`` function"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.config = _default()
+        self.config['broker']['socket'] = os.path.join(self.tmp_dir.name, 'broker.sock')
+        self.logger = MagicMock()
+
+    def tearDown(self):
+        """Runs after every test case"""
+        self.tmp_dir.cleanup()
+
+    @patch.object(broker.os, 'getuid')
+    def test_not_root(self, fake_getuid):
+        """``broker`` 'serve' refuses to run for anyone but root"""
+        fake_getuid.return_value = 9001
+
+        with self.assertRaises(broker.BrokerError):
+            broker.serve(self.config, self.logger)
+
+    @patch.object(broker, 'dockage')
+    @patch.object(broker.os, 'getuid')
+    def test_already_running(self, fake_getuid, fake_dockage):
+        """``broker`` 'serve' won't replace the socket of a broker that's still running"""
+        fake_getuid.return_value = 0
+        live = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        live.bind(self.config['broker']['socket'])
+        live.listen(1)
+        self.addCleanup(live.close)
+
+        with self.assertRaises(broker.BrokerError):
+            broker.serve(self.config, self.logger)
+
+        self.assertTrue(os.path.exists(self.config['broker']['socket']))
+        self.assertFalse(fake_dockage.local_client.called)
+
+    @patch.object(broker, '_Server')
+    @patch.object(broker, 'dockage')
+    @patch.object(broker.os, 'getuid')
+    def test_local_daemon(self, fake_getuid, fake_dockage, fake_server):
+        """``broker`` 'serve' replaces a stale socket, and ignores DOCKER_HOST"""
+        fake_getuid.return_value = 0
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(self.config['broker']['socket'])
+        stale.close()
+        # Stands in for the socket the server would have made.
+        fake_server.return_value.server_close.side_effect = lambda: open(
+            self.config['broker']['socket'], 'w').close()
+
+        broker.serve(self.config, self.logger)
+
+        fake_dockage.local_client.assert_called_with(self.config)
+
+
+class TestDispatch(unittest.TestCase):
+    """A suite of test cases for the ``dispatch`` function"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.docker_client = MagicMock()
+        self.docker_client.api.base_url = 'http+docker://localhost'
+        self.logger = MagicMock()
+        self.message = {'op' : 'login',
+                        'username' : 'sam',
+                        'uid' : 9001,
+                        'gid' : 9001,
+                        'tty' : True,
+                        'config' : broker.config_to_dict(_default())}
+
+    def test_unknown(self):
+        """``broker`` 'dispatch' raises BrokerError for unknown operations"""
+        with self.assertRaises(broker.BrokerError):
+            broker.dispatch({'op' : 'nope'}, 0, self.docker_client, self.logger)
+
+    def test_exec_inspect(self):
+        """``broker`` 'dispatch' proxies 'exec_inspect' to the daemon"""
+        self.docker_client.api.exec_inspect.return_value = {'Pid' : 42}
+
+        reply, _, _ = broker.dispatch({'op' : 'exec_inspect', 'exec_id' : 'abc'}, 0,
+                                      self.docker_client, self.logger)
+
+        self.assertEqual(reply, {'result' : {'Pid' : 42}})
+
+    @patch.object(broker, 'entry')
+    def test_teardown(self, fake_entry):
+        """``broker`` 'dispatch' tears down the container for 'teardown', within the reaper slots"""
+        message = {'op' : 'teardown', 'container_id' : 'abc', 'signal' : 'SIGHUP',
+                   'config' : broker.config_to_dict(_default())}
+
+        broker.dispatch(message, 0, self.docker_client, self.logger)
+        for thread in threading.enumerate():
+            if thread.name.startswith('teardown-'):
+                thread.join(5)
+
+        self.assertTrue(fake_entry._reap.called)
+
+    @patch.object(broker, 'entry')
+    def test_teardown_replies_first(self, fake_entry):
+        """``broker`` 'dispatch' replies to 'teardown' without waiting on the teardown"""
+        message = {'op' : 'teardown', 'container_id' : 'abc', 'signal' : 'SIGHUP',
+                   'config' : broker.config_to_dict(_default())}
+        released = threading.Event()
+        fake_entry._reap.side_effect = lambda *args, **kwargs: released.wait(5)
+
+        began = time.monotonic()
+        reply, _, _ = broker.dispatch(message, 0, self.docker_client, self.logger)
+        elapsed = time.monotonic() - began
+        released.set()
+
+        self.assertEqual(reply, {})
+        self.assertTrue(elapsed < 1)
+
+    @patch.object(broker, 'pool')
+    @patch.object(broker, 'entry')
+    def test_login(self, fake_entry, fake_pool):
+        """``broker`` 'dispatch' returns the exec socket for 'login'"""
+        fake_entry._get_container.return_value = (MagicMock(), False)
+        self.docker_client.api.exec_start.return_value.fileno.return_value = 42
+
+        _, fds, _ = broker.dispatch(self.message, 0, self.docker_client, self.logger)
+
+        self.assertEqual(fds, [42])
+
+    @patch.object(broker, 'pool')
+    @patch.object(broker, 'entry')
+    def test_login_peer_uid(self, fake_entry, fake_pool):
+        """``broker`` 'dispatch' ignores the requested user if the caller isn't root"""
+        fake_entry._get_container.return_value = (MagicMock(), False)
+
+        broker.dispatch(self.message, os.getuid() or 1, self.docker_client, self.logger)
+        the_args, _ = fake_entry._get_container.call_args
+
+        self.assertNotEqual(the_args[1], 'sam')
+
+    def test_login_standalone(self):
+        """``broker`` 'dispatch' leaves standalone containers to the login"""
+        config = _default()
+        config['config']['command'] = 'scp -t /tmp'
+        self.message['config'] = broker.config_to_dict(config)
+
+        with self.assertRaises(broker.BrokerUnavailable):
+            broker.dispatch(self.message, 0, self.docker_client, self.logger)
+
+    def test_login_tls(self):
+        """``broker`` 'dispatch' leaves TLS connections to the login"""
+        self.docker_client.api.base_url = 'https://some.host:2376'
+
+        with self.assertRaises(broker.BrokerUnavailable):
+            broker.dispatch(self.message, 0, self.docker_client, self.logger)
+
+
+if __name__ == '__main__':
+    unittest.main()
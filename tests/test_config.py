@@ -1,5 +1,9 @@
 # -*- coding: UTF-8 -*-
 """A suite of unit tests for the ``config.py`` module"""
+import os
+import time
+import marshal
+import tempfile
 import unittest
 from unittest.mock import patch, MagicMock
 
@@ -19,6 +23,8 @@ class TestDefault(unittest.TestCase):
         test_config.add_section('mounts')
         test_config.add_section('qos')
         test_config.add_section('binaries')
+        test_config.add_section('pool')
+        test_config.add_section('broker')
 
         test_config.set('config', 'image', 'debian:latest')
         test_config.set('config', 'hostname', 'someserver')
@@ -31,6 +37,16 @@ class TestDefault(unittest.TestCase):
         test_config.set('config', 'auto_remove', 'true')
         test_config.set('config', 'persist', '')
         test_config.set('config', 'persist_egrep', 'screen|tmux|coreutils')
+        test_config.set('config', 'state_dir', '/var/lib/container_shell')
+        test_config.set('config', 'refresh_ttl', '0')
+        test_config.set('config', 'background_refresh', 'false')
+        test_config.set('config', 'provision', 'useradd')
+        test_config.set('config', 'state_ttl', '60')
+        test_config.set('config', 'splice', 'false')
+        test_config.set('config', 'pty_engine', 'select')
+        test_config.set('config', 'log_latency', 'false')
+        test_config.set('config', 'reaper_slots', '4')
+        test_config.set('config', 'exec_grace', '60')
         test_config.set('logging', 'location', '/var/log/container_shell/messages.log')
         test_config.set('logging', 'max_size', '1024000') # 1MB
         test_config.set('logging', 'max_count', '3')
@@ -41,6 +57,8 @@ class TestDefault(unittest.TestCase):
         test_config.set('binaries', 'grep', '/usr/bin/grep')
         test_config.set('binaries', 'ps', '/usr/bin/ps')
         test_config.set('binaries', 'id', '/usr/bin/id')
+        test_config.set('pool', 'size', '0')
+        test_config.set('broker', 'socket', '')
 
         default_config = config._default()
 
@@ -94,5 +112,191 @@ class TestGetConfig(unittest.TestCase):
         self.assertEqual(actual, expected)
 
 
+class TestFingerprint(unittest.TestCase):
+    """A suite of test cases for the ``fingerprint`` function"""
+    def test_stable(self):
+        """``config`` The 'fingerprint' function returns the same hash for the same settings"""
+        self.assertEqual(config.fingerprint(config._default()),
+                         config.fingerprint(config._default()))
+
+    def test_ignores_command(self):
+        """``config`` The 'fingerprint' function ignores the per-login command override"""
+        the_config = config._default()
+        the_config['config']['command'] = 'some command'
+
+        self.assertEqual(config.fingerprint(the_config),
+                         config.fingerprint(config._default()))
+
+    def test_qos_changes(self):
+        """``config`` The 'fingerprint' function changes when the QoS settings change"""
+        the_config = config._default()
+        the_config['qos']['cpus'] = '2'
+
+        self.assertNotEqual(config.fingerprint(the_config),
+                            config.fingerprint(config._default()))
+
+
+class TestCompileConfig(unittest.TestCase):
+    """A suite of test cases for the compiled config"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.location = os.path.join(self.tmp_dir.name, 'config.ini')
+        self.compiled_location = os.path.join(self.tmp_dir.name, 'state', 'config.compiled')
+        self._write('[config]\nimage=some/image\n[mounts]\n/home=/home\n[qos]\ncpus=2\n')
+
+    def tearDown(self):
+        """Runs after every test case"""
+        self.tmp_dir.cleanup()
+
+    def _write(self, contents):
+        with open(self.location, 'w') as the_file:
+            the_file.write(contents)
+
+    def test_round_trip(self):
+        """``config`` 'get_config' uses the compiled config once it's compiled"""
+        errors = config.compile_config(self.location, self.compiled_location)
+        with patch.object(config.Config, 'read') as fake_read:
+            the_config, using_defaults, _ = config.get_config(location=self.location,
+                                                              compiled_location=self.compiled_location)
+
+        self.assertEqual(errors, [])
+        self.assertFalse(fake_read.called)
+        self.assertFalse(using_defaults)
+        self.assertEqual(the_config['config']['image'], 'some/image')
+
+    def test_derived(self):
+        """``config`` 'compile_config' saves the container template derived from the config"""
+        config.compile_config(self.location, self.compiled_location)
+        the_config, _, _ = config.get_config(location=self.location,
+                                             compiled_location=self.compiled_location)
+        template = the_config.compiled['template']
+
+        self.assertEqual(template['image'], 'some/image')
+        self.assertEqual(template['cpu_quota'], 200000)
+        self.assertEqual(template['mounts'][0]['Target'], '/home')
+
+    def test_command_override(self):
+        """``config`` 'get_config' still supports overriding the command with a compiled config"""
+        config.compile_config(self.location, self.compiled_location)
+        the_config, _, _ = config.get_config(shell_command='some command',
+                                             location=self.location,
+                                             compiled_location=self.compiled_location)
+
+        self.assertEqual(the_config['config']['command'], 'some command')
+
+    def test_new_defaults(self):
+        """``config`` 'get_config' fills in settings that didn't exist when the config was compiled"""
+        config.compile_config(self.location, self.compiled_location)
+        with open(self.compiled_location, 'rb') as the_file:
+            compiled = marshal.load(the_file)
+        del compiled['sections']['config']['provision']
+        with open(self.compiled_location, 'wb') as the_file:
+            marshal.dump(compiled, the_file)
+
+        the_config, _, _ = config.get_config(location=self.location,
+                                             compiled_location=self.compiled_location)
+
+        self.assertEqual(the_config['config']['provision'], 'useradd')
+        self.assertEqual(the_config.compiled, compiled['derived'])
+
+    def test_stale(self):
+        """``config`` 'get_config' ignores the compiled config once the INI file changes"""
+        config.compile_config(self.location, self.compiled_location)
+        self._write('[config]\nimage=other/image\n')
+        # In case the file system has coarse timestamps
+        later = time.time() + 10
+        os.utime(self.location, (later, later))
+
+        the_config, _, _ = config.get_config(location=self.location,
+                                             compiled_location=self.compiled_location)
+
+        self.assertEqual(the_config['config']['image'], 'other/image')
+        self.assertEqual(the_config.compiled, {})
+
+    def test_corrupt(self):
+        """``config`` 'load_compiled' returns None for an unreadable compiled config"""
+        os.makedirs(os.path.dirname(self.compiled_location))
+        with open(self.compiled_location, 'wb') as the_file:
+            the_file.write(b'garbage')
+
+        self.assertTrue(config.load_compiled(self.location, self.compiled_location) is None)
+
+    def test_invalid(self):
+        """``config`` 'compile_config' returns errors, and saves nothing, for an invalid config"""
+        self._write('[qos]\ncpus=lots\n')
+
+        errors = config.compile_config(self.location, self.compiled_location)
+
+        self.assertEqual(len(errors), 1)
+        self.assertFalse(os.path.exists(self.compiled_location))
+
+    def test_missing(self):
+        """``config`` 'compile_config' returns an error if the INI file doesn't exist"""
+        os.remove(self.location)
+
+        errors = config.compile_config(self.location, self.compiled_location)
+
+        self.assertEqual(len(errors), 1)
+
+
+class TestValidate(unittest.TestCase):
+    """A suite of test cases for the ``validate`` function"""
+    def test_defaults(self):
+        """``config`` The default config is valid"""
+        self.assertEqual(config.validate(config._default()), [])
+
+    def test_numbers(self):
+        """``config`` 'validate' catches values that should be numbers"""
+        the_config = config._default()
+        the_config['config']['docker_timeout'] = 'soon'
+        the_config['qos']['device_read_bps'] = '1.5'
+
+        self.assertEqual(len(config.validate(the_config)), 2)
+
+    def test_provision(self):
+        """``config`` 'validate' catches unknown provision modes"""
+        the_config = config._default()
+        the_config['config']['provision'] = 'magic'
+
+        self.assertEqual(len(config.validate(the_config)), 1)
+
+    def test_pty_engine(self):
+        """``config`` 'validate' catches unknown PTY engines"""
+        the_config = config._default()
+        the_config['config']['pty_engine'] = 'turbo'
+
+        self.assertEqual(len(config.validate(the_config)), 1)
+
+    def test_background_refresh(self):
+        """``config`` 'validate' catches 'background_refresh' without a 'refresh_ttl'"""
+        the_config = config._default()
+        the_config['config']['background_refresh'] = 'true'
+        the_config['config']['refresh_ttl'] = '0'
+
+        self.assertEqual(len(config.validate(the_config)), 1)
+
+    def test_log_level(self):
+        """``config`` 'validate' catches unknown log levels"""
+        the_config = config._default()
+        the_config['logging']['level'] = 'chatty'
+
+        self.assertEqual(len(config.validate(the_config)), 1)
+
+    def test_persist_egrep(self):
+        """``config`` 'validate' catches an invalid 'persist_egrep' pattern"""
+        the_config = config._default()
+        the_config['config']['persist_egrep'] = 'screen|('
+
+        self.assertEqual(len(config.validate(the_config)), 1)
+
+    def test_mounts(self):
+        """``config`` 'validate' catches relative mount paths"""
+        the_config = config._default()
+        the_config['mounts']['/home'] = 'home:ro'
+
+        self.assertEqual(len(config.validate(the_config)), 1)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,18 +1,31 @@
 # -*- coding: UTF-8 -*-
 """A suite of unit tests for the container_shell module"""
+import os
+import sys
+import signal
 import argparse
+import tempfile
 import unittest
+import threading
+import subprocess
 from unittest.mock import patch, MagicMock
 
 import docker
 import requests
 
 from container_shell import container_shell
+from container_shell.lib import dockage, utils
 from container_shell.lib.config import _default
 
 
 class TestContainerShellMain(unittest.TestCase):
     """A suite of test cases for the container_shell main function"""
+    def setUp(self):
+        """Runs before every test case"""
+        # Keeps the session locks out of the real state_dir
+        patcher = patch.object(container_shell, 'sweep')
+        self.fake_sweep = patcher.start()
+        self.addCleanup(patcher.stop)
 
     @patch.object(container_shell, '_block_on_init')
     @patch.object(container_shell.atexit, 'register')
@@ -150,14 +163,349 @@ class TestContainerShellMain(unittest.TestCase):
     def test_get_container_standalone(self, fake_printerr, fake_dockage, fake_docker, fake_dockerpty,
                                       fake_get_config, fake_exit, fake_get_logger, fake_register,
                                       fake_get_container):
-        """``container_shell`` Runs dockerpty.start for standalone containers"""
+        """``container_shell`` Connects directly to the PTY of standalone containers"""
         fake_get_config.return_value = (_default(), True, '')
         fake_get_container.return_value = MagicMock(), True
+        fake_dockerpty.pty.RunOperation.return_value.sockets.return_value = (MagicMock(),
+                                                                              MagicMock(),
+                                                                              MagicMock())
 
         container_shell.main(cli_args=[])
 
 
-        self.assertTrue(fake_dockerpty.start.called)
+        self.assertTrue(fake_dockerpty.pty.PseudoTerminal.return_value.start.called)
+
+    @patch.object(container_shell, 'print')
+    @patch.object(container_shell, 'compile_config')
+    @patch.object(container_shell, 'docker')
+    @patch.object(container_shell.utils, 'get_logger')
+    @patch.object(container_shell, 'get_config')
+    def test_compile_config(self, fake_get_config, fake_get_logger, fake_docker,
+                            fake_compile_config, fake_print):
+        """``container_shell`` '--compile-config' compiles the config, and doesn't log in"""
+        fake_get_config.return_value = (_default(), False, '/some/config.ini')
+        fake_compile_config.return_value = []
+
+        container_shell.main(cli_args=['--compile-config'])
+
+        fake_compile_config.assert_called_with('/some/config.ini')
+        self.assertFalse(fake_docker.from_env.called)
+
+    @patch.object(container_shell.sys, 'exit')
+    @patch.object(container_shell.utils, 'printerr')
+    @patch.object(container_shell, 'compile_config')
+    @patch.object(container_shell.utils, 'get_logger')
+    @patch.object(container_shell, 'get_config')
+    def test_compile_config_errors(self, fake_get_config, fake_get_logger, fake_compile_config,
+                                   fake_printerr, fake_exit):
+        """``container_shell`` '--compile-config' reports validation errors, and exits 1"""
+        fake_get_config.return_value = (_default(), False, '/some/config.ini')
+        fake_compile_config.return_value = ['some error']
+        fake_exit.side_effect = SystemExit
+
+        with self.assertRaises(SystemExit):
+            container_shell.main(cli_args=['--compile-config'])
+
+        fake_printerr.assert_called_with('some error')
+        fake_exit.assert_called_with(1)
+
+    @patch.object(container_shell.sys, 'exit')
+    @patch.object(container_shell.utils, 'printerr')
+    @patch.object(container_shell, 'broker')
+    @patch.object(container_shell.utils, 'get_logger')
+    @patch.object(container_shell, 'get_config')
+    def test_broker_refused(self, fake_get_config, fake_get_logger, fake_broker,
+                            fake_printerr, fake_exit):
+        """``container_shell`` '--broker' exits 1 if the broker can't be started"""
+        fake_get_config.return_value = (_default(), False, '/some/config.ini')
+        fake_broker.BrokerError = RuntimeError
+        fake_broker.serve.side_effect = RuntimeError('Only root may run the broker')
+
+        container_shell.main(cli_args=['--broker'])
+
+        fake_printerr.assert_called_with('Only root may run the broker')
+        fake_exit.assert_called_with(1)
+
+    @patch.object(container_shell, 'refresh')
+    @patch.object(container_shell, 'docker')
+    @patch.object(container_shell.utils, 'get_logger')
+    @patch.object(container_shell, 'get_config')
+    def test_refresh_image(self, fake_get_config, fake_get_logger, fake_docker, fake_refresh):
+        """``container_shell`` '--refresh-image' refreshes the image, and doesn't log in"""
+        fake_get_config.return_value = (_default(), False, '/some/config.ini')
+
+        container_shell.main(cli_args=['--refresh-image'])
+
+        self.assertTrue(fake_refresh.refresh_out_of_band.called)
+        self.assertFalse(fake_docker.from_env.called)
+
+    @patch.object(container_shell.os, 'getuid', return_value=0)
+    @patch.object(container_shell, 'dockage')
+    @patch.object(container_shell, 'docker')
+    @patch.object(container_shell.utils, 'get_logger')
+    @patch.object(container_shell, 'get_config')
+    def test_sweep(self, fake_get_config, fake_get_logger, fake_docker, fake_dockage,
+                   fake_getuid):
+        """``container_shell`` '--sweep' removes orphaned containers, and doesn't log in"""
+        fake_get_config.return_value = (_default(), False, '/some/config.ini')
+        self.fake_sweep.sweep.return_value = {'errors' : 0}
+
+        container_shell.main(cli_args=['--sweep', '--dry-run'])
+
+        the_args, the_kwargs = self.fake_sweep.sweep.call_args
+        self.assertTrue(the_kwargs['dry_run'])
+        self.assertEqual(the_kwargs['min_age'], self.fake_sweep.MIN_AGE)
+        self.assertTrue(the_args[0] is fake_dockage.local_client.return_value)
+        self.assertFalse(fake_docker.from_env.called)
+
+    @patch.object(container_shell.sys, 'exit')
+    @patch.object(container_shell.utils, 'printerr')
+    @patch.object(container_shell.os, 'getuid', return_value=1)
+    @patch.object(container_shell.utils, 'get_logger')
+    @patch.object(container_shell, 'get_config')
+    def test_sweep_not_root(self, fake_get_config, fake_get_logger, fake_getuid,
+                            fake_printerr, fake_exit):
+        """``container_shell`` '--sweep' is only for root"""
+        fake_get_config.return_value = (_default(), False, '/some/config.ini')
+        fake_exit.side_effect = SystemExit
+
+        with self.assertRaises(SystemExit):
+            container_shell.main(cli_args=['--sweep'])
+
+        fake_exit.assert_called_with(1)
+        self.assertFalse(self.fake_sweep.sweep.called)
+
+    @patch.object(container_shell.sys, 'exit')
+    @patch.object(container_shell.os, 'getuid', return_value=0)
+    @patch.object(container_shell, 'dockage')
+    @patch.object(container_shell.utils, 'get_logger')
+    @patch.object(container_shell, 'get_config')
+    def test_sweep_errors(self, fake_get_config, fake_get_logger, fake_dockage, fake_getuid,
+                          fake_exit):
+        """``container_shell`` '--sweep' exits 1 if any container couldn't be removed"""
+        fake_get_config.return_value = (_default(), False, '/some/config.ini')
+        self.fake_sweep.sweep.return_value = {'errors' : 2}
+
+        container_shell.main(cli_args=['--sweep', '--min-age', '0'])
+
+        _, the_kwargs = self.fake_sweep.sweep.call_args
+        self.assertEqual(the_kwargs['min_age'], 0)
+        fake_exit.assert_called_with(1)
+
+
+class TestWaitForRefresh(unittest.TestCase):
+    """A suite of test cases for the ``_wait_for_refresh`` function"""
+    def test_disabled(self):
+        """``container_shell`` '_wait_for_refresh' does nothing when the refresh is disabled"""
+        container_shell._wait_for_refresh(None, MagicMock())
+
+    @patch.object(container_shell.utils, 'printerr')
+    def test_failure(self, fake_printerr):
+        """``container_shell`` '_wait_for_refresh' exits if the refresh failed"""
+        refreshing = MagicMock()
+        refreshing.result.side_effect = docker.errors.DockerException('testing')
+
+        with self.assertRaises(SystemExit):
+            container_shell._wait_for_refresh(refreshing, MagicMock())
+
+        fake_printerr.assert_called_with('Unable to update login environment')
+
+
+class TestImageConfig(unittest.TestCase):
+    """A suite of test cases for the ``_image_config`` function"""
+    def test_create_user(self):
+        """``container_shell`` '_image_config' doesn't fetch the image when the user is recreated"""
+        container = MagicMock()
+
+        self.assertTrue(container_shell._image_config(container, _default()) is None)
+
+    def test_no_create_user(self):
+        """``container_shell`` '_image_config' fetches the image when the exec runs as the image's user"""
+        container = MagicMock()
+        config = _default()
+        config['config']['create_user'] = 'false'
+
+        self.assertTrue(container_shell._image_config(container, config) is container.image)
+
+
+class TestFirstOutput(unittest.TestCase):
+    """A suite of test cases for the ``_FirstOutput`` object"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.stream = MagicMock()
+        self.timer = utils.PhaseTimer()
+        self.logger = MagicMock()
+        self.first_output = container_shell._FirstOutput(self.stream, self.timer, self.logger)
+
+    def test_logs_once(self):
+        """``container_shell`` '_FirstOutput' logs the timings when the first byte arrives"""
+        self.stream.read.return_value = b'a'
+
+        self.first_output.read(1)
+        self.first_output.read(1)
+
+        self.assertTrue('first_byte' in self.timer.phases)
+        self.assertEqual(self.logger.info.call_count, 1)
+
+    def test_no_output(self):
+        """``container_shell`` '_FirstOutput' doesn't count an empty read as output"""
+        self.stream.read.return_value = b''
+
+        self.first_output.read(1)
+
+        self.assertFalse('first_byte' in self.timer.phases)
+
+    def test_passes_through(self):
+        """``container_shell`` '_FirstOutput' passes everything else to the wrapped stream"""
+        self.stream.fileno.return_value = 42
+
+        self.assertEqual(self.first_output.fileno(), 42)
+
+
+class TestPseudoTerminalHelper(unittest.TestCase):
+    """A suite of test cases for the ``_pseudo_terminal`` function"""
+    def test_select(self):
+        """``container_shell`` '_pseudo_terminal' uses the select() engine by default"""
+        the_config = _default()
+
+        pterminal = container_shell._pseudo_terminal(MagicMock(), MagicMock(), the_config)
+
+        self.assertTrue(type(pterminal) is container_shell.dockerpty.pty.PseudoTerminal)
+
+    def test_asyncio(self):
+        """``container_shell`` '_pseudo_terminal' uses the asyncio engine when configured to"""
+        the_config = _default()
+        the_config['config']['pty_engine'] = 'asyncio'
+        the_config['config']['state_ttl'] = '5'
+
+        pterminal = container_shell._pseudo_terminal(MagicMock(), MagicMock(), the_config)
+
+        self.assertTrue(isinstance(pterminal, container_shell.dockerpty.pty.AsyncPseudoTerminal))
+        self.assertEqual(pterminal.state_ttl, 5)
+
+    def test_log_latency(self):
+        """``container_shell`` '_pseudo_terminal' records latency when configured to"""
+        the_config = _default()
+        the_config['config']['log_latency'] = 'true'
+
+        pterminal = container_shell._pseudo_terminal(MagicMock(), MagicMock(), the_config)
+
+        self.assertFalse(pterminal.latency is None)
+
+
+class TestFirstOutputHelper(unittest.TestCase):
+    """A suite of test cases for the ``_first_output`` function"""
+    @patch.object(container_shell.dockerpty.io, 'can_splice')
+    def test_splice(self, fake_can_splice):
+        """``container_shell`` '_first_output' leaves streams that will be spliced alone"""
+        fake_can_splice.return_value = True
+        stream = MagicMock()
+
+        output = container_shell._first_output(stream, True, utils.PhaseTimer(), MagicMock())
+
+        self.assertTrue(output is stream)
+
+    @patch.object(container_shell.dockerpty.io, 'can_splice')
+    def test_no_splice(self, fake_can_splice):
+        """``container_shell`` '_first_output' times the first byte when not splicing"""
+        fake_can_splice.return_value = True
+
+        output = container_shell._first_output(MagicMock(), False, utils.PhaseTimer(), MagicMock())
+
+        self.assertTrue(isinstance(output, container_shell._FirstOutput))
+
+    @patch.object(container_shell.dockerpty.io, 'can_splice')
+    def test_cannot_splice(self, fake_can_splice):
+        """``container_shell`` '_first_output' times the first byte of streams that can't be spliced"""
+        fake_can_splice.return_value = False
+
+        output = container_shell._first_output(MagicMock(), True, utils.PhaseTimer(), MagicMock())
+
+        self.assertTrue(isinstance(output, container_shell._FirstOutput))
+
+
+class TestCompileInPassing(unittest.TestCase):
+    """A suite of test cases for the ``_compile_in_passing`` function"""
+    @patch.object(container_shell, 'compile_config')
+    def test_unwritable(self, fake_compile_config):
+        """``container_shell`` '_compile_in_passing' doesn't fail the login if it can't save"""
+        fake_compile_config.side_effect = PermissionError('testing')
+        logger = MagicMock()
+
+        container_shell._compile_in_passing('/some/config.ini', logger)
+
+        self.assertTrue(logger.debug.called)
+
+    @patch.object(container_shell, 'compile_config')
+    def test_invalid(self, fake_compile_config):
+        """``container_shell`` '_compile_in_passing' logs why an invalid config isn't compiled"""
+        fake_compile_config.return_value = ['some error']
+        logger = MagicMock()
+
+        container_shell._compile_in_passing('/some/config.ini', logger)
+
+        self.assertTrue(logger.warning.called)
+
+
+class TestBrokeredLogin(unittest.TestCase):
+    """A suite of test cases for the ``_brokered_login`` function"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.config = _default()
+        self.config['broker']['socket'] = '/some/broker.sock'
+        self.logger = MagicMock()
+        patcher = patch.object(container_shell, 'sweep')
+        self.fake_sweep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @patch.object(container_shell, 'broker')
+    def test_unavailable(self, fake_broker):
+        """``container_shell`` '_brokered_login' returns False when the broker is unavailable"""
+        fake_broker.BrokerUnavailable = RuntimeError
+        fake_broker.BrokerClient.return_value.login.side_effect = RuntimeError('testing')
+
+        output = container_shell._brokered_login('sam', 9001, 9001, self.config, self.logger)
+
+        self.assertFalse(output)
+
+    @patch.object(container_shell.sys, 'exit')
+    @patch.object(container_shell.utils, 'printerr')
+    @patch.object(container_shell, 'broker')
+    def test_error(self, fake_broker, fake_printerr, fake_exit):
+        """``container_shell`` '_brokered_login' exits if the broker fails to create the container"""
+        fake_broker.BrokerUnavailable = KeyError
+        fake_broker.BrokerError = RuntimeError
+        fake_broker.BrokerClient.return_value.login.side_effect = RuntimeError('testing')
+        fake_exit.side_effect = SystemExit
+
+        with self.assertRaises(SystemExit):
+            container_shell._brokered_login('sam', 9001, 9001, self.config, self.logger)
+
+        fake_exit.assert_called_with(1)
+
+    @patch.object(container_shell, 'set_signal_handlers')
+    @patch.object(container_shell.atexit, 'register')
+    @patch.object(container_shell, 'dockerpty')
+    @patch.object(container_shell, 'broker')
+    def test_connects(self, fake_broker, fake_dockerpty, fake_register, fake_set_signal_handlers):
+        """``container_shell`` '_brokered_login' connects the PTY to the socket from the broker"""
+        fake_broker.BrokerClient.return_value.login.return_value = ('abc', {'Id': '123'}, MagicMock())
+
+        output = container_shell._brokered_login('sam', 9001, 9001, self.config, self.logger)
+
+        self.assertTrue(output)
+        self.assertTrue(fake_dockerpty.pty.PseudoTerminal.return_value.start.called)
+        self.assertTrue(fake_register.called)
+
+
+class TestLazyImports(unittest.TestCase):
+    """A suite of test cases for the startup cost of ``container_shell``"""
+    def test_no_docker(self):
+        """``container_shell`` Importing the entry point doesn't import the Docker SDK"""
+        code = 'import sys; import container_shell.container_shell; print("docker" in sys.modules)'
+        output = subprocess.check_output([sys.executable, '-c', code])
+
+        self.assertEqual(output.strip(), b'False')
 
 
 class TestGetContainer(unittest.TestCase):
@@ -167,18 +515,19 @@ class TestGetContainer(unittest.TestCase):
         """Runs before every test case"""
         cls.config = _default()
         cls.docker_client = MagicMock()
+        cls.logger = MagicMock()
         cls.create_kwargs = {}
 
     def test_shared_env(self):
         """``container_shell`` '_get_container' locates and returns an existing container for shared environments"""
         existing_container = MagicMock()
         existing_container.name = 'pat'
-        containers = [MagicMock(), existing_container, MagicMock()]
-        self.docker_client.containers.list.return_value = containers
+        self.docker_client.containers.get.return_value = existing_container
 
         found, stanalone = container_shell._get_container(self.docker_client,
                                                   'pat',
                                                   self.config,
+                                                  self.logger,
                                                   **self.create_kwargs)
 
         self.assertTrue(found is existing_container)
@@ -187,8 +536,7 @@ class TestGetContainer(unittest.TestCase):
     @patch.object(container_shell, '_block_on_init')
     def test_creates(self, fake_block_on_init):
         """``container_shell`` '_get_container' makes a container for shared environment is none exist already"""
-        containers = [MagicMock(), MagicMock()]
-        self.docker_client.containers.list.return_value = containers
+        self.docker_client.containers.get.side_effect = docker.errors.NotFound('testing')
         new_container = MagicMock()
         new_container.status = 'created'
         self.docker_client.containers.create.return_value = new_container
@@ -196,12 +544,125 @@ class TestGetContainer(unittest.TestCase):
         found, _ = container_shell._get_container(self.docker_client,
                                                  'joe',
                                                  self.config,
+                                                 self.logger,
                                                  **self.create_kwargs)
 
         self.assertTrue(found is new_container)
         self.assertTrue(self.docker_client.containers.create.called)
         self.assertTrue(found.start.called)
 
+    @patch.object(container_shell, '_block_on_init')
+    def test_timer(self, fake_block_on_init):
+        """``container_shell`` '_get_container' times looking up, creating, and starting the container"""
+        self.docker_client.containers.get.side_effect = docker.errors.NotFound('testing')
+        self.docker_client.containers.create.return_value.status = 'created'
+        fake_block_on_init.return_value = 0.1
+        timer = utils.PhaseTimer()
+
+        container_shell._get_container(self.docker_client, 'joe', self.config, self.logger,
+                                       timer=timer)
+
+        self.assertEqual(sorted(timer.phases.keys()), ['create', 'init', 'lookup', 'start'])
+
+    def test_existing_skips_refresh(self):
+        """``container_shell`` '_get_container' doesn't wait on the image refresh for an existing container"""
+        existing_container = MagicMock()
+        existing_container.name = 'pat'
+        existing_container.status = 'running'
+        self.docker_client.containers.get.return_value = existing_container
+        refreshed = MagicMock()
+
+        container_shell._get_container(self.docker_client, 'pat', self.config, self.logger,
+                                       refreshed=refreshed)
+
+        self.assertFalse(refreshed.called)
+
+    @patch.object(container_shell, '_block_on_init')
+    def test_create_waits_on_refresh(self, fake_block_on_init):
+        """``container_shell`` '_get_container' waits on the image refresh before creating a container"""
+        self.docker_client.containers.get.side_effect = docker.errors.NotFound('testing')
+        order = []
+        refreshed = MagicMock(side_effect=lambda: order.append('refreshed'))
+        self.docker_client.containers.create.side_effect = lambda **kw: order.append('create') or MagicMock()
+
+        container_shell._get_container(self.docker_client, 'joe', self.config, self.logger,
+                                       refreshed=refreshed)
+
+        self.assertEqual(order, ['refreshed', 'create'])
+
+    @patch.object(container_shell, 'dockage')
+    @patch.object(container_shell, '_block_on_init')
+    def test_provision_mount(self, fake_block_on_init, fake_dockage):
+        """``container_shell`` '_get_container' doesn't wait on the user to be created for 'provision=mount'"""
+        fake_dockage.provision_mode.return_value = 'mount'
+        self.docker_client.containers.get.side_effect = docker.errors.NotFound('testing')
+        self.docker_client.containers.create.return_value.status = 'created'
+
+        container_shell._get_container(self.docker_client, 'joe', self.config, self.logger)
+
+        self.assertTrue(self.docker_client.containers.create.return_value.start.called)
+        self.assertFalse(fake_block_on_init.called)
+
+    def test_pooled(self):
+        """``container_shell`` '_get_container' claims a container from the warm pool before creating one"""
+        self.docker_client.containers.get.side_effect = docker.errors.NotFound('testing')
+        pooled_container = MagicMock()
+        pooled_container.status = 'running'
+
+        found, _ = container_shell._get_container(self.docker_client,
+                                                 'joe',
+                                                 self.config,
+                                                 self.logger,
+                                                 pooled=lambda: pooled_container,
+                                                 **self.create_kwargs)
+
+        self.assertTrue(found is pooled_container)
+        self.assertFalse(self.docker_client.containers.create.called)
+
+    @patch.object(container_shell, '_block_on_init')
+    def test_pool_miss(self, fake_block_on_init):
+        """``container_shell`` '_get_container' creates a container when the warm pool is empty"""
+        self.docker_client.containers.get.side_effect = docker.errors.NotFound('testing')
+
+        container_shell._get_container(self.docker_client,
+                                       'joe',
+                                       self.config,
+                                       self.logger,
+                                       pooled=lambda: None,
+                                       **self.create_kwargs)
+
+        self.assertTrue(self.docker_client.containers.create.called)
+
+    def test_find_container(self):
+        """``container_shell`` '_find_container' looks up the container by name"""
+        existing_container = MagicMock()
+        existing_container.name = 'pat'
+        self.docker_client.containers.get.return_value = existing_container
+
+        found = container_shell._find_container(self.docker_client, 'pat')
+
+        self.assertTrue(found is existing_container)
+        self.docker_client.containers.get.assert_called_with('pat')
+        self.assertFalse(self.docker_client.containers.list.called)
+
+    def test_find_container_id_prefix(self):
+        """``container_shell`` '_find_container' ignores containers whose ID merely starts with the username"""
+        other_container = MagicMock()
+        other_container.name = 'bob'
+        self.docker_client.containers.get.return_value = other_container
+
+        found = container_shell._find_container(self.docker_client, 'abc')
+
+        self.assertTrue(found is None)
+
+    def test_find_container_not_found(self):
+        """``container_shell`` '_find_container' returns None if the user has no container"""
+        self.docker_client.containers.get.side_effect = docker.errors.NotFound('testing')
+
+        found = container_shell._find_container(self.docker_client, 'pat')
+
+        self.assertTrue(found is None)
+
     def test_standalone(self):
         """``container_shell`` '_get_container' creates a new container for SCP commands"""
         # "-f" is a hidden flag, and how scp sends a file from a local machine to yours over SSH.
@@ -215,6 +676,7 @@ class TestGetContainer(unittest.TestCase):
         found, stanalone = container_shell._get_container(self.docker_client,
                                                  'joe',
                                                  self.config,
+                                                 self.logger,
                                                  **self.create_kwargs)
 
         self.assertTrue(found is new_container)
@@ -234,10 +696,28 @@ class TestGetContainer(unittest.TestCase):
         found, _ = container_shell._get_container(self.docker_client,
                                                  'joe',
                                                  self.config,
+                                                 self.logger,
                                                  **self.create_kwargs)
 
         self.assertFalse(found.start.called)
 
+    @patch.object(container_shell, '_block_on_init')
+    def test_creates_logs_wait(self, fake_block_on_init):
+        """``container_shell`` '_get_container' logs how long it waited for a new container to initialize"""
+        self.docker_client.containers.get.side_effect = docker.errors.NotFound('testing')
+        self.docker_client.containers.create.return_value.status = 'created'
+        fake_block_on_init.return_value = 0.25
+
+        container_shell._get_container(self.docker_client,
+                                       'joe',
+                                       self.config,
+                                       self.logger,
+                                       **self.create_kwargs)
+
+        the_args, _ = self.logger.info.call_args
+
+        self.assertEqual(the_args[1], 0.25)
+
     @patch.object(container_shell.time, 'sleep')
     def test_block_on_init(self, fake_sleep):
         """``container_shell`` '_block_on_init' waits until the user is created in the container"""
@@ -260,6 +740,41 @@ class TestGetContainer(unittest.TestCase):
         with self.assertRaises(RuntimeError):
             container_shell._block_on_init(fake_container, 'sally', '/usr/bin/id')
 
+    @patch.object(container_shell.time, 'sleep')
+    def test_block_on_init_backoff(self, fake_sleep):
+        """``container_shell`` '_block_on_init' backs off exponentially while polling"""
+        fake_container = MagicMock()
+        fake_container.attrs = {'Config': {'Cmd': ['/bin/bash']}}
+        fake_exec = MagicMock()
+        fake_exec.exit_code = 0
+        fake_container.exec_run.side_effect = [MagicMock(), MagicMock(), MagicMock(), fake_exec]
+
+        container_shell._block_on_init(fake_container, 'sally', '/usr/bin/id')
+        delays = [x[0][0] for x in fake_sleep.call_args_list]
+
+        self.assertEqual(delays, [0.05, 0.1, 0.2])
+
+    def test_block_on_init_marker(self):
+        """``container_shell`` '_block_on_init' waits for the ready marker instead of polling"""
+        fake_container = MagicMock()
+        fake_container.attrs = {'Config': {'Cmd': ['/bin/bash', '-c', 'echo {}'.format(dockage.READY_MARKER)]}}
+        fake_container.logs.return_value = iter([b'some output\r\n__container_sh', b'ell_ready__\r\n'])
+
+        container_shell._block_on_init(fake_container, 'sally', '/usr/bin/id')
+
+        self.assertFalse(fake_container.exec_run.called)
+
+    def test_block_on_init_marker_missing(self):
+        """``container_shell`` '_block_on_init' falls back to polling if the container stops without the marker"""
+        fake_container = MagicMock()
+        fake_container.attrs = {'Config': {'Cmd': ['/bin/bash', '-c', 'echo {}'.format(dockage.READY_MARKER)]}}
+        fake_container.logs.return_value = iter([b'some output'])
+        fake_container.exec_run.return_value.exit_code = 0
+
+        container_shell._block_on_init(fake_container, 'sally', '/usr/bin/id')
+
+        self.assertTrue(fake_container.exec_run.called)
+
 
 class TestShouldNotKill(unittest.TestCase):
     """A suite of test cases for the ``_should_not_kill`` function"""
@@ -267,8 +782,7 @@ class TestShouldNotKill(unittest.TestCase):
     def setUp(cls):
         """Runs before each test case"""
         cls.container = MagicMock()
-        cls.ps_output = b'some output'
-        cls.container.exec_run.return_value = ('', cls.ps_output)
+        cls.container.top.return_value = {'Processes' : [['sally', '1', '/bin/bash']]}
         cls.container.attrs = {'ExecIDs' : None}
         cls.logger = MagicMock()
         cls.persist = 'true'
@@ -306,8 +820,8 @@ class TestShouldNotKill(unittest.TestCase):
 
     def test_should_not_kill_background_jobs(self):
         """``container_shell`` '_should_not_kill' returns True if persist is true and background jobs are found"""
-        ps_output = b'USER         PID %CPU %MEM    VSZ   RSS TTY      STAT START   TIME COMMAND\nsally\t20\t0.0\t.0.0\t0\t0\t?\tS\tFed08\t0:00\t screen'
-        self.container.exec_run.return_value = ('', ps_output)
+        self.container.top.return_value = {'Processes' : [['sally', '1', '/bin/bash'],
+                                                          ['sally', '20', 'screen']]}
         answer = container_shell._should_not_kill(self.container,
                                                   self.persist,
                                                   self.persist_egrep,
@@ -318,8 +832,7 @@ class TestShouldNotKill(unittest.TestCase):
 
     def test_container_not_found(self):
         """``container_shell`` '_should_not_kill' returns None if the container doesn't exist"""
-        docker.errors.NotFound = Exception
-        self.container.exec_run.side_effect = Exception('Testing')
+        self.container.reload.side_effect = docker.errors.NotFound('Testing')
 
         answer = container_shell._should_not_kill(self.container,
                                                   self.persist,
@@ -329,6 +842,23 @@ class TestShouldNotKill(unittest.TestCase):
 
         self.assertTrue(answer is None)
 
+    def test_should_not_kill_no_exec(self):
+        """``container_shell`` '_should_not_kill' doesn't run anything inside the container"""
+        container_shell._should_not_kill(self.container,
+                                         self.persist,
+                                         self.persist_egrep,
+                                         self.ps_path,
+                                         self.logger)
+
+        self.assertFalse(self.container.exec_run.called)
+
+    def test_persist_regex(self):
+        """``container_shell`` '_persist_regex' compiles each setting once"""
+        first = container_shell._persist_regex('tmux|screen')
+        second = container_shell._persist_regex('tmux|screen')
+
+        self.assertTrue(first is second)
+
 
 class TestKillContainer(unittest.TestCase):
     """A suite of test cases for the ``kill_container`` function"""
@@ -462,6 +992,210 @@ class TestKillContainer(unittest.TestCase):
         self.assertTrue(self.logger.exception.called)
 
 
+class TestReapContainer(unittest.TestCase):
+    """A suite of test cases for the ``reap_container`` function"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.config = _default()
+        self.config['config']['state_dir'] = self.tmp_dir.name
+        self.container = MagicMock()
+        self.container.id = 'a' * 64
+        self.logger = MagicMock()
+
+    def tearDown(self):
+        """Runs after every test case"""
+        self.tmp_dir.cleanup()
+
+    @patch.object(container_shell.utils, 'detach')
+    def test_reap_container(self, fake_detach):
+        """``container_shell`` 'reap_container' tears down the container in a detached process"""
+        container_shell.reap_container(self.container, 'SIGHUP', self.config, self.logger)
+
+        the_args, _ = fake_detach.call_args
+        self.assertEqual(the_args[:3], (container_shell._reap, self.container.id, 'SIGHUP'))
+
+    @patch.object(container_shell, 'kill_container')
+    @patch.object(container_shell.utils, 'detach')
+    def test_reap_container_inline(self, fake_detach, fake_kill_container):
+        """``container_shell`` 'reap_container' tears down the container before returning when reaper_slots=0"""
+        self.config['config']['reaper_slots'] = '0'
+        container_shell.reap_container(self.container, 'SIGHUP', self.config, self.logger)
+
+        self.assertFalse(fake_detach.called)
+        self.assertTrue(fake_kill_container.called)
+
+    @patch.object(container_shell, 'kill_container')
+    @patch.object(container_shell, 'docker')
+    def test_reap(self, fake_docker, fake_kill_container):
+        """``container_shell`` '_reap' applies the persist rules to the container, and logs the teardown time"""
+        fake_kill_container.return_value = True
+        container_shell._reap(self.container.id, 'SIGHUP', self.config, self.logger)
+
+        the_args, _ = fake_kill_container.call_args
+        got_container = the_args[0]
+        expected = fake_docker.from_env.return_value.containers.get.return_value
+        message, _, removed, _, _ = self.logger.info.call_args[0]
+
+        self.assertTrue(got_container is expected)
+        self.assertTrue(message.startswith('Teardown'))
+        self.assertTrue(removed)
+
+    @patch.object(container_shell, 'kill_container')
+    @patch.object(container_shell, 'docker')
+    def test_reap_gone(self, fake_docker, fake_kill_container):
+        """``container_shell`` '_reap' is fine with the container already being removed"""
+        fake_docker.errors.NotFound = docker.errors.NotFound
+        fake_docker.from_env.return_value.containers.get.side_effect = docker.errors.NotFound('testing')
+        container_shell._reap(self.container.id, 'SIGHUP', self.config, self.logger)
+
+        self.assertFalse(fake_kill_container.called)
+        self.assertFalse(self.logger.exception.called)
+        self.assertTrue(self.logger.info.called)
+
+    @patch.object(container_shell, 'kill_container')
+    @patch.object(container_shell, 'docker')
+    def test_reap_error(self, fake_docker, fake_kill_container):
+        """``container_shell`` '_reap' logs unexpected errors"""
+        fake_docker.errors.NotFound = docker.errors.NotFound
+        fake_kill_container.side_effect = RuntimeError('testing')
+        container_shell._reap(self.container.id, 'SIGHUP', self.config, self.logger)
+
+        self.assertTrue(self.logger.exception.called)
+
+    def test_reaper_slot(self):
+        """``container_shell`` '_reaper_slot' takes a free slot without waiting"""
+        self.config['config']['reaper_slots'] = '2'
+        with container_shell._reaper_slot(self.config):
+            with container_shell._reaper_slot(self.config):
+                taken = sorted(os.listdir(self.tmp_dir.name))
+
+        self.assertEqual(taken, ['reaper-0.lock', 'reaper-1.lock'])
+
+    def test_reaper_slot_waits(self):
+        """``container_shell`` '_reaper_slot' waits for a slot when they're all taken"""
+        self.config['config']['reaper_slots'] = '1'
+        location = os.path.join(self.tmp_dir.name, 'reaper-0.lock')
+        entered = threading.Event()
+
+        def reap():
+            with container_shell._reaper_slot(self.config):
+                entered.set()
+
+        with utils.file_lock(location):
+            waiter = threading.Thread(target=reap, daemon=True)
+            waiter.start()
+            held = not entered.wait(0.2)
+        waiter.join(5)
+
+        self.assertTrue(held)
+        self.assertTrue(entered.is_set())
+
+    def test_kill_container_kept(self):
+        """``container_shell`` 'kill_container' returns False when the container is kept"""
+        self.container.attrs = {'ExecIDs' : ['some-exec']}
+        self.container.exec_run.return_value = ('', b'some output')
+        removed = container_shell.kill_container(self.container, 'SIGHUP', 'false',
+                                                 'tmux', '/bin/ps', self.logger)
+
+        self.assertFalse(removed)
+        self.assertFalse(self.container.remove.called)
+
+
+class TestTeardown(unittest.TestCase):
+    """A suite of test cases for the ``Teardown`` object"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.logger = MagicMock()
+        self.teardown = container_shell.Teardown(self.logger)
+
+    def tearDown(self):
+        """Runs after every test case"""
+        self.teardown.hangup.close()
+
+    def test_run(self):
+        """``container_shell`` 'Teardown' runs its steps once, no matter how many times it's ran"""
+        step = MagicMock()
+        self.teardown.add(step)
+
+        first = self.teardown.run()
+        second = self.teardown.run()
+
+        self.assertTrue(first)
+        self.assertFalse(second)
+        self.assertEqual(step.call_count, 1)
+        self.assertEqual(self.teardown.state, container_shell.Teardown.DONE)
+
+    def test_request(self):
+        """``container_shell`` 'Teardown' only records the signal in the signal handler"""
+        step = MagicMock()
+        self.teardown.add(step)
+
+        self.teardown.request(signal.SIGHUP, None)
+
+        self.assertFalse(step.called)
+        self.assertEqual(self.teardown.state, container_shell.Teardown.REQUESTED)
+        self.assertEqual(self.teardown.signal, 'SIGHUP')
+        self.assertTrue(self.teardown.hangup.clear())
+
+    def test_request_many(self):
+        """``container_shell`` 'Teardown' keeps the first signal it got"""
+        self.teardown.request(signal.SIGHUP, None)
+        self.teardown.request(signal.SIGTERM, None)
+        self.teardown.run()
+        self.teardown.request(signal.SIGINT, None)
+
+        self.assertEqual(self.teardown.signal, 'SIGHUP')
+        self.assertEqual(self.teardown.state, container_shell.Teardown.DONE)
+
+    def test_signalled_only(self):
+        """``container_shell`` 'Teardown' skips the signal-only steps if the session ended on its own"""
+        step = MagicMock()
+        self.teardown.add(step, signalled_only=True)
+
+        self.teardown.run()
+
+        self.assertFalse(step.called)
+
+    def test_signalled_first(self):
+        """``container_shell`` 'Teardown' runs the signal-only steps first after a signal"""
+        called = []
+        self.teardown.add(lambda: called.append('reap'))
+        self.teardown.add(lambda: called.append('kill_exec'), signalled_only=True)
+
+        self.teardown.request(signal.SIGHUP, None)
+        self.teardown.run()
+
+        self.assertEqual(called, ['kill_exec', 'reap'])
+
+    def test_step_error(self):
+        """``container_shell`` 'Teardown' logs a step that fails, and runs the rest"""
+        step = MagicMock()
+        self.teardown.add(MagicMock(side_effect=RuntimeError('testing')))
+        self.teardown.add(step)
+
+        self.teardown.run()
+
+        self.assertTrue(self.logger.exception.called)
+        self.assertTrue(step.called)
+
+    def test_set_signal_handlers(self):
+        """``container_shell`` 'set_signal_handlers' has every teardown signal request the teardown"""
+        originals = {name : signal.getsignal(getattr(signal, name))
+                     for name in container_shell.TEARDOWN_SIGNALS}
+        try:
+            container_shell.set_signal_handlers(self.teardown)
+            os.kill(os.getpid(), signal.SIGHUP)
+            handlers = [signal.getsignal(getattr(signal, name))
+                        for name in container_shell.TEARDOWN_SIGNALS]
+        finally:
+            for name, handler in originals.items():
+                signal.signal(getattr(signal, name), handler)
+
+        self.assertTrue(all(handler == self.teardown.request for handler in handlers))
+        self.assertEqual(self.teardown.state, container_shell.Teardown.REQUESTED)
+
+
 class TestParseCli(unittest.TestCase):
     """A suite of test cases for the ``parse_cli`` function"""
 
@@ -492,6 +1226,18 @@ class TestParseCli(unittest.TestCase):
 
         self.assertEqual(expected, actual)
 
+    def test_parse_cli_broker(self):
+        """``container_shell`` 'parse_cli' supports the '--broker' argument"""
+        args = container_shell.parse_cli(['--broker'])
+
+        self.assertTrue(args.broker)
+
+    def test_parse_cli_compile_config(self):
+        """``container_shell`` 'parse_cli' supports the '--compile-config' argument"""
+        args = container_shell.parse_cli(['--compile-config'])
+
+        self.assertTrue(args.compile_config)
+
 
 if __name__ == '__main__':
     unittest.main()
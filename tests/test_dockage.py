@@ -1,5 +1,7 @@
 # -*- coding: UTF-8 -*-
 """A suite of unit tests for the ``dockage.py`` module"""
+import os
+import tempfile
 import unittest
 from unittest.mock import patch, MagicMock
 
@@ -34,6 +36,162 @@ class TestBuildArgs(unittest.TestCase):
         self.assertTrue(fake_generate_name.called)
 
 
+class TestCreateTemplate(unittest.TestCase):
+    """A suite of unit tests for the ``create_template`` function"""
+    @patch.object(dockage, 'compile_template')
+    def test_compiled(self, fake_compile_template):
+        """``dockage`` 'create_template' uses the template from a compiled config"""
+        config = _default()
+        config.compiled = {'template' : {'image' : 'some/image'}}
+
+        template = dockage.create_template(config, MagicMock())
+
+        self.assertEqual(template, {'image' : 'some/image'})
+        self.assertFalse(fake_compile_template.called)
+
+    def test_copy(self):
+        """``dockage`` 'create_template' doesn't let callers change the compiled template"""
+        config = _default()
+        config.compiled = {'template' : {'image' : 'some/image'}}
+
+        dockage.create_template(config, MagicMock())['image'] = 'other/image'
+
+        self.assertEqual(config.compiled['template']['image'], 'some/image')
+
+    def test_not_compiled(self):
+        """``dockage`` 'create_template' derives the template when the config isn't compiled"""
+        template = dockage.create_template(_default(), MagicMock())
+
+        self.assertEqual(template['image'], 'debian:latest')
+
+    def test_builtin_types(self):
+        """``dockage`` 'compile_template' only returns types that ``marshal`` supports"""
+        config = _default()
+        config['mounts']['/home'] = '/home'
+
+        template = dockage.compile_template(config, MagicMock())
+
+        self.assertTrue(type(template['mounts'][0]) is dict)
+
+
+class TestProvisionMount(unittest.TestCase):
+    """A suite of test cases for recreating the user via mounted passwd and group files"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.config = _default()
+        self.config['config']['state_dir'] = self.tmp_dir.name
+        self.config['config']['provision'] = 'mount'
+
+    def tearDown(self):
+        """Runs after every test case"""
+        self.tmp_dir.cleanup()
+
+    def test_provision_mode(self):
+        """``dockage`` 'provision_mode' returns the configured mode"""
+        self.assertEqual(dockage.provision_mode(self.config), 'mount')
+        self.assertEqual(dockage.provision_mode(_default()), 'useradd')
+
+    def test_provision_mode_no_create(self):
+        """``dockage`` 'provision_mode' returns an empty string when 'create_user' is false"""
+        self.config['config']['create_user'] = 'false'
+
+        self.assertEqual(dockage.provision_mode(self.config), '')
+
+    def test_build_args(self):
+        """``dockage`` 'build_args' starts the container as the user for 'provision=mount'"""
+        args = dockage.build_args(self.config, 'sam', 9001, 9002, MagicMock())
+        targets = [x['Target'] for x in args['mounts']]
+
+        self.assertEqual(args['user'], '9001:9002')
+        self.assertEqual(args['command'], ['/bin/bash', '-l'])
+        self.assertTrue('/etc/passwd' in targets)
+        self.assertTrue('/etc/group' in targets)
+
+    def test_build_args_no_marker(self):
+        """``dockage`` 'build_args' doesn't echo the ready marker for 'provision=mount'"""
+        args = dockage.build_args(self.config, 'sam', 9001, 9002, MagicMock())
+
+        self.assertFalse(dockage.READY_MARKER in ' '.join(args['command']))
+
+    def test_build_args_tmpfs_home(self):
+        """``dockage`` 'build_args' gives the user a tmpfs home when it's not mounted"""
+        args = dockage.build_args(self.config, 'sam', 9001, 9002, MagicMock())
+
+        self.assertEqual(args['tmpfs'], {'/home/sam' : 'uid=9001,gid=9002,mode=0700'})
+
+    def test_build_args_mounted_home(self):
+        """``dockage`` 'build_args' uses the mounted home directory when one is configured"""
+        self.config['mounts']['/home'] = '/home'
+
+        args = dockage.build_args(self.config, 'sam', 9001, 9002, MagicMock())
+
+        self.assertFalse('tmpfs' in args)
+
+    def test_build_args_compiled(self):
+        """``dockage`` 'build_args' doesn't change the mounts of a compiled config"""
+        self.config.compiled = {'template' : {'mounts' : []}}
+
+        dockage.build_args(self.config, 'sam', 9001, 9002, MagicMock())
+
+        self.assertEqual(self.config.compiled['template']['mounts'], [])
+
+    def test_write_identity(self):
+        """``dockage`` 'write_identity' generates passwd and group entries for the user"""
+        passwd, group = dockage.write_identity(self.config, 'sam', 9001, 9002)
+        with open(passwd) as the_file:
+            passwd_lines = the_file.read().splitlines()
+        with open(group) as the_file:
+            group_lines = the_file.read().splitlines()
+
+        self.assertTrue('sam:x:9001:9002::/home/sam:/bin/bash' in passwd_lines)
+        self.assertTrue('sam:x:9002:' in group_lines)
+
+    def test_write_identity_unchanged(self):
+        """``dockage`` 'write_identity' doesn't rewrite files that haven't changed"""
+        passwd, _ = dockage.write_identity(self.config, 'sam', 9001, 9002)
+        before = os.stat(passwd).st_ino
+        dockage.write_identity(self.config, 'sam', 9001, 9002)
+
+        self.assertEqual(os.stat(passwd).st_ino, before)
+
+    def test_login_command(self):
+        """``dockage`` 'login_command' runs the override command via the login shell"""
+        self.assertEqual(dockage.login_command('top'), ['/bin/bash', '-c', 'top'])
+
+
+class TestLabels(unittest.TestCase):
+    """A suite of test cases for the ``labels`` function"""
+    def test_labels(self):
+        """``dockage`` 'labels' identifies the user, session kind, config, and creation time"""
+        output = dockage.labels(_default(), 'martin', 'shared')
+        expected = {dockage.LABEL_USER, dockage.LABEL_SESSION,
+                    dockage.LABEL_CONFIG, dockage.LABEL_CREATED}
+
+        self.assertEqual(set(output.keys()), expected)
+        self.assertEqual(output[dockage.LABEL_USER], 'martin')
+
+    def test_strings(self):
+        """``dockage`` 'labels' only uses strings, because that's all Docker accepts"""
+        output = dockage.labels(_default(), 'martin', 'shared')
+
+        self.assertTrue(all(isinstance(x, str) for x in output.values()))
+
+    def test_build_args(self):
+        """``dockage`` 'build_args' labels the container"""
+        the_args = dockage.build_args(_default(), 'martin', 9001, 9001, MagicMock())
+
+        self.assertEqual(the_args['labels'][dockage.LABEL_SESSION], 'shared')
+
+    def test_build_args_standalone(self):
+        """``dockage`` 'build_args' labels SCP containers as standalone"""
+        config = _default()
+        config['config']['command'] = 'scp -t /tmp'
+        the_args = dockage.build_args(config, 'martin', 9001, 9001, MagicMock())
+
+        self.assertEqual(the_args['labels'][dockage.LABEL_SESSION], 'standalone')
+
+
 class TestDns(unittest.TestCase):
     """A suite of test cases for the ``dns`` function"""
     def test_no_addrs(self):
@@ -188,6 +346,59 @@ class TestContainerCommand(unittest.TestCase):
         self.assertEqual(cmd, expected)
 
 
+    def test_ready_marker(self):
+        """``dockage`` 'container_command' echos the ready marker once the user exists"""
+        cmd = dockage.container_command(username='liz',
+                                        user_uid=9001,
+                                        user_gid=9001,
+                                        create_user='true',
+                                        command='',
+                                        runuser='/sbin/runuser',
+                                        useradd='/sbin/adduser',
+                                        ready_marker='READY')
+        expected = "/bin/bash -c '/usr/sbin/groupadd --gid 9001 liz && /sbin/adduser -m --uid 9001 --gid 9001 -s /bin/bash liz 2>/dev/null && chown liz:liz /dev/pts/0 2>/dev/null ; id -u liz >/dev/null 2>&1 && echo READY ; cd /home/liz 2>/dev/null ; /sbin/runuser liz -l '"
+
+        self.assertEqual(cmd, expected)
+
+    def test_build_args_ready_marker(self):
+        """``dockage`` 'build_args' includes the ready marker for shared containers"""
+        the_args = dockage.build_args(_default(), 'liz', 9001, 9001, MagicMock())
+
+        self.assertTrue(dockage.READY_MARKER in the_args['command'])
+
+    def test_build_args_no_ready_marker(self):
+        """``dockage`` 'build_args' never includes the ready marker for standalone containers"""
+        config = _default()
+        config['config']['command'] = 'scp -f /tmp/foo'
+        the_args = dockage.build_args(config, 'liz', 9001, 9001, MagicMock())
+
+        self.assertFalse(dockage.READY_MARKER in the_args['command'])
+
+
+class TestProvisionCommand(unittest.TestCase):
+    """A suite of test cases for the ``provision_command`` function"""
+    def test_provision_command(self):
+        """``dockage`` 'provision_command' creates the group and user in a single command"""
+        cmd = dockage.provision_command(username='liz',
+                                        user_uid=9001,
+                                        user_gid=9001,
+                                        create_user='true',
+                                        useradd='/sbin/adduser')
+        expected = "/bin/bash -c '/usr/sbin/groupadd --gid 9001 liz && /sbin/adduser -m --uid 9001 --gid 9001 -s /bin/bash liz 2>/dev/null'"
+
+        self.assertEqual(cmd, expected)
+
+    def test_provision_command_no_create(self):
+        """``dockage`` 'provision_command' returns an empty string when not creating a user"""
+        cmd = dockage.provision_command(username='liz',
+                                        user_uid=9001,
+                                        user_gid=9001,
+                                        create_user='false',
+                                        useradd='/sbin/adduser')
+
+        self.assertEqual(cmd, '')
+
+
 class TestGenerateName(unittest.TestCase):
     """A suite of test cases for the ``generate_name`` function"""
 
@@ -375,6 +586,16 @@ class TestExecCommand(unittest.TestCase):
 
         self.assertEqual(syntax, expected)
 
+    def test_exec_command_image(self):
+        """``dockage`` 'exec_command' uses an already fetched image instead of fetching it again"""
+        self.config['config']['create_user'] = 'false'
+        image = MagicMock()
+        image.attrs = {'Config' : {'User' : 'app'}}
+
+        syntax = dockage.exec_command(self.container, self.config, username='sally', image=image)
+
+        self.assertEqual(syntax, '/sbin/runuser -l app')
+
 
 class TestCreateExec(unittest.TestCase):
     """A suite of test cases for the ``create_exec`` function"""
@@ -398,6 +619,26 @@ class TestCreateExec(unittest.TestCase):
 
         self.assertEqual(exec_id, expected)
 
+    @patch.object(dockage.sys.stdin, 'isatty')
+    def test_create_exec_tty(self, fake_isatty):
+        """``dockage`` 'create_exec' supports overriding if the exec has a TTY"""
+        fake_isatty.return_value = True
+
+        dockage.create_exec(self.docker_client, self.container, self.config, 'bob', self.logger, tty=False)
+        _, the_kwargs = self.docker_client.api.exec_create.call_args
+
+        self.assertFalse(the_kwargs['tty'])
+
+    def test_create_exec_mount(self):
+        """``dockage`` 'create_exec' runs the exec as the user for 'provision=mount'"""
+        self.config['config']['provision'] = 'mount'
+
+        dockage.create_exec(self.docker_client, self.container, self.config, 'bob', self.logger, tty=True)
+        the_args, the_kwargs = self.docker_client.api.exec_create.call_args
+
+        self.assertEqual(the_kwargs['user'], 'bob')
+        self.assertEqual(the_args[1], ['/bin/bash', '-l'])
+
 
 class TestShouldCreateUser(unittest.TestCase):
     """A suite of test cases for the ``_should_create_user`` function"""
@@ -419,6 +660,93 @@ class TestShouldCreateUser(unittest.TestCase):
         self.assertTrue(all(results))
 
 
+class TestProcesses(unittest.TestCase):
+    """A suite of test cases for the ``processes`` function"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.proc_root = os.path.join(self.tmp_dir.name, 'proc')
+        self.cgroup_root = os.path.join(self.tmp_dir.name, 'cgroup')
+        self.container = MagicMock()
+        self.container.id = 'abc123'
+        self.container.attrs = {'State' : {'Pid' : 100}}
+        patchers = [patch.object(dockage, 'PROC_ROOT', self.proc_root),
+                    patch.object(dockage, 'CGROUP_ROOT', self.cgroup_root)]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        """Runs after every test case"""
+        self.tmp_dir.cleanup()
+
+    def _write(self, path, content):
+        """Create a file under the temporary directory"""
+        location = os.path.join(self.tmp_dir.name, path)
+        os.makedirs(os.path.dirname(location), exist_ok=True)
+        with open(location, 'wb') as the_file:
+            the_file.write(content)
+
+    def _process(self, pid, comm, cmdline):
+        """Create the /proc entries for a process"""
+        self._write('proc/{}/comm'.format(pid), comm + b'\n')
+        self._write('proc/{}/cmdline'.format(pid), cmdline)
+
+    def test_processes(self):
+        """``dockage`` 'processes' reads the command lines of the container's processes from the host"""
+        self._write('proc/100/cgroup', b'0::/system.slice/docker-abc123.scope\n')
+        self._write('cgroup/system.slice/docker-abc123.scope/cgroup.procs', b'100\n101\n102\n')
+        self._process(100, b'bash', b'/bin/bash\0')
+        self._process(101, b'tmux: server', b'tmux\0new\0')
+        # 102 exited before it was read
+
+        found = list(dockage.processes(self.container, '/bin/ps'))
+        expected = ['bash /bin/bash ', 'tmux: server tmux new ']
+
+        self.assertEqual(found, expected)
+        self.assertFalse(self.container.top.called)
+        self.assertFalse(self.container.exec_run.called)
+
+    def test_processes_cgroup_v1(self):
+        """``dockage`` 'processes' supports hosts using cgroup v1"""
+        self._write('proc/100/cgroup', b'5:cpu,cpuacct:/docker/abc123\n')
+        self._write('cgroup/cpuacct/docker/abc123/cgroup.procs', b'100\n')
+        self._process(100, b'bash', b'/bin/bash\0')
+
+        found = list(dockage.processes(self.container, '/bin/ps'))
+
+        self.assertEqual(found, ['bash /bin/bash '])
+
+    def test_processes_other_namespace(self):
+        """``dockage`` 'processes' uses the Docker top API if the PID belongs to some other process"""
+        self._write('proc/100/cgroup', b'0::/user.slice\n')
+        self._write('cgroup/user.slice/cgroup.procs', b'100\n')
+        self._process(100, b'bash', b'/bin/bash\0')
+        self.container.top.return_value = {'Processes' : [['root', '1', 'screen']]}
+
+        found = list(dockage.processes(self.container, '/bin/ps'))
+
+        self.assertEqual(found, ['root 1 screen'])
+
+    def test_processes_top(self):
+        """``dockage`` 'processes' uses the Docker top API if the cgroup can't be read"""
+        self.container.top.return_value = {'Processes' : [['root', '1', 'bash'], ['root', '2', 'tmux']]}
+
+        found = list(dockage.processes(self.container, '/bin/ps'))
+
+        self.assertEqual(found, ['root 1 bash', 'root 2 tmux'])
+
+    def test_processes_ps(self):
+        """``dockage`` 'processes' runs ps inside the container if the Docker top API fails"""
+        self.container.top.side_effect = docker.errors.APIError('testing')
+        self.container.exec_run.return_value = (0, b'USER PID COMMAND\nroot 1 screen\n')
+
+        found = list(dockage.processes(self.container, '/bin/ps'))
+
+        self.assertEqual(found, ['USER PID COMMAND', 'root 1 screen'])
+        self.container.exec_run.assert_called_with('/bin/ps auxwww')
+
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,251 @@
+# -*- coding: UTF-8 -*-
+"""A suite of unit tests for the ``pool.py`` module"""
+import os
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+from container_shell.lib import pool, utils
+from container_shell.lib.config import _default
+
+
+class TestPoolHash(unittest.TestCase):
+    """A suite of test cases for the ``pool_hash`` function"""
+    def test_image_changes(self):
+        """``pool`` 'pool_hash' changes when the image digest changes"""
+        docker_client = MagicMock()
+        docker_client.images.get.return_value.id = 'sha256:aaaa'
+        first = pool.pool_hash(docker_client, _default())
+        docker_client.images.get.return_value.id = 'sha256:bbbb'
+        second = pool.pool_hash(docker_client, _default())
+
+        self.assertNotEqual(first, second)
+
+    def test_config_changes(self):
+        """``pool`` 'pool_hash' changes when the config changes"""
+        docker_client = MagicMock()
+        docker_client.images.get.return_value.id = 'sha256:aaaa'
+        config = _default()
+        first = pool.pool_hash(docker_client, config)
+        config['mounts']['/home'] = '/home'
+        second = pool.pool_hash(docker_client, config)
+
+        self.assertNotEqual(first, second)
+
+
+def _idle():
+    """Make a fake idle container, where provisioning the user succeeds"""
+    idle = MagicMock()
+    idle.name = 'cspool-abc-123456'
+    idle.exec_run.return_value.exit_code = 0
+    return idle
+
+
+class TestClaim(unittest.TestCase):
+    """A suite of test cases for the ``claim`` function"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.config = _default()
+        self.config['config']['state_dir'] = self.tmp_dir.name
+        self.config['pool']['size'] = '2'
+        self.docker_client = MagicMock()
+        self.docker_client.images.get.return_value.id = 'sha256:aaaa'
+        self.logger = MagicMock()
+
+    def tearDown(self):
+        """Runs after every test case"""
+        self.tmp_dir.cleanup()
+
+    def test_disabled(self):
+        """``pool`` 'claim' returns None when the pool is disabled"""
+        self.config['pool']['size'] = '0'
+
+        container = pool.claim(self.docker_client, self.config, 'sam', 9001, 9001, self.logger)
+
+        self.assertTrue(container is None)
+        self.assertFalse(self.docker_client.containers.list.called)
+
+    def test_provision_mount(self):
+        """``pool`` 'claim' returns None when users are provisioned via mounts"""
+        self.config['config']['provision'] = 'mount'
+
+        container = pool.claim(self.docker_client, self.config, 'sam', 9001, 9001, self.logger)
+
+        self.assertTrue(container is None)
+        self.assertFalse(self.docker_client.containers.list.called)
+
+    def test_miss(self):
+        """``pool`` 'claim' returns None when no idle containers exist"""
+        self.docker_client.containers.list.return_value = []
+
+        container = pool.claim(self.docker_client, self.config, 'sam', 9001, 9001, self.logger)
+
+        self.assertTrue(container is None)
+
+    def test_hit(self):
+        """``pool`` 'claim' renames an idle container to the user"""
+        idle = _idle()
+        self.docker_client.containers.list.return_value = [idle]
+
+        container = pool.claim(self.docker_client, self.config, 'sam', 9001, 9001, self.logger)
+
+        self.assertTrue(container is idle)
+        idle.rename.assert_called_with('sam')
+
+    def test_hit_marks_claimed(self):
+        """``pool`` 'claim' records the claim before renaming, so ``--sweep`` leaves it be"""
+        idle = _idle()
+        idle.id = 'abc123'
+        self.docker_client.containers.list.return_value = [idle]
+
+        pool.claim(self.docker_client, self.config, 'sam', 9001, 9001, self.logger)
+
+        marker = os.path.join(self.tmp_dir.name, 'sessions', 'abc123.claimed')
+        self.assertTrue(os.path.exists(marker))
+
+    def test_hit_provisions(self):
+        """``pool`` 'claim' creates the user inside the claimed container"""
+        idle = _idle()
+        self.docker_client.containers.list.return_value = [idle]
+
+        pool.claim(self.docker_client, self.config, 'sam', 9001, 9001, self.logger)
+        the_args, _ = idle.exec_run.call_args
+
+        self.assertTrue('useradd' in the_args[0])
+
+    def test_hit_provision_fails(self):
+        """``pool`` 'claim' removes the container, and returns None, if the user can't be created"""
+        idle = _idle()
+        idle.exec_run.return_value.exit_code = 1
+        idle.exec_run.return_value.output = b'useradd: UID 9001 is not unique'
+        self.docker_client.containers.list.return_value = [idle]
+
+        container = pool.claim(self.docker_client, self.config, 'sam', 9001, 9001, self.logger)
+
+        self.assertTrue(container is None)
+        idle.remove.assert_called_with(force=True)
+        self.assertTrue(self.logger.error.called)
+
+    def test_hit_no_create_user(self):
+        """``pool`` 'claim' does not create a user when 'create_user' is false"""
+        self.config['config']['create_user'] = 'false'
+        idle = _idle()
+        self.docker_client.containers.list.return_value = [idle]
+
+        pool.claim(self.docker_client, self.config, 'sam', 9001, 9001, self.logger)
+
+        self.assertFalse(idle.exec_run.called)
+
+    def test_ignores_substring_names(self):
+        """``pool`` 'claim' ignores containers that only contain the pool prefix"""
+        not_idle = MagicMock()
+        not_idle.name = 'bob-cspool-abc'
+        self.docker_client.containers.list.return_value = [not_idle]
+
+        container = pool.claim(self.docker_client, self.config, 'sam', 9001, 9001, self.logger)
+
+        self.assertTrue(container is None)
+
+
+class TestRefill(unittest.TestCase):
+    """A suite of test cases for the ``refill`` function"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.config = _default()
+        self.config['config']['state_dir'] = self.tmp_dir.name
+        self.config['pool']['size'] = '2'
+        self.docker_client = MagicMock()
+        self.docker_client.images.get.return_value.id = 'sha256:aaaa'
+        self.digest = pool.pool_hash(self.docker_client, self.config)
+        self.logger = MagicMock()
+
+    def tearDown(self):
+        """Runs after every test case"""
+        self.tmp_dir.cleanup()
+
+    def test_fills(self):
+        """``pool`` 'refill' creates and starts containers until the pool is full"""
+        self.docker_client.containers.list.return_value = []
+
+        made = pool.refill(self.docker_client, self.config, self.logger)
+
+        self.assertEqual(made, 2)
+        self.assertEqual(self.docker_client.containers.create.call_count, 2)
+        self.assertTrue(self.docker_client.containers.create.return_value.start.called)
+
+    def test_counts_idle(self):
+        """``pool`` 'refill' only creates enough containers to fill the pool"""
+        idle = _idle()
+        idle.status = 'running'
+        idle.labels = {pool.POOL_LABEL : self.digest}
+        self.docker_client.containers.list.return_value = [idle]
+
+        made = pool.refill(self.docker_client, self.config, self.logger)
+
+        self.assertEqual(made, 1)
+
+    def test_discards_stale(self):
+        """``pool`` 'refill' removes idle containers built from an old config or image"""
+        stale = MagicMock()
+        stale.name = 'cspool-abc-123456'
+        stale.status = 'running'
+        stale.labels = {pool.POOL_LABEL : 'someOldHash'}
+        self.docker_client.containers.list.return_value = [stale]
+
+        made = pool.refill(self.docker_client, self.config, self.logger)
+
+        self.assertTrue(stale.remove.called)
+        self.assertEqual(made, 2)
+
+    def test_labels(self):
+        """``pool`` 'refill' labels the containers it creates with the pool hash"""
+        self.docker_client.containers.list.return_value = []
+
+        pool.refill(self.docker_client, self.config, self.logger)
+        _, the_kwargs = self.docker_client.containers.create.call_args
+
+        self.assertEqual(the_kwargs['labels'][pool.POOL_LABEL], self.digest)
+
+    def test_already_refilling(self):
+        """``pool`` 'refill' does nothing if another process is refilling the pool"""
+        self.docker_client.containers.list.return_value = []
+        with utils.file_lock(pool._lock_location(self.config, 'refill')):
+            made = pool.refill(self.docker_client, self.config, self.logger)
+
+        self.assertEqual(made, 0)
+        self.assertFalse(self.docker_client.containers.create.called)
+
+    def test_disabled(self):
+        """``pool`` 'refill' does nothing when the pool is disabled"""
+        self.config['pool']['size'] = '0'
+
+        made = pool.refill(self.docker_client, self.config, self.logger)
+
+        self.assertEqual(made, 0)
+
+
+class TestRefillInBackground(unittest.TestCase):
+    """A suite of test cases for the ``refill_in_background`` function"""
+    def test_disabled(self):
+        """``pool`` 'refill_in_background' doesn't start a thread when the pool is disabled"""
+        worker = pool.refill_in_background(MagicMock(), _default(), MagicMock())
+
+        self.assertTrue(worker is None)
+
+    @patch.object(pool, 'refill')
+    def test_logs_errors(self, fake_refill):
+        """``pool`` 'refill_in_background' logs errors instead of writing them to the terminal"""
+        fake_refill.side_effect = RuntimeError('testing')
+        config = _default()
+        config['pool']['size'] = '1'
+        logger = MagicMock()
+
+        pool.refill_in_background(MagicMock(), config, logger).join()
+
+        self.assertTrue(logger.exception.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
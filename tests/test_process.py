@@ -0,0 +1,134 @@
+# -*- coding: UTF-8 -*-
+"""A suite of unit tests for the ``process.py`` module"""
+import os
+import sys
+import time
+import signal
+import unittest
+import threading
+import subprocess
+from unittest.mock import patch, MagicMock
+
+from container_shell.lib import process
+
+
+class TestKillExec(unittest.TestCase):
+    """A suite of test cases for the ``kill_exec`` function"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.logger = MagicMock()
+        self.docker_client = MagicMock()
+
+    def _start(self, ignore_term=False):
+        """Start a process to kill, and reap it once it exits"""
+        script = 'import signal, time\n'
+        if ignore_term:
+            script += 'signal.signal(signal.SIGTERM, signal.SIG_IGN)\n'
+        script += 'print("ready", flush=True)\ntime.sleep(30)\n'
+        proc = subprocess.Popen([sys.executable, '-c', script], stdout=subprocess.PIPE)
+        proc.stdout.readline()
+        threading.Thread(target=proc.wait, daemon=True).start()
+        self.docker_client.api.exec_inspect.return_value = {'Pid' : proc.pid, 'Running' : True}
+        self.addCleanup(proc.stdout.close)
+        return proc
+
+    def test_kill_exec(self):
+        """``process`` 'kill_exec' returns as soon as the process exits"""
+        proc = self._start()
+        began = time.monotonic()
+        process.kill_exec(self.docker_client, {'Id' : 'abc'}, self.logger, 1, None)
+        elapsed = time.monotonic() - began
+
+        self.assertEqual(proc.wait(5), -15)
+        self.assertTrue(elapsed < 1)
+        self.assertTrue(self.logger.info.called)
+
+    @patch.object(process.utils, 'detach')
+    def test_kill_exec_escalates(self, fake_detach):
+        """``process`` 'kill_exec' sends SIGKILL once the grace period ends"""
+        fake_detach.side_effect = lambda func, *args: func(*args)
+        proc = self._start(ignore_term=True)
+        process.kill_exec(self.docker_client, {'Id' : 'abc'}, self.logger, grace=0.5)
+
+        self.assertEqual(proc.wait(5), -9)
+        self.assertTrue(self.logger.warning.called)
+
+    @patch.object(process.utils, 'detach')
+    def test_kill_exec_detaches(self, fake_detach):
+        """``process`` 'kill_exec' doesn't wait out the grace period itself"""
+        proc = self._start(ignore_term=True)
+        began = time.monotonic()
+        process.kill_exec(self.docker_client, {'Id' : 'abc'}, self.logger, grace=30)
+        elapsed = time.monotonic() - began
+        proc.kill()
+
+        self.assertTrue(elapsed < 1)
+        self.assertTrue(fake_detach.called)
+        self.assertEqual(fake_detach.call_args[0][0], process._escalate)
+
+    @patch.object(process, '_open_pid')
+    def test_kill_exec_gone(self, fake_open_pid):
+        """``process`` 'kill_exec' is fine with the process already being gone"""
+        fake_open_pid.side_effect = ProcessLookupError
+        self.docker_client.api.exec_inspect.return_value = {'Pid' : 9001, 'Running' : True}
+        process.kill_exec(self.docker_client, {'Id' : 'abc'}, self.logger)
+
+        self.assertTrue(self.logger.info.called)
+
+    @patch.object(process.signal, 'pidfd_send_signal', create=True)
+    @patch.object(process.os, 'kill')
+    def test_kill_exec_not_started(self, fake_kill, fake_pidfd_send_signal):
+        """``process`` 'kill_exec' signals nothing for an exec that never started"""
+        self.docker_client.api.exec_inspect.return_value = {'Pid' : 0, 'Running' : False}
+        process.kill_exec(self.docker_client, {'Id' : 'abc'}, self.logger)
+
+        self.assertFalse(fake_kill.called)
+        self.assertFalse(fake_pidfd_send_signal.called)
+
+    @patch.object(process.signal, 'pidfd_send_signal', create=True)
+    @patch.object(process.os, 'kill')
+    def test_kill_exec_exited(self, fake_kill, fake_pidfd_send_signal):
+        """``process`` 'kill_exec' signals nothing for an exec that already exited"""
+        self.docker_client.api.exec_inspect.return_value = {'Pid' : os.getpid(), 'Running' : False}
+        process.kill_exec(self.docker_client, {'Id' : 'abc'}, self.logger)
+
+        self.assertFalse(fake_kill.called)
+        self.assertFalse(fake_pidfd_send_signal.called)
+
+    @patch.object(process.signal, 'pidfd_send_signal', create=True)
+    def test_kill_exec_pidfd(self, fake_pidfd_send_signal):
+        """``process`` 'kill_exec' signals the process through a pidfd"""
+        proc = self._start()
+        fake_pidfd_send_signal.side_effect = lambda pid_fd, the_signal: proc.terminate()
+        process.kill_exec(self.docker_client, {'Id' : 'abc'}, self.logger)
+
+        self.assertEqual(proc.wait(5), -15)
+        self.assertEqual(fake_pidfd_send_signal.call_args[0][1], signal.SIGTERM)
+
+    @patch.object(process.os, 'pidfd_open', create=True)
+    def test_wait_for_pid_fallback(self, fake_pidfd_open):
+        """``process`` '_wait_for_pid' polls the process when pidfds aren't supported"""
+        fake_pidfd_open.side_effect = OSError('testing')
+        proc = self._start()
+        pid_fd = process._open_pid(proc.pid)
+        running = process._wait_for_pid(proc.pid, pid_fd, 0.05)
+        proc.terminate()
+        exited = process._wait_for_pid(proc.pid, pid_fd, 5)
+
+        self.assertTrue(pid_fd is None)
+        self.assertFalse(running)
+        self.assertTrue(exited)
+
+    def test_wait_for_pid_timeout(self):
+        """``process`` '_wait_for_pid' returns False if the process is still running"""
+        proc = self._start()
+        pid_fd = process._open_pid(proc.pid)
+        self.addCleanup(os.close, pid_fd)
+        running = process._wait_for_pid(proc.pid, pid_fd, 0.05)
+        proc.kill()
+
+        self.assertFalse(running)
+
+
+if __name__ == '__main__':
+    unittest.main()
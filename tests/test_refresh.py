@@ -0,0 +1,165 @@
+# -*- coding: UTF-8 -*-
+"""A suite of unit tests for the ``refresh.py`` module"""
+import time
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+import docker
+
+from container_shell.lib import refresh
+from container_shell.lib.config import _default
+
+
+class TestRefreshImage(unittest.TestCase):
+    """A suite of test cases for the ``refresh_image`` function"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.config = _default()
+        self.config['config']['state_dir'] = self.tmp_dir.name
+        self.config['config']['refresh_ttl'] = '300'
+        self.docker_client = MagicMock()
+        self.docker_client.images.pull.return_value.id = 'sha256:aaaa'
+        self.logger = MagicMock()
+
+    def tearDown(self):
+        """Runs after every test case"""
+        self.tmp_dir.cleanup()
+
+    def test_no_ttl(self):
+        """``refresh`` 'refresh_image' pulls on every call when the TTL is zero"""
+        self.config['config']['refresh_ttl'] = '0'
+
+        refresh.refresh_image(self.docker_client, self.config, self.logger)
+        refresh.refresh_image(self.docker_client, self.config, self.logger)
+
+        self.assertEqual(self.docker_client.images.pull.call_count, 2)
+
+    def test_pulls(self):
+        """``refresh`` 'refresh_image' pulls when there's no record of a previous pull"""
+        pulled = refresh.refresh_image(self.docker_client, self.config, self.logger)
+
+        self.assertTrue(pulled)
+        self.assertTrue(self.docker_client.images.pull.called)
+
+    def test_within_ttl(self):
+        """``refresh`` 'refresh_image' skips the pull within the TTL"""
+        refresh.refresh_image(self.docker_client, self.config, self.logger)
+        pulled = refresh.refresh_image(self.docker_client, self.config, self.logger)
+
+        self.assertFalse(pulled)
+        self.assertEqual(self.docker_client.images.pull.call_count, 1)
+
+    def test_records_digest(self):
+        """``refresh`` 'refresh_image' records the digest of the pulled image"""
+        refresh.refresh_image(self.docker_client, self.config, self.logger)
+        cache = refresh._read_cache(self.config)
+
+        self.assertEqual(cache['debian:latest']['digest'], 'sha256:aaaa')
+
+    @patch.object(refresh.time, 'time')
+    def test_expired(self, fake_time):
+        """``refresh`` 'refresh_image' pulls again once the TTL expires"""
+        fake_time.return_value = 1000
+        refresh.refresh_image(self.docker_client, self.config, self.logger)
+        fake_time.return_value = 9001
+        pulled = refresh.refresh_image(self.docker_client, self.config, self.logger)
+
+        self.assertTrue(pulled)
+        self.assertEqual(self.docker_client.images.pull.call_count, 2)
+
+    def test_not_local(self):
+        """``refresh`` 'refresh_image' pulls within the TTL if the image was removed from the host"""
+        refresh.refresh_image(self.docker_client, self.config, self.logger)
+        self.docker_client.images.get.side_effect = docker.errors.ImageNotFound('testing')
+        pulled = refresh.refresh_image(self.docker_client, self.config, self.logger)
+
+        self.assertTrue(pulled)
+
+    def test_failed_pull(self):
+        """``refresh`` 'refresh_image' doesn't record failed pulls"""
+        self.docker_client.images.pull.side_effect = docker.errors.APIError('testing')
+
+        with self.assertRaises(docker.errors.APIError):
+            refresh.refresh_image(self.docker_client, self.config, self.logger)
+
+        self.assertEqual(refresh._read_cache(self.config), {})
+
+
+class TestUpdateImage(unittest.TestCase):
+    """A suite of test cases for the ``update_image`` function"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.config = _default()
+        self.config['config']['state_dir'] = self.tmp_dir.name
+        self.config['config']['refresh_ttl'] = '300'
+        self.config['config']['background_refresh'] = 'true'
+        self.docker_client = MagicMock()
+        self.docker_client.images.pull.return_value.id = 'sha256:aaaa'
+        self.logger = MagicMock()
+
+    def tearDown(self):
+        """Runs after every test case"""
+        self.tmp_dir.cleanup()
+
+    @patch.object(refresh.subprocess, 'Popen')
+    def test_background(self, fake_popen):
+        """``refresh`` 'update_image' refreshes a stale, local image in another process"""
+        pulled = refresh.update_image(self.docker_client, self.config, self.logger)
+
+        self.assertFalse(pulled)
+        self.assertFalse(self.docker_client.images.pull.called)
+        self.assertTrue(fake_popen.called)
+
+    @patch.object(refresh.subprocess, 'Popen')
+    def test_background_process(self, fake_popen):
+        """``refresh`` 'update_image' starts a new process, in its own session, instead of forking"""
+        refresh.update_image(self.docker_client, self.config, self.logger)
+
+        the_args, the_kwargs = fake_popen.call_args
+        self.assertEqual(the_args[0][-1], '--refresh-image')
+        self.assertTrue(the_kwargs['start_new_session'])
+        self.assertTrue(the_kwargs['close_fds'])
+
+    @patch.object(refresh.subprocess, 'Popen')
+    def test_background_fresh(self, fake_popen):
+        """``refresh`` 'update_image' doesn't start a background refresh within the TTL"""
+        refresh._write_cache(self.config, 'debian:latest', 'sha256:aaaa')
+
+        refresh.update_image(self.docker_client, self.config, self.logger)
+
+        self.assertFalse(fake_popen.called)
+
+    @patch.object(refresh.subprocess, 'Popen')
+    def test_background_not_local(self, fake_popen):
+        """``refresh`` 'update_image' pulls in the foreground if the image isn't on the host"""
+        self.docker_client.images.get.side_effect = docker.errors.ImageNotFound('testing')
+
+        pulled = refresh.update_image(self.docker_client, self.config, self.logger)
+
+        self.assertTrue(pulled)
+        self.assertFalse(fake_popen.called)
+
+    @patch.object(refresh.subprocess, 'Popen')
+    def test_background_no_ttl(self, fake_popen):
+        """``refresh`` 'update_image' never detaches a pull per login when there's no TTL"""
+        self.config['config']['refresh_ttl'] = '0'
+
+        pulled = refresh.update_image(self.docker_client, self.config, self.logger)
+
+        self.assertTrue(pulled)
+        self.assertFalse(fake_popen.called)
+
+    def test_foreground(self):
+        """``refresh`` 'update_image' pulls in the foreground when background refresh is disabled"""
+        self.config['config']['background_refresh'] = 'false'
+
+        pulled = refresh.update_image(self.docker_client, self.config, self.logger)
+
+        self.assertTrue(pulled)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,252 @@
+# -*- coding: UTF-8 -*-
+"""A suite of unit tests for the ``sweep.py`` module"""
+import os
+import time
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+from container_shell.lib import sweep, dockage, pool
+from container_shell.lib.config import _default
+
+
+def _container(name, age=3600):
+    """Make a fake container, created ``age`` seconds ago"""
+    container = MagicMock()
+    container.name = name
+    container.id = '{}-id'.format(name)
+    container.short_id = name[:10]
+    container.status = 'running'
+    container.labels = {dockage.LABEL_CREATED : str(int(time.time() - age))}
+    return container
+
+
+class TestSweep(unittest.TestCase):
+    """A suite of test cases for the ``sweep`` function"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.config = _default()
+        self.config['config']['state_dir'] = self.tmp_dir.name
+        self.logger = MagicMock()
+        self.docker_client = MagicMock()
+        patchers = [patch.object(sweep, 'print', create=True),
+                    patch.object(sweep.entry, '_reap'),
+                    patch.object(sweep.entry, '_should_not_kill')]
+        self.fake_print, self.fake_reap, self.fake_should_not_kill = [p.start() for p in patchers]
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+        self.fake_reap.return_value = True
+        self.fake_should_not_kill.return_value = False
+
+    def tearDown(self):
+        """Runs after every test case"""
+        sweep._SESSIONS.close()
+        self.tmp_dir.cleanup()
+
+    def _listed(self, *containers):
+        """Have the Docker daemon report these containers"""
+        self.docker_client.containers.list.return_value = list(containers)
+
+    def test_sweep(self):
+        """``sweep`` 'sweep' removes containers that no session is using"""
+        orphan = _container('sally')
+        self._listed(orphan)
+
+        stats = sweep.sweep(self.docker_client, self.config, self.logger)
+
+        the_args, the_kwargs = self.fake_reap.call_args
+        self.assertEqual(the_args[0], orphan.id)
+        self.assertTrue(the_kwargs['container'] is orphan)
+        self.assertEqual(stats['removed'], 1)
+
+    def test_sweep_live(self):
+        """``sweep`` 'sweep' keeps containers that a session holds the lock for"""
+        self._listed(_container('sally'))
+        sweep.hold_session(self.config, 'sally-id', self.logger)
+
+        stats = sweep.sweep(self.docker_client, self.config, self.logger)
+
+        self.assertFalse(self.fake_reap.called)
+        self.assertEqual(stats['live'], 1)
+
+    def test_sweep_young(self):
+        """``sweep`` 'sweep' ignores containers a login might still be setting up"""
+        self._listed(_container('sally', age=10))
+
+        stats = sweep.sweep(self.docker_client, self.config, self.logger, min_age=60)
+
+        self.assertFalse(self.fake_reap.called)
+        self.assertEqual(stats['young'], 1)
+
+    def test_sweep_claimed(self):
+        """``sweep`` 'sweep' ignores an old pooled container that a login just claimed"""
+        claimed = _container('sally')
+        claimed.labels[dockage.LABEL_SESSION] = 'pool'
+        self._listed(claimed)
+        sweep.mark_claimed(self.config, claimed.id, self.logger)
+
+        stats = sweep.sweep(self.docker_client, self.config, self.logger, min_age=60)
+
+        self.assertFalse(self.fake_reap.called)
+        self.assertEqual(stats['young'], 1)
+
+    def test_sweep_all(self):
+        """``sweep`` 'sweep' looks at containers in every state, not just running ones"""
+        self._listed()
+
+        sweep.sweep(self.docker_client, self.config, self.logger)
+
+        _, the_kwargs = self.docker_client.containers.list.call_args_list[0]
+        self.assertTrue(the_kwargs['all'])
+        self.assertNotIn('status', the_kwargs['filters'])
+
+    def test_sweep_exited(self):
+        """``sweep`` 'sweep' removes containers that exited, without checking the persist rules"""
+        exited = _container('sally')
+        exited.status = 'exited'
+        self._listed(exited)
+
+        stats = sweep.sweep(self.docker_client, self.config, self.logger)
+
+        exited.remove.assert_called_with(force=True)
+        self.assertFalse(self.fake_reap.called)
+        self.assertEqual(stats['removed'], 1)
+
+    def test_sweep_created_dry_run(self):
+        """``sweep`` 'sweep' reports containers that were never started when it's a dry run"""
+        created = _container('sally')
+        created.status = 'created'
+        self._listed(created)
+
+        stats = sweep.sweep(self.docker_client, self.config, self.logger, dry_run=True)
+
+        self.assertFalse(created.remove.called)
+        self.assertFalse(self.fake_should_not_kill.called)
+        self.assertEqual(stats['orphaned'], 1)
+
+    def test_sweep_pool_disabled(self):
+        """``sweep`` 'sweep' removes idle containers left behind once the warm pool is disabled"""
+        idle = _container('{}abc'.format(pool.NAME_PREFIX))
+        self._listed(idle)
+
+        stats = sweep.sweep(self.docker_client, self.config, self.logger)
+
+        idle.remove.assert_called_with(force=True)
+        self.assertEqual(stats['removed'], 1)
+
+    def test_sweep_pool(self):
+        """``sweep`` 'sweep' leaves idle containers in the warm pool alone"""
+        self.config['pool']['size'] = '2'
+        self._listed(_container('{}abc'.format(pool.NAME_PREFIX)))
+
+        stats = sweep.sweep(self.docker_client, self.config, self.logger)
+
+        self.assertFalse(self.fake_reap.called)
+        self.assertEqual(stats['found'], 0)
+
+    def test_sweep_kept(self):
+        """``sweep`` 'sweep' counts the containers the persist rules kept, and the failures"""
+        self._listed(_container('sally'), _container('bob'))
+        self.fake_reap.side_effect = [False, None]
+
+        stats = sweep.sweep(self.docker_client, self.config, self.logger)
+
+        self.assertEqual(stats['kept'], 1)
+        self.assertEqual(stats['errors'], 1)
+
+    def test_sweep_parallel(self):
+        """``sweep`` 'sweep' removes containers in parallel, no more than reaper_slots at once"""
+        self.config['config']['reaper_slots'] = '2'
+        self._listed(*[_container('user{}'.format(index)) for index in range(6)])
+        self.fake_reap.side_effect = lambda *args, **kwargs: time.sleep(0.1) or True
+
+        began = time.monotonic()
+        stats = sweep.sweep(self.docker_client, self.config, self.logger)
+        elapsed = time.monotonic() - began
+
+        self.assertEqual(stats['removed'], 6)
+        self.assertTrue(0.3 <= elapsed < 0.6)
+
+    def test_dry_run(self):
+        """``sweep`` 'sweep' only reports what it would remove when it's a dry run"""
+        self._listed(_container('sally'), _container('bob'))
+        self.fake_should_not_kill.side_effect = [False, True]
+
+        stats = sweep.sweep(self.docker_client, self.config, self.logger, dry_run=True)
+
+        self.assertFalse(self.fake_reap.called)
+        self.assertEqual(stats['orphaned'], 1)
+        self.assertEqual(stats['kept'], 1)
+        self.fake_print.assert_any_call('Would remove sally (sally)')
+
+    def test_summary(self):
+        """``sweep`` 'sweep' logs how many containers it found, and how long teardowns took"""
+        self._listed(_container('sally'))
+
+        sweep.sweep(self.docker_client, self.config, self.logger)
+
+        message, dry_run, summary = self.logger.info.call_args[0]
+        self.assertEqual(message, 'Sweep dry_run=%s %s')
+        self.assertFalse(dry_run)
+        self.assertIn('removed=1', summary)
+        self.assertIn('teardown_count=1', summary)
+        self.assertIn('total=', summary)
+
+    def test_forget_sessions(self):
+        """``sweep`` 'sweep' deletes the session locks of containers that no longer exist"""
+        sessions = os.path.join(self.tmp_dir.name, 'sessions')
+        os.makedirs(sessions)
+        for name in ('gone.lock', 'gone.claimed', 'still-here.lock'):
+            open(os.path.join(sessions, name), 'w').close()
+        still_here = _container('sally')
+        still_here.id = 'still-here'
+        self.docker_client.containers.list.side_effect = [[], [still_here]]
+
+        sweep.sweep(self.docker_client, self.config, self.logger)
+
+        self.assertEqual(os.listdir(sessions), ['still-here.lock'])
+
+
+class TestHoldSession(unittest.TestCase):
+    """A suite of test cases for the ``hold_session`` function"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.config = _default()
+        self.config['config']['state_dir'] = self.tmp_dir.name
+        self.logger = MagicMock()
+
+    def tearDown(self):
+        """Runs after every test case"""
+        sweep._SESSIONS.close()
+        self.tmp_dir.cleanup()
+
+    def test_shared(self):
+        """``sweep`` 'hold_session' lets many sessions use the same container"""
+        sweep.hold_session(self.config, 'abc', self.logger)
+        sweep.hold_session(self.config, 'abc', self.logger)
+
+        self.assertFalse(self.logger.error.called)
+
+    def test_mark_claimed_unwritable(self):
+        """``sweep`` 'mark_claimed' logs, instead of failing the login, on errors"""
+        self.config['config']['state_dir'] = os.path.join(self.tmp_dir.name, 'file')
+        open(self.config['config']['state_dir'], 'w').close()
+
+        sweep.mark_claimed(self.config, 'abc', self.logger)
+
+        self.assertTrue(self.logger.error.called)
+
+    def test_unwritable(self):
+        """``sweep`` 'hold_session' logs, instead of failing the login, if the lock can't be made"""
+        self.config['config']['state_dir'] = os.path.join(self.tmp_dir.name, 'file')
+        open(self.config['config']['state_dir'], 'w').close()
+
+        sweep.hold_session(self.config, 'abc', self.logger)
+
+        self.assertTrue(self.logger.error.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,12 @@
 # -*- coding: UTF-8 -*-
 """A suite of unit tests for the ``utils.py`` module"""
 import unittest
-from unittest.mock import patch
+from unittest.mock import patch, MagicMock
 
+import os
+import time
 import logging
+import tempfile
 
 from container_shell.lib import utils
 
@@ -57,5 +60,133 @@ class TestUtils(unittest.TestCase):
         self.assertTrue(isinstance(logger, logging.Logger))
 
 
+class TestLazyImport(unittest.TestCase):
+    """A suite of test cases for the ``LazyImport`` object"""
+    @patch.object(utils.importlib, 'import_module')
+    def test_deferred(self, fake_import_module):
+        """``utils`` 'LazyImport' doesn't import the module until an attribute is used"""
+        utils.LazyImport('json')
+
+        self.assertFalse(fake_import_module.called)
+
+    def test_attribute(self):
+        """``utils`` 'LazyImport' proxies attributes to the imported module"""
+        lazy_json = utils.LazyImport('json')
+
+        self.assertEqual(lazy_json.dumps([1]), '[1]')
+
+    @patch.object(utils.importlib, 'import_module')
+    def test_imports_once(self, fake_import_module):
+        """``utils`` 'LazyImport' only imports the module once"""
+        lazy_json = utils.LazyImport('json')
+        lazy_json.dumps
+        lazy_json.loads
+
+        self.assertEqual(fake_import_module.call_count, 1)
+
+
+class TestPhaseTimer(unittest.TestCase):
+    """A suite of test cases for the ``PhaseTimer`` object"""
+    def test_phase(self):
+        """``utils`` PhaseTimer adds up every time a phase runs"""
+        timer = utils.PhaseTimer()
+        with patch.object(utils.time, 'monotonic') as fake_monotonic:
+            fake_monotonic.side_effect = [10, 11, 20, 22]
+            with timer.phase('lookup'):
+                pass
+            with timer.phase('lookup'):
+                pass
+
+        self.assertEqual(timer.phases['lookup'], 3)
+
+    def test_timed(self):
+        """``utils`` PhaseTimer 'timed' wraps a callable, and keeps its return value"""
+        timer = utils.PhaseTimer()
+
+        output = timer.timed('refresh', lambda x: x * 2)(21)
+
+        self.assertEqual(output, 42)
+        self.assertTrue('refresh' in timer.phases)
+
+    def test_mark(self):
+        """``utils`` PhaseTimer 'mark' only records the first time"""
+        timer = utils.PhaseTimer()
+        timer.mark('first_byte')
+        first = timer.phases['first_byte']
+        time.sleep(0.01)
+        timer.mark('first_byte')
+
+        self.assertEqual(timer.phases['first_byte'], first)
+
+    def test_log(self):
+        """``utils`` PhaseTimer 'log' writes a single record with the path and every phase"""
+        timer = utils.PhaseTimer()
+        timer.path = 'shared'
+        with timer.phase('lookup'):
+            pass
+        logger = MagicMock()
+
+        timer.log(logger)
+        timer.log(logger)
+        the_args, _ = logger.info.call_args
+        record = the_args[1]
+
+        self.assertEqual(logger.info.call_count, 1)
+        self.assertTrue(record.startswith('path=shared lookup='))
+        self.assertTrue(' total=' in record)
+
+
+class TestFileLock(unittest.TestCase):
+    """A suite of test cases for the ``file_lock`` context manager"""
+    def setUp(self):
+        """Runs before every test case"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.location = os.path.join(self.tmp_dir.name, 'locks', 'test.lock')
+
+    def tearDown(self):
+        """Runs after every test case"""
+        self.tmp_dir.cleanup()
+
+    def test_file_lock(self):
+        """``utils`` 'file_lock' yields True once the lock is obtained"""
+        with utils.file_lock(self.location) as locked:
+            self.assertTrue(locked)
+
+    def test_file_lock_held(self):
+        """``utils`` 'file_lock' yields False if non-blocking and the lock is already held"""
+        with utils.file_lock(self.location):
+            with utils.file_lock(self.location, blocking=False) as locked:
+                self.assertFalse(locked)
+
+    def test_file_lock_released(self):
+        """``utils`` 'file_lock' releases the lock upon exit"""
+        with utils.file_lock(self.location):
+            pass
+        with utils.file_lock(self.location, blocking=False) as locked:
+            self.assertTrue(locked)
+
+
+class TestDetach(unittest.TestCase):
+    """A suite of test cases for the ``detach`` function"""
+    def test_detach(self):
+        """``utils`` 'detach' runs the function in another process without waiting on it"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            location = os.path.join(tmp_dir, 'pid')
+
+            def record_pid():
+                with open(location, 'w') as the_file:
+                    the_file.write(str(os.getpid()))
+
+            utils.detach(record_pid)
+            deadline = time.time() + 5
+            while not os.path.exists(location) and time.time() < deadline:
+                time.sleep(0.01)
+            time.sleep(0.05)
+            with open(location) as the_file:
+                pid = int(the_file.read())
+
+        self.assertNotEqual(pid, os.getpid())
+
+
 if __name__ == '__main__':
     unittest.main()